@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 """chalilulz — agentic coding cli · openrouter · agent skills"""
 
-import argparse, glob as G, importlib.resources as resources, json, os, pathlib, re, shutil, subprocess, sys, threading, time, urllib.request, urllib.error
+import argparse, collections, contextlib, glob as G, hashlib, http.client, importlib.resources as resources, io, json, math, os, pathlib, re, shutil, socket, struct, subprocess, sys, threading, time, urllib.request, urllib.error, urllib.parse, zlib
 
 __version__ = "0.0.1b7"
 
@@ -71,32 +71,31 @@ def _get_default_args():
             "GEMINI_HOST", "https://generativelanguage.googleapis.com/v1beta/openai"
         )
         yes = conf.get("yes", False)
+        # context window override: int for every model, or {"provider:model": int}
+        context = conf.get("context") or {}
+        # failover chain tried in order when the current provider errors or stalls
+        fallback = conf.get("fallback") or []
+        failover_ttft = conf.get("failover_ttft", 20)
+        cooldown = conf.get("cooldown", 60)
+        keep_alive = conf.get("keep_alive", "30m")
+        # stream timeouts (s): tcp/tls connect, wait for the first token, gap between chunks
+        connect_timeout = conf.get("connect_timeout", 10)
+        first_byte_timeout = conf.get("first_byte_timeout", 120)
+        idle_timeout = conf.get("idle_timeout", 60)
+        # client-side limits: int for every provider, or {"provider": n}
+        rpm = conf.get("rpm") or {}
+        tpm = conf.get("tpm") or {}
+        # $ per million tokens: {"provider:model": [input, output, cached input]}
+        prices = conf.get("prices") or {}
 
     return DefaultArgs()
 
 
 # Set initial values (defaults for module-level usage, overridden by main())
 MODEL = "openrouter:arcee-ai/trinity-large-preview:free"
-# Parse provider from MODEL
-if MODEL.startswith("openrouter:"):
-    PROVIDER = "openrouter"
-    ACTUAL_MODEL = MODEL[len("openrouter:") :]
-elif MODEL.startswith("ollama:"):
-    PROVIDER = "ollama"
-    ACTUAL_MODEL = MODEL[len("ollama:") :]
-elif MODEL.startswith("mistral:"):
-    PROVIDER = "mistral"
-    ACTUAL_MODEL = MODEL[len("mistral:") :]
-elif MODEL.startswith("groq:"):
-    PROVIDER = "groq"
-    ACTUAL_MODEL = MODEL[len("groq:") :]
-elif MODEL.startswith("gemini:"):
-    PROVIDER = "gemini"
-    ACTUAL_MODEL = MODEL[len("gemini:") :]
-else:
-    PROVIDER = None
-    ACTUAL_MODEL = MODEL
+PROVIDER, _, ACTUAL_MODEL = MODEL.partition(":")
 KEY = ""
+OPENROUTER_HOST = "https://openrouter.ai/api/v1"
 OLLAMA_HOST = "http://localhost:11434"
 MISTRAL_KEY = ""
 MISTRAL_HOST = "https://api.mistral.ai/v1"
@@ -105,6 +104,109 @@ GROQ_HOST = "https://api.groq.com/openai/v1"
 GEMINI_KEY = ""
 GEMINI_HOST = "https://generativelanguage.googleapis.com/v1beta/openai"
 AUTO_APPROVE = False
+INTERACTIVE = True  # False in headless mode: never prompt on stdin
+EVENTS = None  # file receiving ndjson events (headless --json), see _emit
+CTX_OVERRIDE = {}  # "provider:model" or "*" → context window (tokens)
+FALLBACK = []  # ordered "provider:model" failover chain
+FAILOVER_TTFT = 20  # s to wait for a first token before failing over
+COOLDOWN = 60  # s a failed provider is skipped
+KEEP_ALIVE = "30m"  # how long ollama keeps the model loaded after a request
+CONNECT_TIMEOUT = 10  # s to establish the tcp/tls connection
+FIRST_BYTE_TIMEOUT = 120  # s from request sent to the first token
+IDLE_TIMEOUT = 60  # s allowed between chunks once streaming
+RECORD_DIR = None  # save every provider stream here (see _urlopen)
+REPLAY_DIR = None  # serve provider streams from recordings instead of the network
+REPLAY_TIMING = False  # replay with the recorded connect/chunk timing
+# requests/min and tokens/min per provider ("*" for any), shared by every process
+# using the same RATE_DIR (default <data dir>/rate) and api key
+RATE_DIR = os.getenv("CHALILULZ_RATE_DIR")
+RATE_LIMIT = json.loads(os.getenv("CHALILULZ_RPM") or "{}")
+TOKEN_LIMIT = json.loads(os.getenv("CHALILULZ_TPM") or "{}")
+
+# ─ session state
+# per-session settings an Agent carries. the upper-cased module globals are their
+# defaults, and are what every function uses when no Agent is active on the thread
+_SETTINGS = (
+    "model",
+    "provider",
+    "actual_model",
+    "key",
+    "openrouter_host",
+    "ollama_host",
+    "mistral_key",
+    "mistral_host",
+    "groq_key",
+    "groq_host",
+    "gemini_key",
+    "gemini_host",
+    "auto_approve",
+    "interactive",
+    "events",
+    "ctx_override",
+    "fallback",
+    "failover_ttft",
+    "cooldown",
+    "keep_alive",
+    "connect_timeout",
+    "first_byte_timeout",
+    "idle_timeout",
+    "record_dir",
+    "replay_dir",
+    "replay_timing",
+    "no_tools_models",
+    "stats",
+    "budget",
+    "sp",
+)
+_LOCAL = threading.local()
+
+
+class _Module:
+    """the module globals seen through the Agent attribute names (the legacy session)"""
+
+    cwd = None  # tools resolve paths against the process cwd
+    out = None  # transcript goes to sys.stdout
+    session = None  # no ledger session id
+    log = None  # messages are not logged
+    approve = None  # gated tools prompt on the terminal
+    ttft_limit = None  # set by call_api for each failover attempt
+    cancelled = False  # set by Agent.cancel from another thread
+    live = None  # the response being streamed, for Agent.cancel to cut off
+
+    def __getattr__(self, k):
+        return globals()[k.upper()]
+
+    def __setattr__(self, k, v):
+        if k in type(self).__dict__:  # per-session state, not a setting
+            object.__setattr__(self, k, v)
+        else:
+            globals()[k.upper()] = v
+
+
+_MODULE = _Module()
+
+
+def _ag():
+    """the Agent active on this thread, else the module-level session"""
+    return getattr(_LOCAL, "agent", None) or _MODULE
+
+
+def _out():
+    """where the active session's transcript goes"""
+    return _ag().out or sys.stdout
+
+
+def _spawn(fn):
+    """run fn in a daemon thread with the caller's session active"""
+    ag = getattr(_LOCAL, "agent", None)
+
+    def _run():
+        _LOCAL.agent = ag
+        fn()
+
+    t = threading.Thread(target=_run, daemon=True)
+    t.start()
+    return t
 
 
 def _r(a):
@@ -230,7 +332,7 @@ def _b(a):
         ) as p:
             out = []
             for ln in iter(p.stdout.readline, ""):
-                print(f"  {D}│{ln.rstrip()}{R}", flush=True)
+                print(f"  {D}│{ln.rstrip()}{R}", file=_out(), flush=True)
                 out.append(ln)
             try:
                 p.wait(timeout=120)
@@ -314,27 +416,35 @@ def _fd(a):
 def _sk(a):
     """load full skill body by name"""
     name = a["name"]
-    sd = _skill_dirs()
-    for d in sd:
-        sm = d / name / "SKILL.md"
-        if sm.exists():
-            try:
-                body = sm.read_text(encoding="utf-8")
-                # strip frontmatter
-                if body.startswith("---"):
-                    end = body.find("---", 3)
-                    body = body[end + 3 :].strip() if end > 0 else body
-                # also load scripts listing
-                sc = d / name / "scripts"
-                extra = ""
-                if sc.is_dir():
-                    extra = "\n\nScripts:\n" + "\n".join(
-                        str(p) for p in sc.rglob("*") if p.is_file()
-                    )
-                return body + extra
-            except Exception as e:
-                return f"error:{e}"
-    return f"skill '{name}' not found"
+    sd = _skill_index(check=False)["skills"].get(name)
+    if sd is None or not (sd / "SKILL.md").is_file():  # new or moved since discovery
+        sd = _skill_index()["skills"].get(name)
+    if sd is None:
+        return f"skill '{name}' not found"
+    try:
+        body = (sd / "SKILL.md").read_text(encoding="utf-8")
+        # strip frontmatter
+        if body.startswith("---"):
+            end = body.find("---", 3)
+            body = body[end + 3 :].strip() if end > 0 else body
+        # also load scripts listing
+        scripts = _skill_scripts(sd)
+        extra = "\n\nScripts:\n" + "\n".join(scripts) if scripts else ""
+        return body + extra
+    except Exception as e:
+        return f"error:{e}"
+
+
+def _ss(a):
+    """find skills by keywords (bm25 over name, description and body)"""
+    skills = load_skills()
+    scores = bm25(_terms(a["query"]), _skill_docs(skills))
+    hits = sorted(
+        (i for i, sc in enumerate(scores) if sc > 0), key=lambda i: -scores[i]
+    )[:10]
+    return "\n".join(
+        f"{skills[i]['name']}: {skills[i]['desc'][:160]}" for i in hits
+    ) or (f"no skills match '{a['query']}'")
 
 
 # (desc, params{k:type}, fn)
@@ -373,6 +483,11 @@ TOOLS = {
     "cp": ("Copy file or dir", {"src": "string", "dest": "string"}, _cp),
     "find": ("rglob find by name pattern", {"pat": "string", "path": "string"}, _fd),
     "load_skill": ("Load full skill instructions by name", {"name": "string"}, _sk),
+    "search_skills": (
+        "Find skills not listed in the prompt by keywords",
+        {"query": "string"},
+        _ss,
+    ),
 }
 # optional params (types without required enforcement)
 OPT = {"offset", "limit", "cwd", "all"}
@@ -416,44 +531,280 @@ SCHEMA = mk_schema()
 
 
 # Provider handling
+# name → (call fn, auth scheme, key var, base url var). fn and vars are resolved by
+# name at call time (vars on the active session, see _ag) so cli flags set in main()
+# and test patches take effect.
+PROVIDERS = {
+    "openrouter": ("call_openrouter", "Bearer", "KEY", "OPENROUTER_HOST"),
+    "ollama": ("call_ollama", None, None, "OLLAMA_HOST"),
+    "mistral": ("call_mistral", "Bearer", "MISTRAL_KEY", "MISTRAL_HOST"),
+    "groq": ("call_groq", "Bearer", "GROQ_KEY", "GROQ_HOST"),
+    "gemini": ("call_gemini", "x-goog-api-key", "GEMINI_KEY", "GEMINI_HOST"),
+}
+
+
 def parse_model(model_str):
     """Parse provider prefix from model string. Returns (provider, model_id)."""
     prefix, sep, rest = model_str.partition(":")
-    if sep and prefix in ["ollama", "mistral", "groq", "gemini", "openrouter"]:
+    if sep and prefix in PROVIDERS:
         return prefix, rest
     # No prefix: default to ollama
     return "ollama", model_str
 
 
 def update_model(model_str):
-    """Update global MODEL, PROVIDER, ACTUAL_MODEL."""
-    global MODEL, PROVIDER, ACTUAL_MODEL
-    MODEL = model_str
-    PROVIDER, ACTUAL_MODEL = parse_model(model_str)
+    """Update the session's model, provider and actual model."""
+    a = _ag()
+    a.model = model_str
+    a.provider, a.actual_model = parse_model(model_str)
+    # start in the right tool mode instead of rediscovering it with a failed request
+    if get_caps(a.provider, a.actual_model).get("tools") is False:
+        a.no_tools_models.add(a.actual_model)
 
 
 def get_required_key(provider):
     """Return the API key variable for the given provider, or None if no key needed."""
-    if provider == "openrouter":
-        return KEY
-    elif provider == "mistral":
-        return MISTRAL_KEY
-    elif provider == "groq":
-        return GROQ_KEY
-    elif provider == "gemini":
-        return GEMINI_KEY
-    elif provider == "ollama":
+    spec = PROVIDERS.get(provider)
+    if not spec or not spec[2]:
+        return None
+    return getattr(_ag(), spec[2].lower())
+
+
+# ─ capability cache: what we learned about each provider:model, kept across runs
+CAPS_TTL = 7 * 86400
+
+
+def _data_dir():
+    d = os.environ.get("CHALILULZ_HOME")
+    return (
+        pathlib.Path(d) if d else pathlib.Path.home() / ".local" / "share" / "chalilulz"
+    )
+
+
+def _caps_path():
+    return _data_dir() / "caps.json"
+
+
+_JSON = {}  # path → ((mtime, size), data): re-read only when the file changes
+
+
+def _load_json(p):
+    """contents of a json file we maintain, cached until it changes; {} if unreadable"""
+    try:
+        st = p.stat()
+        sig = (st.st_mtime_ns, st.st_size)
+        hit = _JSON.get(p)
+        if hit and hit[0] == sig:
+            return hit[1]
+        data = json.loads(p.read_text(encoding="utf-8"))
+        _JSON[p] = (sig, data)
+        return data
+    except Exception:
+        return {}
+
+
+def _write_atomic(p, data):
+    """replace p with data (str or bytes) in one step, through a temp file no other
+    process or thread writes"""
+    p.parent.mkdir(parents=True, exist_ok=True)
+    tmp = p.with_name(f".{p.name}.{os.getpid()}.{threading.get_ident()}")
+    try:
+        tmp.write_bytes(data.encode() if isinstance(data, str) else data)
+        os.replace(tmp, p)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            tmp.unlink()
+        raise
+
+
+def _update_json(p, fn):
+    """read-modify-write p under its lock file, so concurrent writers (batch workers,
+    daemon threads) don't drop each other's entries. fn gets the current contents
+    and returns the new ones, or None to leave the file alone"""
+    with _locked(p.with_name(p.name + ".lock")):
+        data = fn(_load_json(p))
+        if data is not None:
+            _write_atomic(p, json.dumps(data))
+
+
+def _load_caps():
+    return _load_json(_caps_path())
+
+
+def get_caps(provider, model):
+    """cached capabilities for provider:model ({} if unknown or older than CAPS_TTL)"""
+    c = _load_caps().get(f"{provider}:{model}")
+    if not c or time.time() - c.get("ts", 0) > CAPS_TTL:
+        return {}
+    return c
+
+
+def set_caps(provider, model, **kw):
+    """merge kw (tools, ctx, quirks…) into the cache entry; no write if nothing changed"""
+    c = get_caps(provider, model)
+    if c and all(c.get(f) == v for f, v in kw.items()):
+        return
+
+    def merge(caps):
+        k = f"{provider}:{model}"
+        c = caps.get(k) or {}
+        if time.time() - c.get("ts", 0) > CAPS_TTL:
+            c = {}
+        return dict(caps, **{k: dict(c, **kw, ts=time.time())})
+
+    try:
+        _update_json(_caps_path(), merge)
+    except Exception:
+        pass
+
+
+# ─ context budget: sized from each model's context window
+DEFAULT_CTX = 65536
+
+
+def budget(ctx):
+    """split a context window into history / output reserve / per-tool-result limits"""
+    reserve = min(8192, ctx // 4)
+    history = ctx - reserve
+    return {
+        "ctx": ctx,
+        "reserve": reserve,
+        "history": history,
+        "tool_chars": min(100000, max(2000, history // 8 * 4)),
+    }
+
+
+BUDGET = budget(DEFAULT_CTX)
+
+
+def _fetch_ctx(provider, model):
+    """ask the provider for the model's context window; None if it won't say"""
+    a = _ag()
+    if a.replay_dir:
         return None
+    try:
+        if provider == "ollama":
+            req = urllib.request.Request(
+                a.ollama_host.rstrip("/") + "/api/show",
+                data=json.dumps({"model": model}).encode(),
+                headers={"Content-Type": "application/json"},
+                method="POST",
+            )
+            with _OPENER.open(req, timeout=5) as r:
+                info = json.loads(r.read()).get("model_info", {})
+            vals = [v for k, v in info.items() if k.endswith(".context_length")]
+            return int(vals[0]) if vals else None
+        _, auth, key_var, host_var = PROVIDERS[provider]
+        key = getattr(a, key_var.lower())
+        hdr = {"x-goog-api-key": key} if auth == "x-goog-api-key" else {}
+        if auth == "Bearer":
+            hdr["Authorization"] = f"Bearer {key}"
+        host = getattr(a, host_var.lower())
+        req = urllib.request.Request(host.rstrip("/") + "/models", headers=hdr)
+        with _OPENER.open(req, timeout=5) as r:
+            data = json.loads(r.read()).get("data", [])
+        for m in data:
+            if m.get("id") == model:
+                pr = m.get("pricing") or {}
+                try:  # openrouter lists $ per token
+                    price = [float(pr[f]) * 1e6 for f in ("prompt", "completion")]
+                    price.append(
+                        float(pr.get("input_cache_read") or price[0] / 1e6) * 1e6
+                    )
+                    set_caps(provider, model, price=price)
+                except (KeyError, TypeError, ValueError):
+                    pass
+                for f in ("context_length", "context_window", "max_context_length"):
+                    if m.get(f):
+                        return int(m[f])
+    except Exception:
+        pass
     return None
 
 
+def model_ctx(provider, model, fetch=True):
+    """context window: config override → cached metadata → provider api → DEFAULT_CTX"""
+    over = _ag().ctx_override
+    n = over.get(f"{provider}:{model}") or over.get("*")
+    if n:
+        return int(n)
+    n = get_caps(provider, model).get("ctx")
+    if n or not fetch:
+        return n or DEFAULT_CTX
+    n = _fetch_ctx(provider, model)
+    if n:
+        set_caps(provider, model, ctx=n)
+    return n or DEFAULT_CTX
+
+
+def refresh_budget():
+    """resize the session budget for its model; network lookups run in the background"""
+    a = _ag()
+    prov, model = a.provider, a.actual_model
+    a.budget = budget(model_ctx(prov, model, fetch=False))
+    if a.ctx_override or get_caps(prov, model).get("ctx"):
+        return
+
+    def _bg():
+        n = model_ctx(prov, model)
+        if (a.provider, a.actual_model) == (prov, model):  # not switched meanwhile
+            a.budget = budget(n)
+
+    _spawn(_bg)
+
+
+def truncate_history(msgs, limit, keep=5):
+    """drop oldest messages until ~tokens ≤ limit; returns number dropped"""
+    sizes = [len(json.dumps(m)) for m in msgs]
+    total = sum(sizes) + 2 * len(sizes)
+    n = 0
+    while total // 4 > limit and len(msgs) > keep:
+        msgs.pop(0)
+        total -= sizes[n] + 2
+        n += 1
+    return n
+
+
+def _clip(res):
+    """cap a tool result at the current budget so one huge read can't evict the history"""
+    res = str(res)
+    lim = _ag().budget["tool_chars"]
+    if len(res) <= lim:
+        return res
+    return res[:lim] + f"\n…[truncated {len(res) - lim} chars]"
+
+
+def _in_cwd(name, args, cwd):
+    """resolve a tool's relative paths against a session cwd"""
+    args = dict(args)
+    for k in ("path", "src", "dest", "cwd"):
+        v = args.get(k)
+        if isinstance(v, str) and v and not os.path.isabs(v):
+            args[k] = os.path.join(cwd, v)
+    if not args.get("path") and "path" in TOOLS[name][1]:
+        args["path"] = cwd
+    if name == "bash" and not args.get("cwd"):
+        args["cwd"] = cwd
+    return args
+
+
 def run_tool(name, args):
     if name not in TOOLS:
         return f"error:unknown tool {name!r}"
-    if not AUTO_APPROVE and name in ("bash", "write", "edit", "rm", "mv", "cp"):
-        print(f"\n {Y}⚠ Tool '{name}' requested with args: {args}{R}")
-        ans = input(f" {Bo}Allow? [y/N]: {R}").strip().lower()
-        if ans not in ("y", "yes"):
+    a = _ag()
+    if a.cwd:
+        args = _in_cwd(name, args, a.cwd)
+    if not a.auto_approve and name in ("bash", "write", "edit", "rm", "mv", "cp"):
+        if a.approve:
+            ok = a.approve(name, args)
+        elif not a.interactive:
+            return "error:tool denied (headless; pass --yes to allow)"
+        else:
+            out = _out()
+            print(f"\n {Y}⚠ Tool '{name}' requested with args: {args}{R}", file=out)
+            print(f" {Bo}Allow? [y/N]: {R}", end="", file=out, flush=True)
+            ok = input().strip().lower() in ("y", "yes")
+        if not ok:
             return "error:user denied tool execution"
     return TOOLS[name][2](args)
 
@@ -473,42 +824,102 @@ def _get_bundled_skills_dir():
         return None
 
 
-def _ensure_global_skills():
-    """Install bundled skills to global location on first run."""
-    bundled = _get_bundled_skills_dir()
-    if not bundled:
-        return  # Not installed as package or no bundled skills
+def _bundle_files(d, pre=""):
+    """relative posix path → file, for every file under a bundled (Traversable) dir"""
+    out = {}
+    for p in d.iterdir():
+        if p.is_dir():
+            out.update(_bundle_files(p, f"{pre}{p.name}/"))
+        elif p.is_file():
+            out[pre + p.name] = p
+    return out
 
-    global_dir = pathlib.Path.home() / ".local" / "share" / "chalilulz" / "skills"
-    marker = global_dir / ".installed"
 
-    # Skip if already installed
-    if marker.exists():
-        return
+def _sha(data):
+    return hashlib.sha256(data).hexdigest()
 
-    # Create directory
-    global_dir.mkdir(parents=True, exist_ok=True)
 
-    # Copy each skill
-    for skill_src in bundled.iterdir():
-        if not skill_src.is_dir():
-            continue
-        skill_dst = global_dir / skill_src.name
-        if skill_dst.exists():
-            shutil.rmtree(skill_dst)
-        shutil.copytree(skill_src, skill_dst)
+def _file_sha(path):
+    try:
+        return _sha(path.read_bytes())
+    except OSError:
+        return None
+
+
+def _ensure_global_skills():
+    """Sync bundled skills to the global location once per package version.
+
+    .manifest.json records the hash of every file installed, so an upgrade only
+    rewrites files that changed and leaves alone any skill the user has edited.
+    installs from before the manifest (the .installed marker) have no record, so
+    there a skill whose files differ from the bundle is taken to be the user's;
+    deleting it brings the bundled one back. The normal startup path is one stat
+    of the .synced-<version> marker."""
+    global_dir = _data_dir() / "skills"
+    stamp = global_dir / f".synced-{__version__}"
+    if stamp.exists():
+        return
+    bundled = _get_bundled_skills_dir()
+    if not bundled:
+        return  # Not installed as package or no bundled skills
 
-    # Create marker file
-    marker.touch()
+    # Lock so concurrent first runs (e.g. batch workers) don't copy over each other
+    with _locked(global_dir / ".lock"):
+        if stamp.exists():
+            return
+        mpath = global_dir / ".manifest.json"
+        try:
+            old = json.loads(mpath.read_text(encoding="utf-8"))["files"]
+        except (OSError, ValueError, KeyError):
+            old = None  # first install, or one from before the manifest
+        files = {r: (p, p.read_bytes()) for r, p in _bundle_files(bundled).items()}
+        new = {r: _sha(b) for r, (_, b) in files.items()}
+        manifest = {}
+        for skill in {r.split("/")[0] for r in (*new, *(old or ()))}:
+            # without a manifest, compare against the bundle: what differs is the user's
+            base = new if old is None else old
+            mine = {r: h for r, h in base.items() if r.split("/")[0] == skill}
+            theirs = {r: h for r, h in new.items() if r.split("/")[0] == skill}
+            edited = any(
+                _file_sha(global_dir / r) not in (h, None) for r, h in mine.items()
+            )
+            if edited:
+                manifest.update(
+                    mine
+                )  # user's copy wins, and still counts as edited next time
+                continue
+            for r, h in theirs.items():
+                dst = global_dir / r
+                if _file_sha(dst) != h:
+                    dst.parent.mkdir(parents=True, exist_ok=True)
+                    tmp = dst.with_name(f".{dst.name}.{os.getpid()}")
+                    src, data = files[r]
+                    tmp.write_bytes(data)
+                    if isinstance(src, pathlib.Path):
+                        shutil.copymode(src, tmp)  # keeps scripts executable
+                    os.replace(tmp, dst)
+            for r in set(mine) - set(theirs):  # dropped from the package
+                with contextlib.suppress(OSError):
+                    (global_dir / r).unlink()
+            if not theirs:
+                for d, _, _ in sorted(os.walk(global_dir / skill), reverse=True):
+                    with contextlib.suppress(OSError):
+                        os.rmdir(d)  # only removes what is now empty
+            manifest.update(theirs)
+        _write_atomic(mpath, json.dumps({"version": __version__, "files": manifest}))
+        for m in [*global_dir.glob(".synced-*"), global_dir / ".installed"]:
+            with contextlib.suppress(OSError):
+                m.unlink()
+        stamp.touch()
 
 
 # ─ agent skills (agentskills.io spec)
-def _skill_dirs():
-    _ensure_global_skills()  # Install bundled skills if needed
-
-    cands = [pathlib.Path(os.getcwd())]
+def _skill_candidates():
+    """every location skills may live in, nearest first (most need not exist)"""
+    cwd = pathlib.Path(_ag().cwd or os.getcwd())
+    cands = [cwd]
     # walk up to repo root looking for skills (agentskills.io spec locations)
-    p = pathlib.Path(os.getcwd())
+    p = cwd
     while True:
         cands.append(p / ".agents" / "skills")
         cands.append(p / ".github" / "skills")
@@ -523,9 +934,63 @@ def _skill_dirs():
         pathlib.Path.home() / ".github" / "skills",
         pathlib.Path.home() / ".claude" / "skills",
         pathlib.Path.home() / ".local" / "share" / "agent-skills",
-        pathlib.Path.home() / ".local" / "share" / "chalilulz" / "skills",
+        _data_dir() / "skills",
     ]
-    return [d for d in cands if d.is_dir()]
+    return cands
+
+
+def _skill_dirs():
+    _ensure_global_skills()  # Install bundled skills if needed
+    return [d for d in _skill_candidates() if d.is_dir()]
+
+
+# discovery cache: (cwd, data dir, dir finder) → skill roots, name → skill dir, and the
+# mtimes of every directory whose change could add, remove or shadow a skill
+_SKILL_INDEX = {}
+
+
+def _mtimes(paths):
+    out = []
+    for p in paths:
+        try:
+            out.append(p.stat().st_mtime_ns)
+        except OSError:
+            out.append(None)
+    return out
+
+
+def _skill_index(check=True):
+    """skill roots and name → skill dir for the active session's cwd. with check, the
+    cached copy is revalidated against directory mtimes; without, it is trusted"""
+    key = (_ag().cwd or os.getcwd(), str(_data_dir()))
+    hit = _SKILL_INDEX.get(key)
+    if hit and (not check or _mtimes(hit["watch"]) == hit["sig"]):
+        return hit
+    dirs = _skill_dirs()
+    skills = {}
+    for d in dirs:
+        try:
+            for sd in sorted(d.iterdir()):
+                if sd.name not in skills and (sd / "SKILL.md").is_file():
+                    skills[sd.name] = sd
+        except OSError:
+            pass
+    # the roots themselves (skills added/removed), every dir in them (a SKILL.md written
+    # into one) and the dirs roots may appear in; not the data dir, which our own caches
+    # rewrite (its skills/ is ours anyway)
+    subs = []
+    for d in dirs:
+        with contextlib.suppress(OSError):
+            subs += [sd for sd in sorted(d.iterdir()) if sd.is_dir()]
+    parents = [c.parent for c in _skill_candidates()] + [d.parent for d in dirs]
+    watch = list(dict.fromkeys(dirs + [p for p in subs + parents if p != _data_dir()]))
+    hit = _SKILL_INDEX[key] = {
+        "dirs": dirs,
+        "skills": skills,
+        "watch": watch,
+        "sig": _mtimes(watch),
+    }
+    return hit
 
 
 def _parse_frontmatter(text):
@@ -543,24 +1008,84 @@ def _parse_frontmatter(text):
     return fm
 
 
+# on-disk skill index: SKILL.md path → (mtime, size) and its frontmatter, scripts/ dir
+# → its file listing and the mtimes of the dirs it was built from. unchanged skills
+# are not opened at all on later starts
+
+
+def _skill_meta_path():
+    return _data_dir() / "skill-index.json"
+
+
+def _load_skill_meta():
+    return _load_json(_skill_meta_path())
+
+
+def _save_skill_meta(idx):
+    """merge idx into the on-disk index (entries are revalidated by mtime, so a stale
+    one only costs a re-read), forgetting skills that are gone"""
+    try:
+        _update_json(
+            _skill_meta_path(),
+            lambda cur: {
+                k: v for k, v in dict(cur, **idx).items() if os.path.exists(k)
+            },
+        )
+    except Exception:
+        pass
+
+
+def _read_frontmatter(path):
+    """frontmatter of a SKILL.md, reading only up to its closing ---"""
+    with open(path, "rb") as f:  # lines are decoded one by one; the body never is
+        lines = [f.readline()]
+        if not lines[0].startswith(b"---"):
+            return {}
+        for ln in f:
+            lines.append(ln)
+            if b"---" in ln:
+                break
+    return _parse_frontmatter(b"".join(lines).decode("utf-8").replace("\r\n", "\n"))
+
+
+def _skill_scripts(sd):
+    """files under a skill's scripts/, listed once and revalidated by dir mtimes"""
+    idx = _load_skill_meta()
+    key = str(sd / "scripts")
+    e = idx.get(key)
+    if e and _mtimes([pathlib.Path(d) for d in e["dirs"]]) == e["sig"]:
+        return e["files"]
+    dirs, files = [sd], []  # a new scripts/ shows up in the skill dir's mtime
+    for root, _, fs in os.walk(key):
+        dirs.append(pathlib.Path(root))
+        files += [os.path.join(root, f) for f in fs]
+    files.sort()
+    e = {"dirs": [str(d) for d in dirs], "sig": _mtimes(dirs), "files": files}
+    _save_skill_meta(dict(idx, **{key: e}))
+    return files
+
+
 def load_skills():
     """returns list of (name,description,path,full_loaded) — only name+desc at startup"""
-    found = {}
-    for sd in _skill_dirs():
-        for skill_dir in sd.iterdir():
-            if not skill_dir.is_dir():
-                continue
+    found = []
+    idx, dirty = dict(_load_skill_meta()), False
+    for skill_dir in _skill_index()["skills"].values():
+        try:
             sm = skill_dir / "SKILL.md"
-            if not sm.exists() or skill_dir.name in found:
+            st = sm.stat()
+            sig = [st.st_mtime_ns, st.st_size]
+            e = idx.get(str(sm))
+            if not e or e.get("sig") != sig:
+                e = idx[str(sm)] = {"sig": sig, "fm": _read_frontmatter(sm)}
+                dirty = True
+            fm = e["fm"]
+            if "name" not in fm or "description" not in fm:
                 continue
-            try:
-                fm = _parse_frontmatter(sm.read_text(encoding="utf-8"))
-                if "name" not in fm or "description" not in fm:
-                    continue
-                # validate dir name matches frontmatter name (agentskills.io spec)
-                if fm["name"] != skill_dir.name:
-                    continue
-                found[skill_dir.name] = {
+            # validate dir name matches frontmatter name (agentskills.io spec)
+            if fm["name"] != skill_dir.name:
+                continue
+            found.append(
+                {
                     "name": fm["name"],
                     "desc": fm["description"],
                     "path": str(skill_dir),
@@ -568,12 +1093,16 @@ def load_skills():
                     "allowed_tools": fm.get("allowed-tools", ""),
                     "compatibility": fm.get("compatibility", ""),
                 }
-            except:
-                pass
-    return list(found.values())
+            )
+        except:
+            pass
+    if dirty:
+        _save_skill_meta(idx)
+    return found
 
 
-def skills_prompt(skills):
+def skills_prompt(skills, more=0):
+    """the skills section; more = how many further skills search_skills can find"""
     if not skills:
         return ""
     lines = ["\n## Available Skills (use load_skill to activate full instructions):"]
@@ -586,9 +1115,89 @@ def skills_prompt(skills):
         if s.get("compatibility"):
             parts.append(f"  Compat: {s['compatibility']}")
         lines.append("\n".join(parts))
+    if more:
+        lines.append(f"- …and {more} more: use search_skills to find them")
     return "\n".join(lines)
 
 
+# ─ skill ranking: with many skills, only those relevant to the turn are listed
+SKILLS_TOP_K = 8
+_STOP = set(
+    "a an and are as at be by can do for from how if in into is it its of on or so that the "
+    "then this to use used using when with you your".split()
+)
+
+
+def _terms(text):
+    return [
+        t
+        for t in re.findall(r"[a-z0-9]+", text.lower())
+        if len(t) > 1 and t not in _STOP
+    ]
+
+
+def bm25(query, docs, k1=1.5, b=0.75):
+    """okapi bm25 score of each doc (a list of terms) for the query terms"""
+    if not docs:
+        return []
+    avg = sum(len(d) for d in docs) / len(docs) or 1
+    df = collections.Counter(t for d in docs for t in set(d))
+    q = set(query)
+    idf = {
+        t: math.log(1 + (len(docs) - df[t] + 0.5) / (df[t] + 0.5)) for t in q if df[t]
+    }
+    out = []
+    for d in docs:
+        tf = collections.Counter(t for t in d if t in idf)
+        norm = k1 * (1 - b + b * len(d) / avg)
+        out.append(sum(idf[t] * n * (k1 + 1) / (n + norm) for t, n in tf.items()))
+    return out
+
+
+def _skill_docs(skills):
+    """ranking terms per skill: name ×3, description ×2, then the skill body's most
+    frequent terms, which are kept in the skill index next to the frontmatter"""
+    idx, dirty, docs = _load_skill_meta(), False, []
+    for s in skills:
+        sm = str(pathlib.Path(s["path"]) / "SKILL.md")
+        e = idx.get(sm)
+        kw = e.get("kw") if e else None
+        if kw is None:
+            try:
+                text = pathlib.Path(sm).read_text(encoding="utf-8", errors="replace")
+            except OSError:
+                text = ""
+            end = text.find("---", 3) if text.startswith("---") else -1
+            kw = [
+                t
+                for t, _ in collections.Counter(
+                    _terms(text[end + 3 :] if end > 0 else text)
+                ).most_common(30)
+            ]
+            if e:
+                idx, dirty = dict(idx, **{sm: dict(e, kw=kw)}), True
+        docs.append(_terms(s["name"]) * 3 + _terms(s["desc"]) * 2 + kw)
+    if dirty:
+        _save_skill_meta(idx)
+    return docs
+
+
+def pick_skills(skills, query, k=None):
+    """up to k skills matching query, best first but returned in discovery order so the
+    prompt text only changes when the set does. all of them when there are no more
+    than k; None when nothing matches"""
+    k = SKILLS_TOP_K if k is None else k
+    if len(skills) <= k:
+        return skills
+    scores = bm25(_terms(query or ""), _skill_docs(skills))
+    if not any(scores):
+        return None
+    top = sorted(
+        (i for i, sc in enumerate(scores) if sc > 0), key=lambda i: -scores[i]
+    )[:k]
+    return [skills[i] for i in sorted(top)]
+
+
 # ─ spinner
 class Spin:
     F = "⠋⠙⠹⠸⠼⠴⠦⠧⠇⠏"
@@ -596,9 +1205,13 @@ class Spin:
     def __init__(self):
         self._e = threading.Event()
         self._t = None
+        self.on = True
 
     def start(self, msg="Thinking"):
+        if not self.on:
+            return
         self._e.clear()
+        out = _out()
 
         def _r(i=0):
             w = len(msg) + 14
@@ -606,11 +1219,12 @@ class Spin:
                 print(
                     f"\r {C}{self.F[i % 10]}{R} {D}{I}{msg}{R}{D}…{R}",
                     end="",
+                    file=out,
                     flush=True,
                 )
                 i += 1
-                time.sleep(0.08)
-            print(f"\r{' ' * w}\r", end="", flush=True)
+                self._e.wait(0.08)  # wakes immediately on stop()
+            print(f"\r{' ' * w}\r", end="", file=out, flush=True)
 
         self._t = threading.Thread(target=_r, daemon=True)
         self._t.start()
@@ -644,164 +1258,720 @@ Available tools:\n""" + "\n".join(
 )
 # ─ api
 NO_TOOLS_MODELS = set()
+# per-round latency records for the current session (see fmt_timing)
+STATS = []
+# appended to history when a reply or tool run is cut short by Ctrl-C
+INTERRUPTED = "[interrupted by user]"
+
+
+def _emit(type, **kw):
+    """write one ndjson event to the session's events file (no-op unless set)"""
+    ev = _ag().events
+    if ev is None:
+        return
+    ev.write(json.dumps(dict(type=type, **kw), default=str) + "\n")
+    ev.flush()
+
+
+def _timing(tm, t_first, t_end, tokens, text=""):
+    """fill ttft/total/tok/s into tm; tokens falls back to a ~4 chars/token estimate"""
+    t0 = tm.pop("start", t_end)
+    tm["total"] = t_end - t0
+    if t_first is not None:
+        tm["ttft"] = t_first - t0
+        n = tokens or len(text) // 4
+        gen = t_end - t_first
+        if n and gen > 0 and "tps" not in tm:
+            tm["tps"] = n / gen
+    return tm
+
+
+def fmt_timing(usage, tm):
+    """compact one-line usage + latency summary for a round"""
+    parts = []
+    if usage:
+        parts.append(
+            f"↑{usage.get('prompt_tokens', '-')} ↓{usage.get('completion_tokens', '-')}"
+        )
+    for k, lbl in (("connect", "conn"), ("load", "load"), ("ttft", "ttft")):
+        if tm.get(k) is not None:
+            parts.append(f"{lbl} {tm[k]:.2f}s")
+    if tm.get("tps"):
+        parts.append(f"{tm['tps']:.1f} tok/s")
+    if tm.get("tools"):
+        parts.append(f"tools {tm['tools']:.2f}s")
+    return " · ".join(parts)
+
+
+def stats_summary(stats):
+    """aggregate per-round records: where did the time go this session"""
+    if not stats:
+        return {}
+
+    def avg(k):
+        v = [s[k] for s in stats if s.get(k) is not None]
+        return sum(v) / len(v) if v else None
+
+    return {
+        "rounds": len(stats),
+        "connect": avg("connect"),
+        "ttft": avg("ttft"),
+        "tps": avg("tps"),
+        "model": sum(s.get("total", 0) for s in stats),
+        "tools": sum(s.get("tools", 0) for s in stats),
+    }
+
+
+class ProviderError(RuntimeError):
+    """failure another provider may not share: connect error, 429/5xx, stalled first token"""
+
+
+class _Timeout:
+    """a stream timeout; phase is connect | first_byte | idle"""
+
+    def __init__(self, phase, limit):
+        self.phase, self.limit = phase, limit
+        what = {
+            "connect": "connect",
+            "first_byte": "no first token",
+            "idle": "stream stalled",
+        }
+        super().__init__(f"{what[phase]} timeout after {limit:g}s")
+
+
+class StreamTimeout(_Timeout, ProviderError):
+    """timed out before the first token: another provider may do better"""
+
+
+class StreamStalled(_Timeout, RuntimeError):
+    """stalled after the first token. the partial reply is already out, so this is
+    not retried: another model's answer would be spliced onto it"""
+
+
+def _http_error(code, raw):
+    cls = ProviderError if code == 429 or code >= 500 else RuntimeError
+    return cls(f"HTTP {code}: {raw[:300]}")
+
+
+def _first_byte_limit():
+    a = _ag()
+    lim, fb = a.ttft_limit, a.first_byte_timeout
+    return min(lim, fb) if lim else fb
+
+
+def _set_timeout(resp, t):
+    """adjust the read timeout of a live urllib response (no-op for fakes/replays)"""
+    try:
+        resp.fp.raw._sock.settimeout(t)
+    except Exception:
+        pass
+
+
+def _stream_error(resp, e, t_first):
+    _abort(resp)
+    if isinstance(e, socket.timeout):
+        if t_first is None:
+            return StreamTimeout("first_byte", _first_byte_limit())
+        return StreamStalled("idle", _ag().idle_timeout)
+    if t_first is None:
+        return ProviderError(f"stream failed before first token: {e}")
+    return RuntimeError(f"stream broken: {e}")
+
+
+def _open_error(e):
+    """classify a failure opening a stream: connect timeout, header timeout, or refused"""
+    if isinstance(e, socket.timeout):  # connected, but no response headers in time
+        return StreamTimeout("first_byte", _first_byte_limit())
+    reason = getattr(e, "reason", e)
+    if isinstance(reason, socket.timeout):  # urllib wraps connect failures in URLError
+        return StreamTimeout("connect", _ag().connect_timeout)
+    return ProviderError(f"connect failed: {reason}")
+
+
+# a 400 saying so in as many words; any other 400 (context overflow, malformed
+# request, …) may not recur, so it only switches this session to xml mode
+_NO_TOOLS_ERR = re.compile(
+    r"(does not|doesn't|do not|not) support (tools|tool[ _]?(use|calling)|function[ _]?calling)"
+    r"|(tools|tool[ _]?(use|calling)|function[ _]?calling) (is |are )?not supported"
+    r"|no endpoints found that support tool",
+    re.I,
+)
+
+
+def _mark_no_tools(raw=""):
+    a = _ag()
+    a.no_tools_models.add(a.actual_model)
+    if _NO_TOOLS_ERR.search(raw):
+        set_caps(a.provider, a.actual_model, tools=False)
+    print(f" {Y}⚠ model doesn't support tools — switching to XML mode{R}", file=_out())
+
+
+def _abort(resp):
+    """drop a half-read response: close the socket now instead of waiting out the timeout"""
+    try:
+        resp.close()
+    except Exception:
+        pass
 
 
-def read_sse_stream(resp):
-    SP.stop()
+def read_sse_stream(resp, tm=None):
+    a = _ag()
+    a.sp.stop()
+    out, events = _out(), a.events
+    tm = {} if tm is None else tm
+    t_first = None
     full_msg = {"role": "assistant", "content": ""}
     tool_calls = {}
-    sys.stdout.write(f" {C}◆{R} ")
-    sys.stdout.flush()
+    out.write(f" {C}◆{R} ")
+    out.flush()
     usage = {}
-    for line in resp:
-        line = line.decode().strip()
-        if not line.startswith("data: ") or line == "data: [DONE]":
-            continue
-        try:
-            data = json.loads(line[6:])
-            if "error" in data:
-                raise RuntimeError(data["error"].get("message", str(data["error"])))
-            if "usage" in data and data["usage"]:
-                usage = data["usage"]
-            if not data.get("choices"):
+    interrupted = False
+    _set_timeout(resp, _first_byte_limit())
+    a.live = resp
+    try:
+        for line in resp:
+            if a.cancelled:
+                raise KeyboardInterrupt
+            line = line.decode().strip()
+            if not line.startswith("data: ") or line == "data: [DONE]":
                 continue
-            delta = data["choices"][0].get("delta", {})
-            if "content" in delta and delta["content"]:
-                chunk = delta["content"]
-                full_msg["content"] += chunk
-                sys.stdout.write(chunk)
-                sys.stdout.flush()
-            if "tool_calls" in delta:
-                for tc in delta["tool_calls"]:
-                    idx = tc["index"]
-                    if idx not in tool_calls:
-                        tool_calls[idx] = {
-                            "id": tc.get("id", ""),
-                            "type": "function",
-                            "function": {"name": "", "arguments": ""},
-                        }
-                    if tc.get("id"):
-                        tool_calls[idx]["id"] = tc["id"]
-                    fn = tc.get("function", {})
-                    if fn.get("name"):
-                        tool_calls[idx]["function"]["name"] += fn["name"]
-                    if fn.get("arguments"):
-                        tool_calls[idx]["function"]["arguments"] += fn["arguments"]
-        except Exception:
-            pass
+            try:
+                data = json.loads(line[6:])
+                if "error" in data:
+                    raise RuntimeError(data["error"].get("message", str(data["error"])))
+                if "usage" in data and data["usage"]:
+                    usage = data["usage"]
+                if not data.get("choices"):
+                    continue
+                delta = data["choices"][0].get("delta", {})
+                if t_first is None and (
+                    delta.get("content") or delta.get("tool_calls")
+                ):
+                    t_first = time.perf_counter()
+                    _set_timeout(resp, a.idle_timeout)
+                if "content" in delta and delta["content"]:
+                    chunk = delta["content"]
+                    full_msg["content"] += chunk
+                    out.write(chunk)
+                    out.flush()
+                    events and _emit("token", text=chunk)
+                if "tool_calls" in delta:
+                    for tc in delta["tool_calls"]:
+                        idx = tc["index"]
+                        if idx not in tool_calls:
+                            tool_calls[idx] = {
+                                "id": tc.get("id", ""),
+                                "type": "function",
+                                "function": {"name": "", "arguments": ""},
+                            }
+                        if tc.get("id"):
+                            tool_calls[idx]["id"] = tc["id"]
+                        fn = tc.get("function", {})
+                        if fn.get("name"):
+                            tool_calls[idx]["function"]["name"] += fn["name"]
+                        if fn.get("arguments"):
+                            tool_calls[idx]["function"]["arguments"] += fn["arguments"]
+            except Exception:
+                pass
+    except KeyboardInterrupt:
+        interrupted = True
+        _abort(resp)
+    except OSError as e:
+        if not a.cancelled:
+            raise _stream_error(resp, e, t_first)
+    a.live = None
+    interrupted = interrupted or a.cancelled
     if tool_calls:
         full_msg["tool_calls"] = [tool_calls[i] for i in sorted(tool_calls.keys())]
+    if interrupted:
+        full_msg.pop("tool_calls", None)  # half-streamed calls are not safe to run
     if full_msg["content"]:
-        sys.stdout.write("\n")
-        sys.stdout.flush()
-    return {"choices": [{"message": full_msg}], "usage": usage}
+        out.write("\n")
+        out.flush()
+    _timing(
+        tm,
+        t_first,
+        time.perf_counter(),
+        usage.get("completion_tokens"),
+        full_msg["content"],
+    )
+    return {
+        "choices": [{"message": full_msg}],
+        "usage": usage,
+        "timing": tm,
+        "interrupted": interrupted,
+    }
 
 
-def read_ndjson_stream(resp):
-    SP.stop()
+def read_ndjson_stream(resp, tm=None):
+    a = _ag()
+    a.sp.stop()
+    out, events = _out(), a.events
+    tm = {} if tm is None else tm
+    t_first = None
     full_msg = {"role": "assistant", "content": ""}
-    sys.stdout.write(f" {C}◆{R} ")
-    sys.stdout.flush()
+    out.write(f" {C}◆{R} ")
+    out.flush()
     usage = {}
-    for line in resp:
-        line = line.decode().strip()
-        if not line:
-            continue
-        try:
-            data = json.loads(line)
-            if "error" in data:
-                raise RuntimeError(data["error"].get("message", str(data["error"])))
-            msg = data.get("message", {})
-            if "content" in msg and msg["content"]:
-                chunk = msg["content"]
-                full_msg["content"] += chunk
-                sys.stdout.write(chunk)
-                sys.stdout.flush()
-            if "tool_calls" in msg and msg["tool_calls"]:
-                full_msg["tool_calls"] = msg["tool_calls"]
-            if data.get("done"):
-                usage = {
-                    "prompt_tokens": data.get("prompt_eval_count", 0),
-                    "completion_tokens": data.get("eval_count", 0),
-                }
-        except Exception:
-            pass
+    interrupted = False
+    _set_timeout(resp, _first_byte_limit())
+    a.live = resp
+    try:
+        for line in resp:
+            if a.cancelled:
+                raise KeyboardInterrupt
+            line = line.decode().strip()
+            if not line:
+                continue
+            try:
+                data = json.loads(line)
+                if "error" in data:
+                    raise RuntimeError(data["error"].get("message", str(data["error"])))
+                msg = data.get("message", {})
+                if t_first is None and (msg.get("content") or msg.get("tool_calls")):
+                    t_first = time.perf_counter()
+                    _set_timeout(resp, a.idle_timeout)
+                if "content" in msg and msg["content"]:
+                    chunk = msg["content"]
+                    full_msg["content"] += chunk
+                    out.write(chunk)
+                    out.flush()
+                    events and _emit("token", text=chunk)
+                if "tool_calls" in msg and msg["tool_calls"]:
+                    full_msg["tool_calls"] = msg["tool_calls"]
+                if data.get("done"):
+                    usage = {
+                        "prompt_tokens": data.get("prompt_eval_count", 0),
+                        "completion_tokens": data.get("eval_count", 0),
+                    }
+                    # server-side timings (ns): model load, prompt eval, generation
+                    for k, f in (
+                        ("load", "load_duration"),
+                        ("prompt_eval", "prompt_eval_duration"),
+                        ("eval", "eval_duration"),
+                    ):
+                        if data.get(f):
+                            tm[k] = data[f] / 1e9
+                    if tm.get("eval") and data.get("eval_count"):
+                        tm["tps"] = data["eval_count"] / tm["eval"]
+            except Exception:
+                pass
+    except KeyboardInterrupt:
+        interrupted = True
+        _abort(resp)
+    except OSError as e:
+        if not a.cancelled:
+            raise _stream_error(resp, e, t_first)
+    a.live = None
+    interrupted = interrupted or a.cancelled
+    if interrupted:
+        full_msg.pop("tool_calls", None)  # half-streamed calls are not safe to run
     if full_msg["content"]:
-        sys.stdout.write("\n")
-        sys.stdout.flush()
-    return {"choices": [{"message": full_msg}], "usage": usage}
+        out.write("\n")
+        out.flush()
+    _timing(
+        tm,
+        t_first,
+        time.perf_counter(),
+        usage.get("completion_tokens"),
+        full_msg["content"],
+    )
+    return {
+        "choices": [{"message": full_msg}],
+        "usage": usage,
+        "timing": tm,
+        "interrupted": interrupted,
+    }
 
 
-def call_openrouter(msgs, sysp, force_no_tools=False):
-    use_tools = not force_no_tools and ACTUAL_MODEL not in NO_TOOLS_MODELS
-    body = {
-        "model": ACTUAL_MODEL,
-        "messages": [{"role": "system", "content": sysp}] + msgs,
-        "temperature": 0.3,
-        "stream": True,
-    }
-    if use_tools:
-        body["tools"] = SCHEMA
-        body["tool_choice"] = "auto"
-    req = urllib.request.Request(
-        "https://openrouter.ai/api/v1/chat/completions",
-        data=json.dumps(body).encode(),
-        headers={
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {KEY}",
-            "HTTP-Referer": "https://github.com/chalilulz",
-            "X-Title": "chalilulz",
-        },
-        method="POST",
+def _call_registered(provider, msgs, sysp, force_no_tools, extra_headers=None):
+    """openai-compatible call using the registry's base url, key and auth scheme"""
+    _, auth, key_var, host_var = PROVIDERS[provider]
+    a = _ag()
+    return call_openai_compatible(
+        getattr(a, host_var.lower()),
+        getattr(a, key_var.lower()),
+        msgs,
+        sysp,
+        force_no_tools,
+        auth,
+        extra_headers,
     )
-    try:
-        resp = urllib.request.urlopen(req, timeout=120)
-        result = read_sse_stream(resp)
-        return result, use_tools
-    except urllib.error.HTTPError as e:
-        raw = e.read().decode()
-        if e.code == 400 and use_tools:
-            NO_TOOLS_MODELS.add(ACTUAL_MODEL)
-            print(f" {Y}⚠ model doesn't support tools — switching to XML mode{R}")
-            return call_openrouter(msgs, sysp, force_no_tools=True)
-        raise RuntimeError(f"HTTP {e.code}: {raw[:300]}")
 
 
-def call_ollama(msgs, sysp, force_no_tools=False):
-    use_tools = not force_no_tools and ACTUAL_MODEL not in NO_TOOLS_MODELS
-    body = {
-        "model": ACTUAL_MODEL,
-        "messages": [{"role": "system", "content": sysp}] + msgs,
-        "stream": True,
-        "options": {"temperature": 0.3},
-    }
-    if use_tools:
-        body["tools"] = SCHEMA
-    url = OLLAMA_HOST.rstrip("/") + "/api/chat"
-    req = urllib.request.Request(
-        url,
-        data=json.dumps(body).encode(),
-        headers={"Content-Type": "application/json"},
-        method="POST",
+def call_openrouter(msgs, sysp, force_no_tools=False):
+    return _call_registered(
+        "openrouter",
+        msgs,
+        sysp,
+        force_no_tools,
+        {"HTTP-Referer": "https://github.com/chalilulz", "X-Title": "chalilulz"},
     )
-    try:
-        resp = urllib.request.urlopen(req, timeout=120)
-        return read_ndjson_stream(resp), use_tools
-    except urllib.error.HTTPError as e:
-        raw = e.read().decode()
-        if e.code == 400 and use_tools:
-            NO_TOOLS_MODELS.add(ACTUAL_MODEL)
-            print(f" {Y}⚠ model doesn't support tools — switching to XML mode{R}")
-            return call_ollama(msgs, sysp, force_no_tools=True)
-        raise RuntimeError(f"HTTP {e.code}: {raw[:300]}")
+
+
+# ─ record / replay: provider streams keyed by their normalized request
+_ENV_LINE = re.compile(r"^Environment: .*$", re.M)
+
+
+def _stable_system(text):
+    """the system prompt without what differs between machines and checkouts: the
+    environment line (os, cwd) and the installed skills"""
+    return _ENV_LINE.sub("Environment:", text.split("\n## Available Skills")[0])
+
+
+def _req_key(req):
+    """hash of url path + canonical json body; host, headers (keys), the ollama
+    knobs that vary between runs (keep_alive, options.num_ctx) and the machine
+    specific parts of the system prompt are excluded"""
+    path = urllib.parse.urlsplit(req.full_url).path
+    try:
+        d = json.loads(req.data)
+        if isinstance(d, dict):
+            d.pop("keep_alive", None)
+            if isinstance(d.get("options"), dict):
+                d["options"].pop("num_ctx", None)
+                if not d["options"]:
+                    del d["options"]
+            for m in d.get("messages") or []:
+                if m.get("role") == "system" and isinstance(m.get("content"), str):
+                    m["content"] = _stable_system(m["content"])
+            if isinstance(d.get("system"), str):
+                d["system"] = _stable_system(d["system"])
+        body = json.dumps(d, sort_keys=True)
+    except Exception:
+        body = (req.data or b"").decode("utf-8", "replace")
+    return hashlib.sha256(f"{path}\n{body}".encode()).hexdigest()[:32]
+
+
+class _Recorder:
+    """tees a streaming response line by line into a recording once it completes"""
+
+    def __init__(self, resp, path, t0):
+        self.resp, self.path, self.t0 = resp, path, t0
+        self.connect = time.perf_counter() - t0
+        self.fp = getattr(resp, "fp", None)  # lets _set_timeout reach the socket
+
+    def __iter__(self):
+        rows = []
+        for line in self.resp:
+            rows.append(
+                {
+                    "t": time.perf_counter() - self.t0,
+                    "d": line.decode("utf-8", "replace"),
+                }
+            )
+            yield line
+        _save_recording(self.path, {"status": 200, "connect": self.connect}, rows)
+
+    def close(self):
+        self.resp.close()
+
+
+class _Replay:
+    def __init__(self, path, head, rows, timing=False):
+        self.path, self.rows, self.timing = path, rows, timing
+        self.connect = head.get("connect", 0)
+
+    def __iter__(self):
+        t0 = time.perf_counter() - self.connect
+        for r in self.rows:
+            if self.timing:
+                time.sleep(max(0, r["t"] - (time.perf_counter() - t0)))
+            yield r["d"].encode()
+
+    def close(self):
+        pass
+
+
+def _save_recording(path, head, rows):
+    _write_atomic(path, "".join(json.dumps(r) + "\n" for r in [head] + rows))
+
+
+# ─ stream timeouts
+# urlopen has one timeout for connect and every read. provider streams open with
+# CONNECT_TIMEOUT and these connections switch to the first-byte limit once the
+# socket is up, so a slow model isn't mistaken for a dead host; the readers then
+# move to IDLE_TIMEOUT after the first token.
+_STREAM = threading.local()
+
+
+class _PooledResponse(http.client.HTTPResponse):
+    """hands its connection back to the pool once the body has been read to the end;
+    a response closed early (cancelled or failed stream) takes the connection with it"""
+
+    _pool = None
+    _early = False
+
+    def close(self):
+        if self.fp is not None:
+            self._early = True
+        super().close()
+
+    def _close_conn(self):
+        super()._close_conn()
+        pool, self._pool = self._pool, None
+        if pool:
+            key, h = pool
+            if self._early or self.will_close:
+                h.close()
+            else:
+                _pool_put(key, h)
+
+
+class _FirstByteMixin:
+    response_class = _PooledResponse
+
+    def connect(self):
+        super().connect()
+        t = getattr(_STREAM, "first_byte", None)
+        if t:
+            self.sock.settimeout(t)
+
+
+class _HTTPConn(_FirstByteMixin, http.client.HTTPConnection):
+    pass
+
+
+class _HTTPSConn(_FirstByteMixin, http.client.HTTPSConnection):
+    pass
+
+
+# ─ keep-alive pool: (conn class, host) → [(idle since, connection)], shared by every
+# session in the process so repeat requests skip the tcp/tls handshake
+POOL_MAX = 8  # idle connections kept per host
+POOL_IDLE = 30  # s before an idle connection is dropped (servers close them anyway)
+_POOL = {}
+_POOL_LOCK = threading.Lock()
+
+
+def _pool_get(key):
+    now = time.time()
+    with _POOL_LOCK:
+        idle = _POOL.get(key, [])
+        while idle:
+            t, h = idle.pop()
+            if now - t < POOL_IDLE and h.sock:
+                return h
+            h.close()
+    return None
+
+
+def _pool_put(key, h):
+    with _POOL_LOCK:
+        idle = _POOL.setdefault(key, [])
+        if len(idle) < POOL_MAX and h.sock:
+            idle.append((time.time(), h))
+            return
+    h.close()
+
+
+def _pooled_open(handler, conn_cls, req, **kw):
+    """AbstractHTTPHandler.do_open, but reusing idle keep-alive connections"""
+    if not req.host:
+        raise urllib.error.URLError("no host given")
+    if req._tunnel_host:  # https through a proxy: leave tunnels to urllib
+        return handler.do_open(conn_cls, req, **kw)
+    headers = dict(req.unredirected_hdrs)
+    headers.update({k: v for k, v in req.headers.items() if k not in headers})
+    headers = {k.title(): v for k, v in headers.items()}
+    key = (conn_cls, req.host)
+    h = _pool_get(key)
+    while True:
+        reused = h is not None
+        if not reused:
+            h = conn_cls(req.host, timeout=req.timeout, **kw)
+        try:
+            try:
+                if reused:
+                    h.timeout = req.timeout
+                    h.sock.settimeout(
+                        getattr(_STREAM, "first_byte", None) or req.timeout
+                    )
+                h.request(
+                    req.get_method(),
+                    req.selector,
+                    req.data,
+                    headers,
+                    encode_chunked=req.has_header("Transfer-encoding"),
+                )
+            except OSError as err:
+                if reused:  # server dropped the idle connection
+                    h.close()
+                    h = None
+                    continue
+                raise urllib.error.URLError(err)
+            r = h.getresponse()
+        except (http.client.RemoteDisconnected, ConnectionResetError):
+            h.close()
+            if not reused:
+                raise
+            h = None
+            continue
+        except BaseException:
+            h.close()
+            raise
+        break
+    r._pool = (key, h)
+    r.url = req.get_full_url()
+    r.msg = r.reason
+    return r
+
+
+class _HTTPHandler(urllib.request.HTTPHandler):
+    def http_open(self, req):
+        return _pooled_open(self, _HTTPConn, req)
+
+
+class _HTTPSHandler(urllib.request.HTTPSHandler):
+    def https_open(self, req):
+        return _pooled_open(self, _HTTPSConn, req, context=self._context)
+
+
+# pooled keep-alive, and the first-byte limit while _urlopen has one set. private to
+# chalilulz: programs embedding it keep their own urlopen
+_OPENER = urllib.request.build_opener(_HTTPHandler, _HTTPSHandler)
+
+
+def _open(req):
+    _STREAM.first_byte = _first_byte_limit()
+    try:
+        return _OPENER.open(req, timeout=_ag().connect_timeout)
+    finally:
+        _STREAM.first_byte = None
+
+
+def _urlopen(req):
+    """urlopen for provider streams, honouring the session's record / replay dirs"""
+    a = _ag()
+    if a.replay_dir:
+        path = pathlib.Path(a.replay_dir) / f"{_req_key(req)}.jsonl"
+        try:
+            with open(path, encoding="utf-8") as f:
+                rows = [json.loads(ln) for ln in f]
+        except FileNotFoundError:
+            raise RuntimeError(
+                f"replay: no recording for {req.full_url} ({path.name})"
+            ) from None
+        head = rows[0]
+        if a.replay_timing:
+            time.sleep(head.get("connect", 0))
+        if head["status"] != 200:
+            raise urllib.error.HTTPError(
+                req.full_url,
+                head["status"],
+                "replay",
+                {},
+                io.BytesIO(head["body"].encode()),
+            )
+        return _Replay(path, head, rows[1:], a.replay_timing)
+    t0 = time.perf_counter()
+    if not a.record_dir:
+        return _open(req)
+    path = pathlib.Path(a.record_dir) / f"{_req_key(req)}.jsonl"
+    try:
+        resp = _open(req)
+    except urllib.error.HTTPError as e:
+        body = e.read()
+        head = {"status": e.code, "body": body.decode("utf-8", "replace")}
+        _save_recording(path, dict(head, connect=time.perf_counter() - t0), [])
+        raise urllib.error.HTTPError(
+            e.url, e.code, e.msg, e.hdrs, io.BytesIO(body)
+        ) from e
+    return _Recorder(resp, path, t0)
+
+
+# ─ ollama tuning
+_NUM_CTX = {}  # model → num_ctx last sent; only ever grows, a change reloads the model
+
+
+def ollama_num_ctx(msgs, sysp, model=None):
+    """smallest power-of-two window fitting history + output reserve, capped at the
+    model's maximum. sticky per model so ollama doesn't reload it every round."""
+    model = model or _ag().actual_model
+    need = (len(json.dumps(msgs)) + len(sysp)) // 4 + _ag().budget["reserve"]
+    n = 2048
+    while n < need:
+        n *= 2
+    n = max(min(n, model_ctx("ollama", model, fetch=False)), _NUM_CTX.get(model, 0))
+    _NUM_CTX[model] = n
+    return n
+
+
+def warm_ollama(sysp=""):
+    """load the current ollama model in the background so the first turn doesn't pay for it"""
+    a = _ag()
+    if a.provider != "ollama" or a.replay_dir:
+        return None
+    model, host = a.actual_model, a.ollama_host
+
+    def _bg():
+        model_ctx("ollama", model)  # caches the model's max context on first use
+        body = {
+            "model": model,
+            "keep_alive": a.keep_alive,
+            "options": {"num_ctx": ollama_num_ctx([], sysp, model)},
+        }
+        req = urllib.request.Request(
+            host.rstrip("/") + "/api/generate",
+            data=json.dumps(body).encode(),
+            headers={"Content-Type": "application/json"},
+            method="POST",
+        )
+        try:
+            _OPENER.open(req, timeout=300).read()
+        except Exception:
+            pass
+
+    return _spawn(_bg)
+
+
+def call_ollama(msgs, sysp, force_no_tools=False):
+    a = _ag()
+    use_tools = not force_no_tools and a.actual_model not in a.no_tools_models
+    body = {
+        "model": a.actual_model,
+        "messages": [{"role": "system", "content": sysp}] + msgs,
+        "stream": True,
+        "keep_alive": a.keep_alive,
+        "options": {"temperature": 0.3, "num_ctx": ollama_num_ctx(msgs, sysp)},
+    }
+    if use_tools:
+        body["tools"] = SCHEMA
+    url = a.ollama_host.rstrip("/") + "/api/chat"
+    req = urllib.request.Request(
+        url,
+        data=json.dumps(body).encode(),
+        headers={"Content-Type": "application/json"},
+        method="POST",
+    )
+    t0 = time.perf_counter()
+    try:
+        resp = _urlopen(req)
+        tm = {"start": t0, "connect": time.perf_counter() - t0}
+        return read_ndjson_stream(resp, tm), use_tools
+    except urllib.error.HTTPError as e:
+        raw = e.read().decode()
+        if e.code == 400 and use_tools:
+            _mark_no_tools(raw)
+            return call_ollama(msgs, sysp, force_no_tools=True)
+        raise _http_error(e.code, raw)
+    except (urllib.error.URLError, OSError) as e:
+        raise _open_error(e)
 
 
 def call_openai_compatible(
-    base_url, api_key, msgs, sysp, force_no_tools=False, auth_header="Bearer"
+    base_url,
+    api_key,
+    msgs,
+    sysp,
+    force_no_tools=False,
+    auth_header="Bearer",
+    extra_headers=None,
 ):
-    use_tools = not force_no_tools and ACTUAL_MODEL not in NO_TOOLS_MODELS
+    a = _ag()
+    use_tools = not force_no_tools and a.actual_model not in a.no_tools_models
     body = {
-        "model": ACTUAL_MODEL,
+        "model": a.actual_model,
         "messages": [{"role": "system", "content": sysp}] + msgs,
         "temperature": 0.3,
         "stream": True,
@@ -814,6 +1984,7 @@ def call_openai_compatible(
         headers["Authorization"] = f"Bearer {api_key}"
     elif auth_header == "x-goog-api-key":
         headers["x-goog-api-key"] = api_key
+    headers.update(extra_headers or {})
     url = base_url.rstrip("/") + "/chat/completions"
     req = urllib.request.Request(
         url,
@@ -821,14 +1992,17 @@ def call_openai_compatible(
         headers=headers,
         method="POST",
     )
+    t0 = time.perf_counter()
     try:
-        resp = urllib.request.urlopen(req, timeout=120)
-        return read_sse_stream(resp), use_tools
+        resp = _urlopen(req)
+        tm = {"start": t0, "connect": time.perf_counter() - t0}
+        _rate_learn(a.provider, getattr(resp, "headers", None))
+        return read_sse_stream(resp, tm), use_tools
     except urllib.error.HTTPError as e:
+        _rate_learn(a.provider, e.headers, e.code)
         raw = e.read().decode()
         if e.code == 400 and use_tools:
-            NO_TOOLS_MODELS.add(ACTUAL_MODEL)
-            print(f" {Y}⚠ model doesn't support tools — switching to XML mode{R}")
+            _mark_no_tools(raw)
             return call_openai_compatible(
                 base_url,
                 api_key,
@@ -836,41 +2010,416 @@ def call_openai_compatible(
                 sysp,
                 force_no_tools=True,
                 auth_header=auth_header,
+                extra_headers=extra_headers,
             )
-        raise RuntimeError(f"HTTP {e.code}: {raw[:300]}")
+        raise _http_error(e.code, raw)
+    except (urllib.error.URLError, OSError) as e:
+        raise _open_error(e)
 
 
 def call_mistral(msgs, sysp, force_no_tools=False):
-    return call_openai_compatible(
-        MISTRAL_HOST, MISTRAL_KEY, msgs, sysp, force_no_tools, "Bearer"
-    )
+    return _call_registered("mistral", msgs, sysp, force_no_tools)
 
 
 def call_groq(msgs, sysp, force_no_tools=False):
-    return call_openai_compatible(
-        GROQ_HOST, GROQ_KEY, msgs, sysp, force_no_tools, "Bearer"
-    )
+    return _call_registered("groq", msgs, sysp, force_no_tools)
 
 
 def call_gemini(msgs, sysp, force_no_tools=False):
-    return call_openai_compatible(
-        GEMINI_HOST, GEMINI_KEY, msgs, sysp, force_no_tools, "x-goog-api-key"
-    )
+    return _call_registered("gemini", msgs, sysp, force_no_tools)
 
 
-def call_api(msgs, sysp, force_no_tools=False):
-    if PROVIDER == "openrouter":
-        return call_openrouter(msgs, sysp, force_no_tools)
-    elif PROVIDER == "ollama":
-        return call_ollama(msgs, sysp, force_no_tools)
-    elif PROVIDER == "mistral":
-        return call_mistral(msgs, sysp, force_no_tools)
-    elif PROVIDER == "groq":
-        return call_groq(msgs, sysp, force_no_tools)
-    elif PROVIDER == "gemini":
-        return call_gemini(msgs, sysp, force_no_tools)
+# ─ shared rate limit
+@contextlib.contextmanager
+def _locked(path):
+    """open path r+ under an exclusive lock: flock, or on windows (no fcntl) a
+    msvcrt lock on the first byte, which works before anything is written"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "a+", encoding="utf-8") as f:
+        try:
+            import fcntl
+        except ImportError:
+            fcntl = None
+            import msvcrt
+        if fcntl:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:  # LK_LOCK gives up after ~10s of retries
+                    pass
+        try:
+            f.seek(0)
+            yield f
+        finally:
+            if not fcntl:
+                f.flush()
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def _rate_path(provider):
+    """state file for provider + api key (the key itself is only hashed into the name)"""
+    key = get_required_key(provider) or ""
+    d = pathlib.Path(RATE_DIR) if RATE_DIR else _data_dir() / "rate"
+    return d / f"{provider}-{hashlib.sha256(key.encode()).hexdigest()[:12]}.json"
+
+
+def _rate_state(f):
+    try:
+        return json.loads(f.read() or "{}")
+    except ValueError:
+        return {}
+
+
+def _rate_save(f, st):
+    f.seek(0)
+    f.truncate()
+    f.write(json.dumps(st))
+
+
+def _refill(b, now):
+    b["level"] = min(b["limit"], b["level"] + (now - b["t"]) * b["rate"])
+    b["t"] = now
+
+
+def _configured(b, per_min, burst, now):
+    """bucket from a configured per-minute limit (it caps anything learned from headers)"""
+    if b is None:
+        b = {"level": burst, "t": now}
+    else:
+        _refill(b, now)
+    b.update(limit=burst, rate=per_min / 60, cfg=True)
+    b["level"] = min(b["level"], burst)
+    return b
+
+
+def _throttle(provider, tokens=0):
+    """wait until provider + key has a request slot and `tokens` prompt tokens free
+    under its requests/min and tokens/min buckets; returns seconds waited.
+    configured requests/min are spaced evenly; learned buckets allow the server's burst"""
+    rpm = RATE_LIMIT.get(provider) or RATE_LIMIT.get("*")
+    tpm = TOKEN_LIMIT.get(provider) or TOKEN_LIMIT.get("*")
+    path = _rate_path(provider)
+    if not (rpm or tpm or path.exists()):
+        return 0
+    with _locked(path) as f:
+        st, now = _rate_state(f), time.time()
+        wait = max(0, st.get("until", 0) - now)  # Retry-After from a 429
+        for k, per_min, burst, need in (("req", rpm, 1, 1), ("tok", tpm, tpm, tokens)):
+            b = st.get(k)
+            if per_min:
+                b = st[k] = _configured(b, per_min, burst, now)
+            elif b:
+                _refill(b, now)
+            if not b or not need:
+                continue
+            # reserve now, even if the bucket goes negative: later callers queue behind
+            b["level"] -= min(need, b["limit"])
+            if b["level"] < 0:
+                wait = max(wait, -b["level"] / b["rate"])
+        _rate_save(f, st)
+    if wait:
+        time.sleep(wait)
+    return wait
+
+
+# bucket → alternatives for its (limit, remaining, reset) headers
+_RL_HEADERS = {
+    "req": (
+        ("x-ratelimit-limit-requests", "x-ratelimit-limit-req-minute"),
+        ("x-ratelimit-remaining-requests", "x-ratelimit-remaining-req-minute"),
+        ("x-ratelimit-reset-requests",),
+    ),
+    "tok": (
+        ("x-ratelimit-limit-tokens", "x-ratelimit-limit-tokens-minute"),
+        ("x-ratelimit-remaining-tokens", "x-ratelimit-remaining-tokens-minute"),
+        ("x-ratelimit-reset-tokens",),
+    ),
+}
+
+
+def _duration(v):
+    """ "1m30.5s" / "20ms" / "12" → seconds"""
+    try:
+        return float(v)
+    except ValueError:
+        units = {"h": 3600, "m": 60, "s": 1, "ms": 0.001}
+        return sum(float(n) * units[u] for n, u in re.findall(r"([\d.]+)(ms|h|m|s)", v))
+
+
+def _rate_learn(provider, headers, code=200):
+    """update provider + key buckets from a response's x-ratelimit-* headers; a 429
+    also blocks new requests until its Retry-After (or the exhausted bucket's reset)"""
+    if headers is None:
+        return
+    got, retry = {}, 0
+    for k, names in _RL_HEADERS.items():
+        lim, rem, reset = (
+            next((headers.get(n) for n in alts if headers.get(n)), None)
+            for alts in names
+        )
+        try:
+            lim, rem = float(lim), float(rem)
+            reset = _duration(reset) if reset else 60.0
+        except (TypeError, ValueError):
+            continue
+        if lim <= 0:
+            continue
+        # the window refills what has been used (limit - remaining) by the reset time;
+        # that holds for per-minute and per-day limits alike
+        rate = (lim - rem) / reset if reset > 0 and lim > rem else lim / 60
+        got[k] = (lim, rem, rate)
+        if rem < 1:
+            retry = max(retry, reset)
+    if code == 429:
+        try:
+            retry = float(headers.get("retry-after") or 0) or retry or 1
+        except ValueError:
+            retry = retry or 1
     else:
-        raise RuntimeError(f"Unknown provider: {PROVIDER}")
+        retry = 0
+    if not got and not retry:
+        return
+    with _locked(_rate_path(provider)) as f:
+        st, now = _rate_state(f), time.time()
+        for k, (lim, rem, rate) in got.items():
+            b = st.get(k)
+            if b is None:
+                b = st[k] = {"limit": lim, "rate": rate, "level": rem, "t": now}
+            else:
+                _refill(b, now)
+                if not b.get("cfg"):
+                    b.update(limit=lim, rate=rate)
+            # the server's count wins unless ours is lower (requests still in flight)
+            b["level"] = min(b["level"], rem)
+        if retry:
+            st["until"] = max(st.get("until", 0), now + retry)
+        _rate_save(f, st)
+
+
+def _rate_spend(provider, tokens):
+    """charge generated tokens to a tokens/min bucket, if one is kept for provider + key"""
+    path = _rate_path(provider)
+    if not tokens or not path.exists():
+        return
+    with _locked(path) as f:
+        st = _rate_state(f)
+        b = st.get("tok")
+        if b:
+            _refill(b, time.time())
+            b["level"] -= tokens
+            _rate_save(f, st)
+
+
+# ─ usage ledger: one jsonl row per provider request (reports: chalilulz.usage)
+# $ per million tokens: (input, output[, cached input]); "provider:*" matches any model.
+# openrouter prices come from its /models listing (see _fetch_ctx) or usage.cost
+PRICES = {"ollama:*": (0, 0, 0)}
+
+
+def _ledger_path():
+    return _data_dir() / "usage.jsonl"
+
+
+def _cached_tokens(usage):
+    d = usage.get("prompt_tokens_details") or {}
+    return d.get("cached_tokens") or usage.get("prompt_cache_hit_tokens") or 0
+
+
+def _cost(provider, model, usage):
+    """$ for one request's usage; None when the model has no known price"""
+    if isinstance(usage.get("cost"), (int, float)):  # openrouter reports it directly
+        return usage["cost"]
+    p = PRICES.get(f"{provider}:{model}") or PRICES.get(f"{provider}:*")
+    if p is None and model.endswith(":free"):
+        p = (0, 0, 0)
+    if p is None:
+        p = get_caps(provider, model).get("price")
+    if p is None:
+        return None
+    cached = _cached_tokens(usage)
+    cached_rate = p[2] if len(p) > 2 else p[0]
+    prompt = usage.get("prompt_tokens") or 0
+    out = usage.get("completion_tokens") or 0
+    return ((prompt - cached) * p[0] + cached * cached_rate + out * p[1]) / 1e6
+
+
+def _ledger(provider, model, resp=None, error=None):
+    """append the request's row to the usage ledger (never for replayed streams)"""
+    a = _ag()
+    if a.replay_dir:
+        return
+    usage = (resp or {}).get("usage") or {}
+    tm = (resp or {}).get("timing") or {}
+    row = {
+        "ts": round(time.time(), 3),
+        "session": a.session,
+        "provider": provider,
+        "model": model,
+        "prompt_tokens": usage.get("prompt_tokens"),
+        "completion_tokens": usage.get("completion_tokens"),
+        "cached_tokens": _cached_tokens(usage),
+        "connect": tm.get("connect"),
+        "ttft": tm.get("ttft"),
+        "total": tm.get("total"),
+        "cost": _cost(provider, model, usage) if usage else None,
+    }
+    if error is not None:
+        row["error"] = str(error)[:200]
+    try:
+        p = _ledger_path()
+        p.parent.mkdir(parents=True, exist_ok=True)
+        with open(p, "a", encoding="utf-8") as f:
+            f.write(json.dumps(row) + "\n")  # one write per row keeps appends whole
+    except OSError:
+        pass
+
+
+def _call_current(msgs, sysp, force_no_tools=False):
+    a = _ag()
+    prov, model = a.provider, a.actual_model
+    spec = PROVIDERS.get(prov)
+    if not spec:
+        raise RuntimeError(f"Unknown provider: {prov}")
+    _throttle(
+        prov, (len(sysp) + sum(len(str(m.get("content") or "")) for m in msgs)) // 4
+    )
+    try:
+        resp, use_tools = globals()[spec[0]](
+            convert_msgs(msgs, prov), sysp, force_no_tools
+        )
+    except Exception as e:
+        _ledger(prov, model, error=e)
+        raise
+    if isinstance(resp, dict):
+        _ledger(prov, model, resp)
+        _rate_spend(prov, (resp.get("usage") or {}).get("completion_tokens"))
+    caps = get_caps(prov, model)
+    learned = {}
+    if use_tools and caps.get("tools") is not True:
+        learned["tools"] = True
+    # streaming quirk: some openai-compatible endpoints never send usage in-stream
+    quirks = caps.get("quirks", {})
+    if isinstance(resp, dict) and "usage" in resp:
+        su = bool(resp["usage"])
+        if quirks.get("stream_usage") != su:
+            learned["quirks"] = dict(quirks, stream_usage=su)
+    if learned:
+        set_caps(prov, model, **learned)
+    return resp, use_tools
+
+
+# circuit breakers: (provider, model) → time until which it is skipped
+_BREAKERS = {}
+
+
+def _chain():
+    """current model first, then configured fallbacks that have their api key"""
+    a = _ag()
+    out = [(a.provider, a.actual_model)]
+    for m in a.fallback:
+        c = parse_model(m)
+        if c not in out and get_required_key(c[0]) != "":
+            out.append(c)
+    return out
+
+
+def call_api(msgs, sysp, xml_sysp=None, force_no_tools=False):
+    """call the current model, failing over down the chain on provider errors.
+    xml_sysp, when given, is the prompt for candidates known not to take native tools"""
+    a = _ag()
+    chain = _chain()
+    now = time.time()
+    live = [c for c in chain if _BREAKERS.get(c, 0) <= now] or chain[:1]
+    orig = a.provider, a.actual_model
+    err = None
+    try:
+        for i, (prov, model) in enumerate(live):
+            a.provider, a.actual_model = prov, model
+            a.ttft_limit = a.failover_ttft if i < len(live) - 1 else None
+            p = (
+                xml_sysp
+                if xml_sysp is not None and model in a.no_tools_models
+                else sysp
+            )
+            try:
+                resp, use_tools = _call_current(msgs, p, force_no_tools)
+            except ProviderError as e:
+                err = e
+                _BREAKERS[prov, model] = time.time() + a.cooldown
+                if i < len(live) - 1:
+                    nxt = "%s:%s" % live[i + 1]
+                    print(
+                        f"\r {Y}⚠ {prov}: {e} — failing over to {nxt}{R}", file=_out()
+                    )
+                continue
+            _BREAKERS.pop((prov, model), None)
+            if (prov, model) != orig and isinstance(resp, dict):
+                resp["model"] = f"{prov}:{model}"
+            return resp, use_tools
+        raise err
+    finally:
+        a.provider, a.actual_model = orig
+        a.ttft_limit = None
+
+
+# ─ message format conversion
+def convert_msgs(msgs, provider):
+    """adapt tool-call history to the provider's format: ollama wants tool_name and
+    dict arguments, openai-compatible apis want tool_call_id and json-string arguments.
+    returns msgs itself when nothing needs converting."""
+    ollama = provider == "ollama"
+    out, pending, changed = [], [], False
+    for m in msgs:
+        role = m.get("role")
+        if role == "assistant" and m.get("tool_calls"):
+            tcs, pending = [], []
+            for i, tc in enumerate(m["tool_calls"]):
+                fn = tc.get("function", {})
+                name, args = fn.get("name", ""), fn.get("arguments")
+                if ollama:
+                    if not isinstance(args, dict):
+                        try:
+                            args = json.loads(args or "{}")
+                        except Exception:
+                            args = {}
+                    new = {"function": {"name": name, "arguments": args}}
+                    pending.append((tc.get("id"), name))
+                else:
+                    if not isinstance(args, str):
+                        args = json.dumps(args or {})
+                    cid = tc.get("id") or f"call_{len(out)}_{i}"
+                    new = {
+                        "id": cid,
+                        "type": "function",
+                        "function": {"name": name, "arguments": args},
+                    }
+                    pending.append((cid, name))
+                changed |= new != tc
+                tcs.append(new)
+            m = dict(m, tool_calls=tcs)
+        elif role == "tool":
+            cid, name = m.get("tool_call_id"), m.get("tool_name")
+            hit = next(
+                (p for p in pending if p[0] == cid or (not cid and p[1] == name)),
+                pending[0] if pending else None,
+            )
+            if hit:
+                pending.remove(hit)
+            hid, hname = hit or (None, "")
+            if ollama:
+                new = {"role": "tool", "tool_name": name or hname}
+            else:
+                new = {"role": "tool", "tool_call_id": cid or hid or f"call_{len(out)}"}
+            new["content"] = m.get("content", "")
+            changed |= new != m
+            m = new
+        out.append(m)
+    return out if changed else msgs
 
 
 # ─ ui helpers
@@ -926,50 +2475,747 @@ TIC = {
     "cp": "📋",
     "find": "🔎",
     "load_skill": "🧠",
+    "search_skills": "🧠",
 }
 
 
 def show_tc(name, args, res):
     ic = TIC.get(name, "⚙")
     av = str(list(args.values())[0])[:64] if args else ""
-    print(f"\n {Gr}{ic} {Bo}{name}{R}{D}({av}){R}")
-    print(f"   {D}⎿ {pvw(str(res))}{R}")
+    out = _out()
+    print(f"\n {Gr}{ic} {Bo}{name}{R}{D}({av}){R}", file=out)
+    print(f"   {D}⎿ {pvw(str(res))}{R}", file=out)
 
 
 # ─ agentic loop helpers
 def _do_tool_calls(calls, msgs, xml_mode):
     """execute tool calls (list of dicts: name+args or id+function), append results, return result msgs"""
     results = []
+    stop = False
     for tc in calls:
         if xml_mode:
             name = tc.get("name", "")
             args = tc.get("args", {})
         else:
             name = tc["function"]["name"]
+            raw = tc["function"].get("arguments")
             try:
-                args = json.loads(tc["function"].get("arguments") or "{}")
+                args = raw if isinstance(raw, dict) else json.loads(raw or "{}")
             except:
                 args = {}
-        res = run_tool(name, args)
+        _emit("tool_call", id=tc.get("id", ""), name=name, args=args)
+        stop = stop or _ag().cancelled
+        if stop:
+            res = f"error:skipped — {INTERRUPTED}"
+        else:
+            try:
+                res = run_tool(name, args)
+            except KeyboardInterrupt:
+                stop = True
+                res = f"error:{INTERRUPTED}"
         show_tc(name, args, res)
+        _emit(
+            "tool_result",
+            id=tc.get("id", ""),
+            name=name,
+            result=_clip(res),
+            ok=not str(res).startswith("error"),
+        )
         if not xml_mode:
-            if PROVIDER == "ollama":  # Ollama format
-                results.append({"role": "tool", "tool_name": name, "content": str(res)})
+            if _ag().provider == "ollama":  # Ollama format
+                results.append(
+                    {"role": "tool", "tool_name": name, "content": _clip(res)}
+                )
             else:  # OpenAI-compatible format (openrouter, mistral, groq, gemini)
                 results.append(
-                    {"role": "tool", "tool_call_id": tc["id"], "content": str(res)}
+                    {
+                        "role": "tool",
+                        "tool_call_id": tc.get("id", ""),
+                        "content": _clip(res),
+                    }
                 )
         else:
             results.append(
                 {
                     "role": "user",
-                    "content": f"<tool_result>{json.dumps({'name': name, 'result': str(res)})}</tool_result>",
+                    "content": f"<tool_result>{json.dumps({'name': name, 'result': _clip(res)})}</tool_result>",
                 }
             )
     msgs.extend(results)
+    if stop:
+        # every call still gets a result so the history stays valid for the next request
+        raise KeyboardInterrupt
     return results
 
 
+# ─ agentic loop
+MAX_TOOL_ROUNDS = 25
+
+
+def system_prompt(skills, cwd=None, more=0):
+    cwd = cwd or os.getcwd()
+    return f"""You are Chalilulz, an expert, concise agentic coding assistant.
+Environment: OS={sys.platform}, CWD={cwd}
+
+Guidelines:
+1. Be extremely concise. No filler, pleasantries, or wrapping text.
+2. Think step-by-step silently before acting.
+3. Use tools efficiently. Chain them together to analyze, plan, and execute.
+4. When writing/editing files, ensure you understand the surrounding code. Use the read tool first if unsure.
+5. Stop and ask the user for clarification if you are stuck or need architectural decisions.
+6. Do not enter infinite loops. If you encounter the same error multiple times, ask the user for help.
+{skills_prompt(skills, more)}"""
+
+
+def run_turn(msgs, sysp, xml_sysp):
+    """run one user turn (msgs ends with the user message): call the model, run its
+    tools, repeat until it answers. returns ok | error | interrupted | max_rounds"""
+    a = _ag()
+    out = _out()
+    rounds = 0
+    pending = 1  # the user message is logged with the first round that completes
+    while True:
+        limit = a.budget["history"] - len(sysp) // 4
+        dropped = truncate_history(msgs, limit)
+        if dropped:
+            print(
+                f"\n {Y}⚠ context over ~{limit} tokens — dropped {dropped} oldest messages{R}",
+                file=out,
+            )
+
+        if rounds >= MAX_TOOL_ROUNDS:
+            print(
+                f"\n {Y}⚠ max tool rounds ({MAX_TOOL_ROUNDS}) reached — stopping to prevent infinite loop{R}\n",
+                file=out,
+            )
+            return "max_rounds"
+        rounds += 1
+        mark = len(msgs) - pending
+        try:
+            a.sp.start()
+            try:
+                resp, use_tools = call_api(msgs, sysp, xml_sysp)
+            except KeyboardInterrupt:
+                a.sp.stop()
+                msgs.append({"role": "assistant", "content": INTERRUPTED})
+                print(f"\n {Y}⚠ interrupted{R}\n", file=out)
+                return "interrupted"
+            except Exception as e:
+                a.sp.stop()
+                print(f"\n {Re}✗ {e}{R}\n", file=out)
+                _emit("error", message=str(e))
+                if pending:  # the unlogged user message; earlier rounds stay, as logged
+                    msgs.pop()
+                return "error"
+            a.sp.stop()
+            ch = resp["choices"][0]
+            msg = ch["message"]
+            usage = resp.get("usage", {})
+            tm = resp.get("timing", {})
+            a.stats.append(tm)
+            text = (msg.get("content") or "").strip()
+            if resp.get("interrupted"):
+                msgs.append(
+                    {"role": "assistant", "content": f"{text}\n{INTERRUPTED}".strip()}
+                )
+                print(f" {Y}⚠ interrupted — partial reply kept{R}\n", file=out)
+                return "interrupted"
+            calls = msg.get("tool_calls") or []
+            if not use_tools:
+                calls = parse_xml_calls(text)
+                msg = {"role": "assistant", "content": text}
+            msgs.append(msg)
+            if calls:
+                t0 = time.perf_counter()
+                try:
+                    _do_tool_calls(calls, msgs, xml_mode=not use_tools)
+                except KeyboardInterrupt:
+                    print(
+                        f"\n {Y}⚠ interrupted — remaining tools skipped{R}\n", file=out
+                    )
+                    return "interrupted"
+                finally:
+                    tm["tools"] = time.perf_counter() - t0
+            model = resp.get("model") or f"{a.provider}:{a.actual_model}"
+            _emit("round", model=model, usage=usage, timing=tm)
+            line = fmt_timing(usage, tm)
+            if resp.get("model"):
+                line = f"via {resp['model']} · {line}"
+            if line:
+                print(f" {D}{line}{R}", file=out)
+            if not calls:
+                return "ok"
+            print(file=out)
+        finally:
+            # what this round added (a failed first call pops the user message)
+            _log_msgs(msgs[mark:])
+            pending = 0
+
+
+# ─ session log: <data dir>/sessions/<session>.jsonl, one line per message. a log
+# that continues a loaded session starts with {"from": {"log", "bytes"}}: the first
+# bytes of that (append-only, so never rewritten) log are its history. <session>.idx
+# holds the end offset of each line (8 bytes apiece) so any message can be read alone
+def _sessions_dir():
+    return _data_dir() / "sessions"
+
+
+class SessionLog:
+    """append-only message log: written each round, fsynced at the end of each turn"""
+
+    def __init__(self, path):
+        self.path, self.f, self.idx = pathlib.Path(path), None, None
+
+    def open(self):
+        """create the log (and the sessions dir) if this is its first write"""
+        if self.f is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self.f = open(self.path, "ab")
+            self.idx = open(self.path.with_suffix(".idx"), "ab")
+            self.end = self.f.tell()
+
+    def append(self, msgs):
+        self.open()
+        ends = []
+        for m in msgs:
+            line = (json.dumps(_pack(m), ensure_ascii=False) + "\n").encode("utf-8")
+            self.f.write(line)
+            self.end += len(line)
+            ends.append(self.end)
+        self.f.flush()
+        self.idx.write(struct.pack(f"<{len(ends)}Q", *ends))
+        self.idx.flush()
+
+    def sync(self):
+        if self.f is not None:
+            os.fsync(self.f.fileno())
+            os.fsync(self.idx.fileno())
+
+    def close(self):
+        if self.f is not None:
+            self.f.close()
+            self.idx.close()
+            self.f = None
+
+    @property
+    def size(self):
+        try:
+            return self.path.stat().st_size
+        except FileNotFoundError:
+            return 0
+
+
+# ─ blob store: message fields of BLOB_MIN+ chars (big tool results, mostly) are kept
+# once per content under sessions/blobs/<sha256>, compressed; log lines carry
+# "_blobs": {field: [sha, bytes]} instead
+BLOB_MIN = 2048
+BLOB_GRACE = (
+    3600  # gc spares unreferenced blobs this recent: a writer may be about to log them
+)
+
+
+def _blob_dir():
+    return _sessions_dir() / "blobs"
+
+
+def _blob_put(text):
+    data = text.encode("utf-8")
+    h = hashlib.sha256(data).hexdigest()
+    d = _blob_dir() / h[:2]
+    for ext in (".xz", ".z"):
+        try:
+            os.utime(d / (h + ext))  # already stored; the touch keeps gc off it
+            return h, len(data)
+        except FileNotFoundError:
+            pass
+    try:
+        import lzma
+
+        blob, ext = lzma.compress(data), ".xz"
+    except ImportError:  # python built without liblzma
+        blob, ext = zlib.compress(data, 9), ".z"
+    _write_atomic(d / (h + ext), blob)
+    return h, len(data)
+
+
+def _blob_get(h):
+    p = _blob_dir() / h[:2] / h
+    try:
+        return zlib.decompress(p.with_suffix(".z").read_bytes()).decode("utf-8")
+    except FileNotFoundError:
+        import lzma
+
+        return lzma.decompress(p.with_suffix(".xz").read_bytes()).decode("utf-8")
+
+
+def _pack(m):
+    """m as logged: big string fields replaced by blob references"""
+    big = [k for k, v in m.items() if isinstance(v, str) and len(v) >= BLOB_MIN]
+    if not big:
+        return m
+    out = {k: v for k, v in m.items() if k not in big}
+    out["_blobs"] = {k: _blob_put(m[k]) for k in big}
+    return out
+
+
+def _unpack(m):
+    for k, (h, _) in m.pop("_blobs", {}).items():
+        m[k] = _blob_get(h)
+    return m
+
+
+def _blob_refs():
+    """(sha → bytes of every blob a session log refers to, bytes over all references)"""
+    refs, total = {}, 0
+    for p in _sessions_dir().glob("*.jsonl"):
+        with open(p, "rb") as f:
+            for line in f:
+                if b'"_blobs"' not in line:
+                    continue
+                try:
+                    found = json.loads(line)["_blobs"].values()
+                except (ValueError, KeyError, AttributeError):
+                    continue
+                refs.update(found)
+                total += sum(n for _, n in found)
+    return refs, total
+
+
+def _blobs():
+    return [p for p in _blob_dir().glob("*/*") if p.suffix in (".xz", ".z")]
+
+
+def blob_stats():
+    """how much the blob store holds and saves: bytes the logs refer to (counting
+    every repeat) against what the referenced blobs take on disk"""
+    refs, total = _blob_refs()
+    st = {
+        "blobs": 0,
+        "stored": 0,
+        "referenced": total,
+        "unreferenced": 0,
+        "unreferenced_bytes": 0,
+    }
+    for p in _blobs():
+        size = p.stat().st_size
+        st["blobs"] += 1
+        st["stored"] += size
+        if p.stem not in refs:
+            st["unreferenced"] += 1
+            st["unreferenced_bytes"] += size
+    st["saved"] = total - (st["stored"] - st["unreferenced_bytes"])
+    return st
+
+
+def blob_gc(grace=None):
+    """delete blobs no session log refers to; returns (count, bytes) freed"""
+    refs, _ = _blob_refs()
+    old = time.time() - (BLOB_GRACE if grace is None else grace)
+    n = freed = 0
+    for p in _blobs():
+        st = p.stat()
+        if p.stem not in refs and st.st_mtime < old:
+            with contextlib.suppress(FileNotFoundError):
+                p.unlink()
+                n, freed = n + 1, freed + st.st_size
+    return n, freed
+
+
+def _log_msgs(msgs):
+    log = _ag().log
+    if log is not None and msgs:
+        log.append(msgs)
+
+
+def read_log(path, limit=None):
+    """the messages in a session log, stopping at byte limit (a torn last line from a
+    killed process is skipped)"""
+    msgs = []
+    try:
+        f = open(path, "rb")
+    except FileNotFoundError:
+        return msgs
+    with f:
+        pos = 0
+        for line in f:
+            pos += len(line)
+            if limit is not None and pos > limit:
+                break
+            try:
+                m = json.loads(line)
+            except ValueError:
+                continue
+            if "from" in m:
+                msgs = read_log(
+                    pathlib.Path(path).parent / m["from"]["log"], m["from"]["bytes"]
+                )
+            else:
+                msgs.append(_unpack(m))
+    return msgs
+
+
+def _resolve(name):
+    """pointer to a session saved under name or with that id, or the message list of
+    one saved before the log existed (a plain json list)"""
+    d = _sessions_dir()
+    p = d / f"{name}.json"
+    if p.exists():
+        return json.loads(p.read_text(encoding="utf-8"))
+    p = d / f"{name}.jsonl"
+    if p.exists():
+        return {"log": p.name, "bytes": p.stat().st_size}
+    raise FileNotFoundError(f"session {name} not found")
+
+
+def load_session(name):
+    """(messages, pointer) of a saved session; pointer is None for legacy ones"""
+    ptr = _resolve(name)
+    if isinstance(ptr, list):
+        return ptr, None
+    return read_log(_sessions_dir() / ptr["log"], ptr["bytes"]), ptr
+
+
+def _line_ends(path, start):
+    """end offsets of the complete lines of path from byte start on"""
+    ends = []
+    with open(path, "rb") as f:
+        f.seek(start)
+        pos = start
+        while True:
+            chunk = f.read(1 << 20)
+            if not chunk:
+                return ends
+            i = chunk.find(b"\n")
+            while i >= 0:
+                ends.append(pos + i + 1)
+                i = chunk.find(b"\n", i + 1)
+            pos += len(chunk)
+
+
+class _Lines:
+    """line offsets of one log, read from its .idx a few entries at a time. lines a
+    crash left out of the .idx are found by scanning past its last entry; a log from
+    before the .idx gets one built"""
+
+    def __init__(self, path):
+        self.path, self.ip = path, path.with_suffix(".idx")
+        if not self.ip.exists():
+            ends = _line_ends(path, 0)
+            _write_atomic(self.ip, struct.pack(f"<{len(ends)}Q", *ends))
+        self.n = self.ip.stat().st_size // 8
+        self.extra = _line_ends(path, self.end(self.n - 1))
+        self.total = self.n + len(self.extra)
+
+    def end(self, i):
+        if i < 0:
+            return 0
+        if i >= self.n:
+            return self.extra[i - self.n]
+        with open(self.ip, "rb") as f:
+            f.seek(i * 8)
+            return struct.unpack("<Q", f.read(8))[0]
+
+    def count(self, limit):
+        """lines wholly within the first limit bytes"""
+        lo, hi = 0, self.total
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.end(mid) <= limit:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def read(self, i):
+        start = self.end(i - 1)
+        with open(self.path, "rb") as f:
+            f.seek(start)
+            return json.loads(f.read(self.end(i) - start))
+
+
+class _LogView:
+    """the messages of a saved session by position, across the logs it continues,
+    each read from disk only when asked for"""
+
+    def __init__(self, path, limit):
+        self.segs = []  # (lines, first line, message count), oldest first
+        self._add(path, limit)
+        self.n = sum(k for _, _, k in self.segs)
+
+    def _add(self, path, limit):
+        if not path.exists():
+            return
+        ln = _Lines(path)
+        k, first = ln.count(limit), 0
+        if k:
+            m = ln.read(0)
+            if "from" in m:
+                self._add(path.parent / m["from"]["log"], m["from"]["bytes"])
+                first = 1
+        self.segs.append((ln, first, k - first))
+
+    def __getitem__(self, i):
+        for ln, first, k in self.segs:
+            if i < k:
+                return _unpack(ln.read(first + i))
+            i -= k
+        raise IndexError(i)
+
+
+# ─ agent
+class _Null:
+    """transcript sink for quiet agents"""
+
+    def write(self, s):
+        return len(s)
+
+    def flush(self):
+        pass
+
+
+class Agent:
+    """one chat session: model and provider settings, history, and per-session state
+    (tool-mode fallbacks, timing stats, context budget, spinner, output). settings
+    default to the module-level ones (cli flags / config); any name in _SETTINGS can
+    be passed as a keyword. agents share nothing mutable, so many can run in one
+    process, each driven by one thread at a time.
+
+        ag = Agent("groq:llama-3.1-8b-instant", groq_key=key, cwd="/src/app")
+        if ag.turn("what does main.py do?") == "ok":
+            print(ag.reply)
+
+    quiet agents (the default) print nothing, never prompt, and deny tools that
+    need approval unless auto_approve=True or approve= is given: a callable taking the
+    tool name and args and returning whether to run it. out= takes a transcript stream. skills=
+    reuses an already discovered skill list instead of scanning cwd again. log=True
+    writes every message to the session log as it goes (save() and load() start it
+    otherwise)."""
+
+    def __init__(
+        self,
+        model=None,
+        cwd=None,
+        out=None,
+        quiet=True,
+        skills=None,
+        log=False,
+        approve=None,
+        **settings,
+    ):
+        unknown = set(settings) - set(_SETTINGS)
+        if unknown:
+            raise TypeError(f"unknown Agent setting(s): {', '.join(sorted(unknown))}")
+        for k in _SETTINGS:
+            setattr(self, k, getattr(_MODULE, k))
+        # own copies of everything a session mutates
+        self.ctx_override = dict(self.ctx_override)
+        self.fallback = list(self.fallback)
+        self.no_tools_models = set(self.no_tools_models)
+        self.stats, self.ttft_limit, self.msgs = [], None, []
+        self.cancelled, self.live = False, None
+        self._new_session(log)
+        self.cwd = os.path.abspath(cwd) if cwd else None
+        self.out, self.approve = out, approve
+        if quiet:
+            self.sp, self.interactive = Spin(), False
+            self.sp.on = False
+            if out is None:
+                self.out = _Null()
+        for k, v in settings.items():
+            setattr(self, k, v)
+        self.skills, self._sysp, self._picked, self._older = skills, None, None, None
+        self.set_model(model or self.model)
+
+    @contextlib.contextmanager
+    def active(self):
+        """make this the session module-level functions act on, in this thread"""
+        prev = getattr(_LOCAL, "agent", None)
+        _LOCAL.agent = self
+        try:
+            yield self
+        finally:
+            _LOCAL.agent = prev
+
+    def set_model(self, model):
+        with self.active():
+            update_model(model)
+            refresh_budget()
+
+    @property
+    def system(self):
+        """system prompt (skills are discovered once, from cwd)"""
+        if self._sysp is None:
+            self._select(None)
+        return self._sysp
+
+    def _select(self, query):
+        """list the skills most relevant to query in the system prompt; it is only
+        rebuilt when that set changes, and a query matching nothing keeps the last"""
+        with self.active():
+            if self.skills is None:
+                self.skills = load_skills()
+            picked = pick_skills(self.skills, query)
+            if picked is None:
+                keep = set(self._picked or ())
+                picked = [s for s in self.skills if s["name"] in keep] or self.skills[
+                    :SKILLS_TOP_K
+                ]
+            names = [s["name"] for s in picked]
+            if self._sysp is None or names != self._picked:
+                self._picked = names
+                self._sysp = system_prompt(
+                    picked, self.cwd, len(self.skills) - len(picked)
+                )
+
+    def warm(self):
+        """preload an ollama model in the background (None for other providers)"""
+        sysp = self.system
+        with self.active():
+            return warm_ollama(sysp)
+
+    def turn(self, prompt):
+        """add prompt and run the agent loop until the model answers.
+        returns ok | error | interrupted | max_rounds"""
+        self._select(prompt)  # fixed for every round of this turn
+        sysp = self._sysp
+        self.msgs.append({"role": "user", "content": prompt})
+        self.cancelled = False
+        with self.active():
+            try:
+                return run_turn(self.msgs, sysp, sysp + XML_TOOL_INST)
+            finally:
+                if self.log is not None:
+                    self.log.sync()
+
+    def cancel(self):
+        """stop the running turn from another thread, as Ctrl-C does in the repl: the
+        partial reply is kept and tools not yet run are skipped"""
+        self.cancelled = True
+        try:  # wake a read blocked waiting on the provider
+            self.live.fp.raw._sock.shutdown(socket.SHUT_RDWR)
+        except Exception:
+            pass  # nothing streaming, or a replay
+
+    @property
+    def reply(self):
+        """text of the last assistant message"""
+        for m in reversed(self.msgs):
+            if m.get("role") == "assistant":
+                return m.get("content") or ""
+        return ""
+
+    def clear(self):
+        """start over, as a new session"""
+        self.msgs, self._older = [], None
+        self.stats.clear()
+        self._new_session(self.log is not None)
+
+    def _new_session(self, log):
+        if getattr(self, "log", None) is not None:
+            self.log.close()
+        self.session = time.strftime("%Y%m%d-%H%M%S-") + os.urandom(3).hex()
+        self.log = (
+            SessionLog(_sessions_dir() / f"{self.session}.jsonl") if log else None
+        )
+
+    def save(self, name):
+        """name the session as it is now: a pointer to the current end of its log"""
+        if self.log is None:
+            self.log = SessionLog(_sessions_dir() / f"{self.session}.jsonl")
+            self.log.append(self.msgs)
+        self.log.open()  # an empty session still needs a log to point at
+        self.log.sync()
+        p = _sessions_dir() / f"{name}.json"
+        _write_atomic(
+            p, json.dumps({"log": self.log.path.name, "bytes": self.log.size})
+        )
+        try:
+            from . import sessions
+
+            sessions.index()
+        except ImportError:
+            pass  # no sqlite3: nothing to search with anyway
+
+    def load(self, name):
+        """continue a saved session (by name or session id) in a new log that refers
+        back to it. only the newest messages that fit the history budget are read,
+        plus the first user message; more() pulls in older ones. returns the number
+        of messages loaded"""
+        ptr = _resolve(name)
+        self.clear()
+        if self.log is None:  # what is left on disk is only reachable through the log
+            self.log = SessionLog(_sessions_dir() / f"{self.session}.jsonl")
+        if isinstance(ptr, list):  # saved before the log: all in one json anyway
+            self.msgs = ptr
+            self.log.append(ptr)
+            return len(ptr)
+        view = _LogView(_sessions_dir() / ptr["log"], ptr["bytes"])
+        pin = 0
+        while pin < view.n and view[pin].get("role") != "user":
+            pin += 1
+        first = [view[pin]] if pin < view.n else []
+        pin = pin if first else -1
+        limit = self.budget["history"] - len(self.system) // 4
+        lo, used, tail = view.n, 0, []
+        while lo > pin + 1:
+            m = view[lo - 1]
+            size = (len(json.dumps(m)) + 2) // 4  # as truncate_history counts
+            if used + size > limit and tail:
+                break
+            used += size
+            lo -= 1
+            tail.insert(0, m)
+        self._older = {"view": view, "pin": pin, "first": first, "lo": lo}
+        self.msgs = first + self._widen(tail)
+        self.log.append([{"from": ptr}])
+        return len(self.msgs)
+
+    def _widen(self, got):
+        """got (the loaded session's oldest messages read so far), extended back so it
+        does not start with tool results cut off from the call that asked for them"""
+        o = self._older
+        while got and got[0].get("role") == "tool" and o["lo"] > o["pin"] + 1:
+            o["lo"] -= 1
+            got.insert(0, o["view"][o["lo"]])
+        return got
+
+    @property
+    def older(self):
+        """messages of the loaded session still on disk"""
+        return self._older["lo"] - self._older["pin"] - 1 if self._older else 0
+
+    def more(self, n=20):
+        """read up to n more of the loaded session's older messages back into the
+        history, after its first user message; returns how many"""
+        if not self.older:
+            return 0
+        o = self._older
+        lo = max(o["pin"] + 1, o["lo"] - n)
+        got = [o["view"][i] for i in range(lo, o["lo"])]
+        o["lo"] = lo
+        got = self._widen(got)
+        at = 1 if o["first"] and self.msgs and self.msgs[0] is o["first"][0] else 0
+        self.msgs[at:at] = got
+        return len(got)
+
+
+def headless(prompt, as_json=False):
+    """run one agent turn without a terminal: no banner, readline, spinner or
+    approval prompts. with as_json, stdout carries only ndjson events and the
+    human-readable transcript goes to stderr. returns the exit status"""
+    if as_json:
+        ag = Agent(out=sys.stderr, events=sys.stdout)
+    else:
+        ag = Agent(out=sys.stdout)
+    try:
+        status = ag.turn(prompt)
+    except KeyboardInterrupt:
+        status = "interrupted"
+    with ag.active():
+        _emit("done", status=status, text=ag.reply, stats=stats_summary(ag.stats))
+    return {"ok": 0, "interrupted": 130}.get(status, 1)
+
+
 # ─ main
 def main(argv=None):
     # Parse command line arguments
@@ -984,9 +3230,42 @@ def main(argv=None):
         GEMINI_KEY, \
         GEMINI_HOST, \
         AUTO_APPROVE, \
+        CTX_OVERRIDE, \
+        FALLBACK, \
+        FAILOVER_TTFT, \
+        COOLDOWN, \
+        KEEP_ALIVE, \
+        CONNECT_TIMEOUT, \
+        FIRST_BYTE_TIMEOUT, \
+        IDLE_TIMEOUT, \
+        RECORD_DIR, \
+        REPLAY_DIR, \
+        REPLAY_TIMING, \
         PROVIDER, \
         ACTUAL_MODEL
 
+    argv = sys.argv[1:] if argv is None else list(argv)
+    if argv[:1] == ["mock"]:
+        from . import mock
+
+        return mock.main(argv[1:])
+    if argv[:1] == ["bench"]:
+        from . import bench
+
+        return bench.main(argv[1:])
+    if argv[:1] == ["batch"]:
+        from . import batch
+
+        return batch.main(argv[1:])
+    if argv[:1] == ["usage"]:
+        from . import usage
+
+        return usage.main(argv[1:])
+    if argv[:1] == ["serve"]:
+        from . import serve
+
+        return serve.main(argv[1:])
+
     _def = _get_default_args()
     A = argparse.ArgumentParser(prog="chalilulz")
     A.add_argument(
@@ -1013,6 +3292,75 @@ def main(argv=None):
         default=_def.gemini_host,
         help="Gemini OpenAI-compatible base URL",
     )
+    A.add_argument(
+        "--ctx",
+        type=int,
+        default=None,
+        help="Context window in tokens (default: from provider model metadata)",
+    )
+    A.add_argument(
+        "--fallback",
+        default=",".join(_def.fallback),
+        help="Comma-separated failover chain, e.g. openrouter:x,ollama:y",
+    )
+    A.add_argument(
+        "--failover-ttft",
+        type=float,
+        default=_def.failover_ttft,
+        help="Seconds to wait for a first token before failing over",
+    )
+    A.add_argument(
+        "--keep-alive",
+        default=_def.keep_alive,
+        help="How long Ollama keeps the model loaded (e.g. 30m, -1 for forever)",
+    )
+    A.add_argument(
+        "--connect-timeout",
+        type=float,
+        default=_def.connect_timeout,
+        help="Seconds to connect to the provider",
+    )
+    A.add_argument(
+        "--first-byte-timeout",
+        type=float,
+        default=_def.first_byte_timeout,
+        help="Seconds to wait for the first token",
+    )
+    A.add_argument(
+        "--idle-timeout",
+        type=float,
+        default=_def.idle_timeout,
+        help="Seconds allowed between streamed chunks",
+    )
+    A.add_argument("--record", metavar="DIR", help="Record provider streams to DIR")
+    A.add_argument(
+        "--replay", metavar="DIR", help="Replay recorded provider streams from DIR"
+    )
+    A.add_argument(
+        "--replay-timing",
+        action="store_true",
+        help="Reproduce recorded latency when replaying",
+    )
+    A.add_argument(
+        "-p",
+        "--print",
+        nargs="?",
+        const="-",
+        metavar="PROMPT",
+        help="Run one turn non-interactively and exit (no PROMPT or - reads stdin)",
+    )
+    A.add_argument(
+        "--json",
+        action="store_true",
+        help="With -p, write newline-delimited JSON events to stdout",
+    )
+    A.add_argument(
+        "--attach",
+        nargs="?",
+        const="",
+        metavar="ADDR",
+        help="Run the session on a `chalilulz serve` daemon (socket path or host:port)",
+    )
     A.add_argument(
         "--yes",
         "-y",
@@ -1033,18 +3381,66 @@ def main(argv=None):
     GEMINI_KEY = ARGS.gemini_key
     GEMINI_HOST = ARGS.gemini_host
     AUTO_APPROVE = ARGS.yes
+    ctx = _def.context
+    CTX_OVERRIDE = dict(ctx) if isinstance(ctx, dict) else {"*": ctx}
+    if ARGS.ctx:
+        CTX_OVERRIDE["*"] = ARGS.ctx
+    FALLBACK = [m.strip() for m in ARGS.fallback.split(",") if m.strip()]
+    FAILOVER_TTFT = ARGS.failover_ttft
+    COOLDOWN = _def.cooldown
+    ka = str(ARGS.keep_alive)
+    KEEP_ALIVE = (
+        int(ka) if ka.lstrip("-").isdigit() else ka
+    )  # ollama wants -1, not "-1"
+    CONNECT_TIMEOUT = ARGS.connect_timeout
+    FIRST_BYTE_TIMEOUT = ARGS.first_byte_timeout
+    IDLE_TIMEOUT = ARGS.idle_timeout
+    # config limits sit under the CHALILULZ_RPM / _TPM ones batch hands its workers
+    for lim, conf in ((RATE_LIMIT, _def.rpm), (TOKEN_LIMIT, _def.tpm)):
+        for k, v in (conf if isinstance(conf, dict) else {"*": conf}).items():
+            lim.setdefault(k, v)
+    PRICES.update({k: tuple(v) for k, v in _def.prices.items()})
+    RECORD_DIR, REPLAY_DIR, REPLAY_TIMING = ARGS.record, ARGS.replay, ARGS.replay_timing
 
     # Initialize provider and actual model
     update_model(MODEL)
 
+    if ARGS.attach is not None:  # the daemon holds the keys and does the work
+        from . import serve
+
+        prompt = None
+        if ARGS.print is not None:
+            prompt = sys.stdin.read() if ARGS.print == "-" else ARGS.print
+        settings = {k: getattr(_MODULE, k) for k in serve.FORWARD}
+        return serve.attach(
+            ARGS.attach or None, MODEL, AUTO_APPROVE, prompt, ARGS.json, settings
+        )
+
+    # Check API key for current provider
+    required_key = get_required_key(PROVIDER)
+    if required_key is not None and not required_key and not REPLAY_DIR:
+        print(f"\n {Re}✗ set API key for {PROVIDER} provider{R}\n")
+        sys.exit(1)
+
+    if ARGS.print is not None:
+        prompt = sys.stdin.read() if ARGS.print == "-" else ARGS.print
+        if not prompt.strip():
+            print(f" {Re}✗ empty prompt{R}", file=sys.stderr)
+            return 1
+        return headless(prompt.strip(), ARGS.json)
+
     try:
         import readline, glob
 
         COMMANDS = [
             "/model ",
             "/skills",
+            "/stats",
+            "/usage",
             "/save ",
             "/load ",
+            "/sessions ",
+            "/more",
             "/yes",
             "/no",
             "/q",
@@ -1072,34 +3468,14 @@ def main(argv=None):
     except ImportError:
         pass
 
-    # Check API key for current provider
-    required_key = get_required_key(PROVIDER)
-    if required_key is not None and not required_key:
-        print(f"\n {Re}✗ set API key for {PROVIDER} provider{R}\n")
-        sys.exit(1)
-
-    MAX_TOOL_ROUNDS = 25
-    cwd = os.getcwd()
-    skills = load_skills()
+    ag = Agent(MODEL, quiet=False, log=True)
+    ag.system  # discovers skills for the banner
     sep("═", Bo + C)
-    print(f" {Bo}◆ chalilulz{R}  {D}{MODEL}{R}")
-    print(f" {D}cwd:{cwd}  skills:{len(skills)}{R}")
+    print(f" {Bo}◆ chalilulz{R}  {D}{ag.model}{R}")
+    print(f" {D}cwd:{os.getcwd()}  skills:{len(ag.skills)}{R}")
     sep("═", Bo + C)
     print(f" {D}/q quit  /c clear  /model <slug>  /skills list  /help{R}\n")
-    SP_PART = skills_prompt(skills)
-    SYS = f"""You are Chalilulz, an expert, concise agentic coding assistant.
-Environment: OS={sys.platform}, CWD={cwd}
-
-Guidelines:
-1. Be extremely concise. No filler, pleasantries, or wrapping text.
-2. Think step-by-step silently before acting.
-3. Use tools efficiently. Chain them together to analyze, plan, and execute.
-4. When writing/editing files, ensure you understand the surrounding code. Use the read tool first if unsure.
-5. Stop and ask the user for clarification if you are stuck or need architectural decisions.
-6. Do not enter infinite loops. If you encounter the same error multiple times, ask the user for help.
-{SP_PART}"""
-    XML_SYS = SYS + XML_TOOL_INST
-    msgs = []
+    ag.warm()
     while True:
         try:
             sep()
@@ -1114,49 +3490,108 @@ Guidelines:
                 print(f"\n {D}bye{R}")
                 break
             if ui == "/c":
-                msgs = []
+                ag.clear()
                 print(f"\n {Gr}✓ cleared{R}")
                 continue
             if ui == "/yes":
-                AUTO_APPROVE = True
+                ag.auto_approve = True
                 print(f"\n {Gr}✓ auto-approve enabled{R}")
                 continue
             if ui == "/no":
-                AUTO_APPROVE = False
+                ag.auto_approve = False
                 print(f"\n {Gr}✓ auto-approve disabled{R}")
                 continue
             if ui.startswith("/save "):
                 name = ui[6:].strip()
-                p = (
-                    pathlib.Path.home()
-                    / ".local"
-                    / "share"
-                    / "chalilulz"
-                    / "sessions"
-                    / f"{name}.json"
-                )
-                p.parent.mkdir(parents=True, exist_ok=True)
-                p.write_text(json.dumps(msgs), encoding="utf-8")
+                ag.save(name)
                 print(f"\n {Gr}✓ saved session to {name}{R}")
                 continue
             if ui.startswith("/load "):
                 name = ui[6:].strip()
-                p = (
-                    pathlib.Path.home()
-                    / ".local"
-                    / "share"
-                    / "chalilulz"
-                    / "sessions"
-                    / f"{name}.json"
-                )
-                if p.exists():
-                    try:
-                        msgs = json.loads(p.read_text(encoding="utf-8"))
-                        print(f"\n {Gr}✓ loaded session {name} ({len(msgs)} msgs){R}")
-                    except Exception as e:
-                        print(f"\n {Re}✗ failed to load session: {e}{R}")
-                else:
+                try:
+                    n = ag.load(name)
+                    print(f"\n {Gr}✓ loaded session {name} ({n} msgs){R}")
+                    if ag.older:
+                        print(
+                            f" {D}{ag.older} older msgs left on disk: /more [n] to read them in{R}"
+                        )
+                except FileNotFoundError:
                     print(f"\n {Re}✗ session {name} not found{R}")
+                except Exception as e:
+                    print(f"\n {Re}✗ failed to load session: {e}{R}")
+                continue
+            if ui == "/more" or ui.startswith("/more "):
+                arg = ui[5:].strip()
+                if arg and not arg.isdigit():
+                    print(f"\n {Re}✗ usage: /more [n]{R}")
+                    continue
+                n = ag.more(int(arg or 20))
+                print(f"\n {Gr}✓ read {n} older msgs{R} {D}({ag.older} left){R}")
+                continue
+            if ui.startswith("/sessions"):
+                sub = ui[9:].strip()
+                if sub.startswith("search"):
+                    from . import sessions
+
+                    t0 = time.perf_counter()
+                    hits = sessions.search(sub[6:], hl=(Bo + Y, R))
+                    if not hits:
+                        print(f"\n {D}no matches{R}")
+                    for h in hits:
+                        names = f" ({', '.join(h['names'])})" if h["names"] else ""
+                        print(f"\n  {C}{h['session']}{R}{names}")
+                        print(f"   {D}{h['role']}:{R} {h['snippet']}")
+                    print(
+                        f"\n {D}{len(hits)} sessions · {(time.perf_counter() - t0) * 1000:.0f} ms · /load <session> to resume{R}"
+                    )
+                elif sub == "gc":
+                    n, freed = blob_gc()
+                    print(
+                        f"\n {Gr}✓ removed {n} unreferenced blobs ({freed / 1e6:.1f} MB){R}"
+                    )
+                elif sub == "stats":
+                    st = blob_stats()
+                    print(f"\n {Bo}Session blob store:{R}")
+                    print(
+                        f"  {C}{'blobs':<16}{R} {st['blobs']} ({st['stored'] / 1e6:.1f} MB on disk)"
+                    )
+                    print(
+                        f"  {C}{'referenced':<16}{R} {st['referenced'] / 1e6:.1f} MB as logged"
+                    )
+                    print(f"  {C}{'saved':<16}{R} {st['saved'] / 1e6:.1f} MB")
+                    if st["unreferenced"]:
+                        print(
+                            f"  {D}{st['unreferenced']} unreferenced ({st['unreferenced_bytes'] / 1e6:.1f} MB): /sessions gc{R}"
+                        )
+                else:
+                    print(f"\n {Re}✗ usage: /sessions search <query> | stats | gc{R}")
+                continue
+            if ui == "/stats":
+                st = stats_summary(ag.stats)
+                if not st:
+                    print(f"\n {D}no rounds yet{R}")
+                    continue
+                print(f"\n {Bo}Session timing ({st['rounds']} rounds):{R}")
+                for k, lbl, unit in (
+                    ("connect", "avg connect", "s"),
+                    ("ttft", "avg first token", "s"),
+                    ("tps", "avg generation", " tok/s"),
+                    ("model", "total model", "s"),
+                    ("tools", "total tools", "s"),
+                ):
+                    if st[k] is not None:
+                        print(f"  {C}{lbl:<16}{R} {st[k]:.2f}{unit}")
+                continue
+            if ui == "/usage":
+                from . import usage
+
+                print(f"\n {Bo}This session:{R}")
+                usage.table(
+                    usage.rollup(usage.load(session=ag.session), "model"), "model"
+                )
+                print(f"\n {Bo}Today:{R}")
+                day = time.mktime(time.strptime(time.strftime("%Y-%m-%d"), "%Y-%m-%d"))
+                usage.table(usage.rollup(usage.load(since=day), "model"), "model")
                 continue
             if ui == "/help":
                 print(f"\n {Bo}Commands:{R}")
@@ -1164,84 +3599,53 @@ Guidelines:
                 print(f"  {C}/c{R}               Clear session")
                 print(f"  {C}/model <slug>{R}    Change model (e.g., ollama:llama3)")
                 print(f"  {C}/skills{R}          List loaded skills")
+                print(f"  {C}/stats{R}           Show session latency breakdown")
+                print(
+                    f"  {C}/usage{R}           Tokens and cost, this session and today"
+                )
                 print(f"  {C}/yes, /no{R}        Toggle auto-approve for tools")
                 print(f"  {C}/save <name>{R}     Save current session")
                 print(f"  {C}/load <name>{R}     Load a saved session")
+                print(
+                    f"  {C}/more [n]{R}        Read n older msgs of a loaded session back in"
+                )
+                print(
+                    f"  {C}/sessions search <q>{R} Find past sessions by prompt, reply or tool"
+                )
+                print(
+                    f"  {C}/sessions stats{R}  Space the session blob store saves (gc: prune it)"
+                )
                 print(f"  {C}/help{R}            Show this help")
                 continue
             if ui.startswith("/model "):
-                new_model = ui[7:].strip()
-                update_model(new_model)
-                required_key = get_required_key(PROVIDER)
+                ag.set_model(ui[7:].strip())
+                with ag.active():
+                    required_key = get_required_key(ag.provider)
                 if required_key is None:
                     pass
                 elif not required_key:
-                    print(f"\n {Y}⚠ missing API key for {PROVIDER} provider{R}")
-                print(f"\n {Gr}✓ model→{Bo}{MODEL}{R}")
+                    print(f"\n {Y}⚠ missing API key for {ag.provider} provider{R}")
+                ag.warm()
+                print(f"\n {Gr}✓ model→{Bo}{ag.model}{R}")
+                if ag.actual_model in ag.no_tools_models:
+                    print(f" {D}no native tools (cached) — using XML tool mode{R}")
                 continue
             if ui == "/skills":
-                if not skills:
+                if not ag.skills:
                     print(f"\n {D}no skills found{R}")
                 else:
                     print(f"\n {Bo}Skills:{R}")
-                    for s in skills:
+                    for s in ag.skills:
                         print(f"  {C}{s['name']}{R} {D}{s['desc'][:80]}{R}")
-                    print(f"  {D}paths:{[s['path'] for s in skills]}{R}")
+                    print(f"  {D}paths:{[s['path'] for s in ag.skills]}{R}")
                 continue
-            msgs.append({"role": "user", "content": ui})
             sep()
-            rounds = 0
-            while True:
-                curr_tokens = len(json.dumps(msgs)) // 4
-                while curr_tokens > 60000 and len(msgs) > 5:
-                    print(
-                        f"\n {Y}⚠ context large (~{curr_tokens} tokens) — auto-truncating oldest messages{R}"
-                    )
-                    msgs.pop(0)
-                    curr_tokens = len(json.dumps(msgs)) // 4
-
-                if rounds >= MAX_TOOL_ROUNDS:
-                    print(
-                        f"\n {Y}⚠ max tool rounds ({MAX_TOOL_ROUNDS}) reached — stopping to prevent infinite loop{R}\n"
-                    )
-                    break
-                rounds += 1
-                SP.start()
-                try:
-                    resp, use_tools = call_api(
-                        msgs, SYS if ACTUAL_MODEL not in NO_TOOLS_MODELS else XML_SYS
-                    )
-                except Exception as e:
-                    SP.stop()
-                    print(f"\n {Re}✗ {e}{R}\n")
-                    msgs.pop()
-                    break
-                SP.stop()
-                ch = resp["choices"][0]
-                msg = ch["message"]
-                usage = resp.get("usage", {})
-                if usage:
-                    print(
-                        f" {D}↑{usage.get('prompt_tokens', '-')} ↓{usage.get('completion_tokens', '-')}{R}"
-                    )
-                text = (msg.get("content") or "").strip()
-                calls = msg.get("tool_calls") or []
-                if use_tools:
-                    msgs.append(msg)
-                    if not calls:
-                        break
-                    _do_tool_calls(calls, msgs, xml_mode=False)
-                else:
-                    # xml mode: strip tool_call tags from display just to clean history if needed
-                    display = TC_RE.sub("", text).strip()
-                    xml_calls = parse_xml_calls(text)
-                    msgs.append({"role": "assistant", "content": text})
-                    if not xml_calls:
-                        break
-                    _do_tool_calls(xml_calls, msgs, xml_mode=True)
-                print()
+            ag.turn(ui)
+        except KeyboardInterrupt:
+            ag.sp.stop()
+            print(f"\n {Y}⚠ interrupted{R}\n")
         except Exception as e:
-            SP.stop()
+            ag.sp.stop()
             print(f"\n {Re}✗ {e}{R}\n")
 
 
@@ -0,0 +1,181 @@
+"""chalilulz.batch — run many headless tasks concurrently
+
+each line of the tasks file is {"prompt", "cwd", "model"?, "id"?}. every task runs
+as its own `chalilulz -p --json` process (isolated history, caches and globals),
+up to --workers at a time. they share the per-provider-key rate limit store, so
+--rpm / --tpm (and limits learned from response headers) hold across all of them,
+and across other chalilulz processes using the same key. results are appended to
+a jsonl file as tasks finish, so an interrupted batch resumes where it left off.
+"""
+
+import argparse, json, os, subprocess, sys, threading, time
+from concurrent.futures import ThreadPoolExecutor
+
+
+def load_tasks(path):
+    """tasks from a jsonl file; id defaults to the 1-based line number"""
+    tasks = []
+    with open(path, encoding="utf-8") as f:
+        for n, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            t = json.loads(line)
+            if not t.get("prompt"):
+                raise ValueError(f"{path}:{n}: task has no prompt")
+            t.setdefault("id", str(n))
+            t["id"] = str(t["id"])
+            tasks.append(t)
+    return tasks
+
+
+def load_done(path, retry_failed=False):
+    """ids already recorded in a results file (only successful ones with retry_failed)"""
+    done = set()
+    try:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    r = json.loads(line)
+                except ValueError:
+                    continue  # torn last line from a killed run
+                if not retry_failed or r.get("status") == "ok":
+                    done.add(str(r.get("id")))
+    except FileNotFoundError:
+        pass
+    return done
+
+
+def _summarize(events):
+    """fold a task's ndjson events into usage / rounds / tools / final status"""
+    usage, rounds, tools, done, errors = {}, 0, 0, {}, []
+    for ev in events:
+        t = ev.get("type")
+        if t == "round":
+            rounds += 1
+            for k, v in (ev.get("usage") or {}).items():
+                if isinstance(v, (int, float)):
+                    usage[k] = usage.get(k, 0) + v
+        elif t == "tool_call":
+            tools += 1
+        elif t == "error":
+            errors.append(ev.get("message"))
+        elif t == "done":
+            done = ev
+    return {
+        "status": done.get("status", "error"),
+        "text": done.get("text", ""),
+        "usage": usage,
+        "rounds": rounds,
+        "tool_calls": tools,
+        "stats": done.get("stats") or {},
+        "error": errors[-1] if errors else None,
+    }
+
+
+def run_task(task, yes=False, timeout=None, env=None):
+    """run one task in a child process; returns its result record"""
+    cmd = [sys.executable, "-m", "chalilulz", "-p", "-", "--json"]
+    if task.get("model"):
+        cmd += ["--model", task["model"]]
+    if yes:
+        cmd.append("--yes")
+    t0 = time.perf_counter()
+    rec = {"id": task["id"], "cwd": task.get("cwd"), "model": task.get("model")}
+    try:
+        p = subprocess.run(
+            cmd,
+            input=task["prompt"],
+            cwd=task.get("cwd") or None,
+            env=env,
+            capture_output=True,
+            text=True,
+            timeout=timeout,
+        )
+        events = []
+        for line in p.stdout.splitlines():
+            try:
+                events.append(json.loads(line))
+            except ValueError:
+                pass
+        rec.update(_summarize(events), exit=p.returncode)
+        if p.returncode and not rec["error"]:
+            rec["error"] = p.stderr.strip()[-500:] or f"exit {p.returncode}"
+    except subprocess.TimeoutExpired:
+        rec.update(status="timeout", exit=None, error=f"no result within {timeout}s")
+    except OSError as e:
+        rec.update(status="error", exit=None, error=str(e))
+    rec["wall"] = time.perf_counter() - t0
+    return rec
+
+
+def run(tasks, out, workers=4, rpm=None, yes=False, timeout=None, retry_failed=False, log=None, tpm=None):
+    """run tasks not yet in out; returns the new result records"""
+    done = load_done(out, retry_failed)
+    todo = [t for t in tasks if t["id"] not in done]
+    env = dict(os.environ)
+    # children import the same chalilulz as this process, installed or not
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [root, env.get("PYTHONPATH")]))
+    if rpm:
+        env["CHALILULZ_RPM"] = json.dumps(rpm)
+    if tpm:
+        env["CHALILULZ_TPM"] = json.dumps(tpm)
+    lock, results = threading.Lock(), []
+
+    def one(task):
+        rec = run_task(task, yes, timeout, env)
+        with lock:
+            with open(out, "a", encoding="utf-8") as f:
+                f.write(json.dumps(rec) + "\n")
+            results.append(rec)
+            if log:
+                log(rec, len(results), len(todo))
+        return rec
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as ex:
+        list(ex.map(one, todo))
+    return results
+
+
+def _limits(vals):
+    """["60", "groq=30"] → {"*": 60, "groq": 30}"""
+    out = {}
+    for v in vals or []:
+        k, _, n = v.rpartition("=")
+        out[k or "*"] = float(n)
+    return out
+
+
+def main(argv=None):
+    A = argparse.ArgumentParser(prog="chalilulz batch", description=__doc__)
+    A.add_argument("tasks", help="JSONL file: one {prompt, cwd, model?, id?} per line")
+    A.add_argument("--workers", "-w", type=int, default=4, help="Tasks run at once")
+    A.add_argument("--out", "-o", help="Results JSONL (default: <tasks>.results.jsonl)")
+    A.add_argument(
+        "--rpm",
+        action="append",
+        metavar="[PROVIDER=]N",
+        help="Requests/min shared by all workers, per provider (repeatable)",
+    )
+    A.add_argument(
+        "--tpm",
+        action="append",
+        metavar="[PROVIDER=]N",
+        help="Tokens/min shared by all workers, per provider (repeatable)",
+    )
+    A.add_argument("--timeout", type=float, help="Seconds before a task is killed")
+    A.add_argument("--retry-failed", action="store_true", help="Re-run tasks that did not succeed")
+    A.add_argument("--yes", "-y", action="store_true", help="Auto-approve tool execution")
+    a = A.parse_args(argv)
+    out = a.out or os.path.splitext(a.tasks)[0] + ".results.jsonl"
+    tasks = load_tasks(a.tasks)
+
+    def log(rec, n, total):
+        u = rec.get("usage") or {}
+        tok = u.get("prompt_tokens", 0) + u.get("completion_tokens", 0)
+        print(f"  [{n}/{total}] {rec['id']}: {rec['status']}  {rec['wall']:.1f}s  {tok} tok", flush=True)
+
+    res = run(tasks, out, a.workers, _limits(a.rpm), a.yes, a.timeout, a.retry_failed, log, _limits(a.tpm))
+    bad = [r for r in res if r["status"] != "ok"]
+    print(f"  {len(res) - len(bad)} ok, {len(bad)} failed, {len(tasks) - len(res)} skipped → {out}")
+    return 1 if bad else 0
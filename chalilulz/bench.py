@@ -0,0 +1,283 @@
+"""chalilulz.bench — end-to-end agent-loop benchmark against the local mock provider
+
+runs scripted multi-round sessions (tool calls over a synthetic workspace, then a
+long answer) through the real run_turn loop, plus micro-benchmarks of stream
+parsing and history truncation. results are written as json and can be compared
+against a saved baseline; a regression past the threshold exits non-zero.
+"""
+
+import argparse, contextlib, json, os, platform, random, shutil, sys, tempfile, time, tracemalloc
+
+from .mock import MockLLM
+
+# metric → True if higher is better
+METRICS = {
+    "round_ms_p50": False,
+    "round_ms_p95": False,
+    "tools_ms_avg": False,
+    "sse_parse_mb_s": True,
+    "ndjson_parse_mb_s": True,
+    "truncate_ms": False,
+    "peak_rss_mb": False,
+}
+
+IGNORED = ["node_modules", ".git", "__pycache__", ".venv", "build"]
+
+
+def script(read_path):
+    """glob → grep → read → long answer, looping forever in the mock"""
+    return [
+        {"tool_calls": [{"name": "glob", "args": {"pat": "**/*.py"}}]},
+        {"tool_calls": [{"name": "grep", "args": {"pat": r"def f1\b", "path": "."}}]},
+        {"tool_calls": [{"name": "read", "args": {"path": read_path}}]},
+        {"content": " ".join(f"word{i}" for i in range(300))},
+    ]
+
+
+def make_repo(root, files=200, depth=3, fanout=6, size=2000, binary=0.05, ignored=0.2, seed=0):
+    """deterministic synthetic repo under root. files are spread over a tree of
+    fanout dirs per level up to depth; sizes are lognormal around size bytes (capped
+    at 64x); a binary fraction get random bytes, an ignored fraction land in
+    node_modules/.git/etc. returns the relative paths of text files written"""
+    rng = random.Random(seed)
+    exts = [".py", ".py", ".py", ".js", ".md", ".txt", ".json"]
+    text = []
+    for i in range(files):
+        parts = [f"d{rng.randrange(fanout)}" for _ in range(rng.randint(0, depth))]
+        if rng.random() < ignored:
+            parts.insert(rng.randint(0, len(parts)), rng.choice(IGNORED))
+        n = max(16, min(int(rng.lognormvariate(0, 1) * size), size * 64))
+        is_bin = rng.random() < binary
+        name = f"f{i}" + (".bin" if is_bin else rng.choice(exts))
+        rel = os.path.join(*parts, name)
+        full = os.path.join(root, rel)
+        os.makedirs(os.path.dirname(full), exist_ok=True)
+        if is_bin:
+            data = bytes(rng.getrandbits(8) for _ in range(min(n, 4096))) * (n // 4096 + 1)
+        else:
+            lines, k = [], 0
+            while sum(len(x) for x in lines) < n:
+                lines.append(f"def f{k}(x):\n    return x + {i}\n\n")
+                k += 1
+            data = "".join(lines)[:n].encode()
+        with open(full, "wb") as f:
+            f.write(data)
+        if not is_bin and not any(x in IGNORED for x in parts):
+            text.append(rel)
+    return text
+
+
+def _pct(xs, q):
+    xs = sorted(xs)
+    return xs[min(len(xs) - 1, int(q * len(xs)))] if xs else None
+
+
+def _peak_rss_mb():
+    try:
+        import resource
+    except ImportError:  # windows
+        return None
+    r = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return r / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def _parse_mb_s(c, ndjson, chunks=20000):
+    tok = "lorem ipsum "
+    if ndjson:
+        lines = [json.dumps({"message": {"content": tok}, "done": False}).encode() for _ in range(chunks)]
+        reader = c.read_ndjson_stream
+    else:
+        ev = {"choices": [{"delta": {"content": tok}}]}
+        lines = [b"data: " + json.dumps(ev).encode() for _ in range(chunks)]
+        reader = c.read_sse_stream
+    size = sum(len(x) for x in lines)
+    t0 = time.perf_counter()
+    reader(iter(lines))
+    return size / (time.perf_counter() - t0) / 1e6
+
+
+def _truncate_ms(c, n=3000):
+    msgs = [{"role": "user" if i % 2 else "assistant", "content": "x" * 400} for i in range(n)]
+    t0 = time.perf_counter()
+    c.truncate_history(msgs, n * 50)
+    return (time.perf_counter() - t0) * 1000
+
+
+@contextlib.contextmanager
+def _home(path):
+    """keep caches written during the run out of the user's data dir"""
+    env = os.environ.get("CHALILULZ_HOME")
+    os.environ["CHALILULZ_HOME"] = path
+    try:
+        yield
+    finally:
+        if env is None:
+            os.environ.pop("CHALILULZ_HOME", None)
+        else:
+            os.environ["CHALILULZ_HOME"] = env
+
+
+def run(sessions=5, files=200, provider="openai"):
+    """run the benchmark; returns the result dict (see METRICS)"""
+    import chalilulz as c
+
+    tmp = tempfile.mkdtemp(prefix="chalilulz-bench-")
+    ws = os.path.join(tmp, "ws")
+    os.makedirs(ws)
+    text = make_repo(ws, files, binary=0, ignored=0)
+    llm = MockLLM(script(text[0]), loop=True)
+    url = llm.start()
+    rounds, tools = [], []
+    t_all = time.perf_counter()
+    try:
+        with _home(os.path.join(tmp, "home")):
+            ag = c.Agent(
+                "ollama:mock" if provider == "ollama" else "groq:mock",
+                cwd=ws,
+                groq_host=url + "/v1",
+                groq_key="bench",
+                ollama_host=url,
+                auto_approve=True,
+                fallback=[],
+                ctx_override={"*": 32768},
+                record_dir=None,
+                replay_dir=None,
+            )
+            ag.no_tools_models.discard("mock")
+            for _ in range(sessions):
+                ag.clear()
+                status = ag.turn("survey this repo")
+                if status != "ok":
+                    raise RuntimeError(f"bench session ended with {status}")
+                for tm in ag.stats:
+                    rounds.append(tm.get("total", 0) * 1000)
+                    if tm.get("tools") is not None:
+                        tools.append(tm["tools"] * 1000)
+            with ag.active():
+                sse = _parse_mb_s(c, ndjson=False)
+                ndjson = _parse_mb_s(c, ndjson=True)
+            trunc = _truncate_ms(c)
+    finally:
+        llm.stop()
+        shutil.rmtree(tmp, ignore_errors=True)
+    metrics = {
+        "round_ms_p50": _pct(rounds, 0.5),
+        "round_ms_p95": _pct(rounds, 0.95),
+        "tools_ms_avg": sum(tools) / len(tools) if tools else None,
+        "sse_parse_mb_s": sse,
+        "ndjson_parse_mb_s": ndjson,
+        "truncate_ms": trunc,
+        "peak_rss_mb": _peak_rss_mb(),
+    }
+    return {
+        "version": c.__version__,
+        "python": platform.python_version(),
+        "platform": sys.platform,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {"sessions": sessions, "files": files, "provider": provider},
+        "rounds": len(rounds),
+        "wall_s": time.perf_counter() - t_all,
+        "metrics": metrics,
+    }
+
+
+# ─ scale
+# label → (tool fn name, args); path is filled in per repo
+SCALE_TOOLS = {
+    "glob": ("_gl", {"pat": "**/*.py"}),
+    "grep": ("_gp", {"pat": r"def f1\b"}),
+    "find": ("_fd", {"pat": "*.py"}),
+    "ls": ("_ls", {}),
+}
+
+
+def scale(sizes=(1000, 10000, 100000), **kw):
+    """wall time and python peak memory of each filesystem tool on synthetic repos
+    of each size (kw go to make_repo). memory comes from a second, traced run so
+    tracemalloc overhead stays out of the timings"""
+    import chalilulz as c
+
+    rows, metrics = [], {}
+    for n in sizes:
+        tmp = tempfile.mkdtemp(prefix="chalilulz-scale-")
+        try:
+            t0 = time.perf_counter()
+            make_repo(tmp, n, **kw)
+            gen = time.perf_counter() - t0
+            for label, (fn, args) in SCALE_TOOLS.items():
+                f, args = getattr(c, fn), dict(args, path=tmp)
+                t0 = time.perf_counter()
+                out = f(args)
+                ms = (time.perf_counter() - t0) * 1000
+                tracemalloc.start()
+                f(args)
+                peak = tracemalloc.get_traced_memory()[1] / 1024
+                tracemalloc.stop()
+                rows.append({"files": n, "tool": label, "ms": ms, "peak_kb": peak,
+                             "lines": out.count("\n") + 1, "gen_s": gen})
+                metrics[f"{label}_ms@{n}"] = ms
+                metrics[f"{label}_peak_kb@{n}"] = peak
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+    return {
+        "version": c.__version__,
+        "python": platform.python_version(),
+        "platform": sys.platform,
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": dict(kw, sizes=list(sizes)),
+        "rows": rows,
+        "metrics": metrics,
+    }
+
+
+def compare(cur, base, threshold=0.25):
+    """list of (metric, baseline, current, change) that regressed past threshold.
+    metrics not in METRICS (scale timings/memory) count as lower-is-better"""
+    out = []
+    for k, a in base.get("metrics", {}).items():
+        higher, b = METRICS.get(k, False), cur.get("metrics", {}).get(k)
+        if not a or b is None:
+            continue
+        change = (b - a) / a
+        if (-change if higher else change) > threshold:
+            out.append((k, a, b, change))
+    return out
+
+
+def main(argv=None):
+    A = argparse.ArgumentParser(prog="chalilulz bench", description=__doc__)
+    A.add_argument("--sessions", type=int, default=5, help="Scripted sessions to run")
+    A.add_argument("--files", type=int, default=200, help="Synthetic workspace size")
+    A.add_argument("--provider", choices=["openai", "ollama"], default="openai")
+    A.add_argument("--out", help="Write results JSON here")
+    A.add_argument("--baseline", help="Compare against this results JSON")
+    A.add_argument("--threshold", type=float, default=0.25, help="Allowed regression (0.25 = 25%%)")
+    A.add_argument("--scale", help="Time filesystem tools on synthetic repos of these sizes, e.g. 1000,10000")
+    A.add_argument("--depth", type=int, default=3, help="Synthetic repo directory depth")
+    A.add_argument("--binary", type=float, default=0.05, help="Fraction of binary files")
+    A.add_argument("--ignored", type=float, default=0.2, help="Fraction of files in ignored dirs")
+    A.add_argument("--seed", type=int, default=0)
+    a = A.parse_args(argv)
+    if a.scale:
+        sizes = [int(x) for x in a.scale.split(",")]
+        res = scale(sizes, depth=a.depth, binary=a.binary, ignored=a.ignored, seed=a.seed)
+        print(f"  {'files':>8} {'tool':<6} {'ms':>10} {'peak kb':>10} {'lines':>7}")
+        for r in res["rows"]:
+            print(f"  {r['files']:>8} {r['tool']:<6} {r['ms']:>10.1f} {r['peak_kb']:>10.0f} {r['lines']:>7}")
+    else:
+        res = run(a.sessions, a.files, a.provider)
+        for k, v in res["metrics"].items():
+            print(f"  {k:<20} {'-' if v is None else f'{v:.2f}'}")
+        print(f"  {'rounds':<20} {res['rounds']}  ({res['wall_s']:.2f}s)")
+    if a.out:
+        with open(a.out, "w", encoding="utf-8") as f:
+            json.dump(res, f, indent=2)
+    if a.baseline:
+        with open(a.baseline, encoding="utf-8") as f:
+            bad = compare(res, json.load(f), a.threshold)
+        for k, was, now, ch in bad:
+            print(f"  ✗ {k} regressed {ch:+.0%} ({was:.2f} → {now:.2f})")
+        if bad:
+            return 1
+        print("  ✓ no regressions vs baseline")
+    return 0
@@ -0,0 +1,229 @@
+"""chalilulz.mock — stand-in llm server speaking openai sse and ollama ndjson
+
+point --groq-host / --ollama-host (etc.) at it to measure the client's own overhead
+and exercise retry, failover, cancellation and streaming paths without a network.
+"""
+
+import argparse, json, random, threading, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class MockLLM:
+    """scripted llm. each request consumes the next script turn:
+    {"content": str, "tool_calls": [{"name", "args"}], "error": status, "ttft": s, "tps": n,
+     "headers": {name: value}}
+    missing turns reply "ok". ttft/tps/error_rate apply to every turn unless overridden."""
+
+    def __init__(
+        self,
+        script=None,
+        ttft=0.0,
+        tps=0.0,
+        error_rate=0.0,
+        error_code=500,
+        ctx=32768,
+        loop=False,
+        seed=0,
+    ):
+        self.script = list(script or [])
+        self.ttft, self.tps = ttft, tps
+        self.error_rate, self.error_code = error_rate, error_code
+        self.ctx, self.loop = ctx, loop
+        self.requests = []  # (path, body) of every request, for assertions
+        self._i = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._srv = None
+
+    # ─ script
+    def next_turn(self, path, body):
+        with self._lock:
+            self.requests.append((path, body))
+            if self._i < len(self.script):
+                turn = self.script[self._i]
+            elif self.loop and self.script:
+                turn = self.script[self._i % len(self.script)]
+            else:
+                turn = {}
+            self._i += 1
+            if not turn.get("error") and self.error_rate:
+                if self._rng.random() < self.error_rate:
+                    turn = dict(turn, error=self.error_code)
+        return turn
+
+    # ─ server
+    def start(self, host="127.0.0.1", port=0):
+        """serve in a background thread; returns the base url"""
+        self._srv = ThreadingHTTPServer((host, port), _handler(self))
+        self._srv.daemon_threads = True
+        threading.Thread(
+            target=self._srv.serve_forever, args=(0.05,), daemon=True
+        ).start()
+        return self.url
+
+    @property
+    def url(self):
+        h, p = self._srv.server_address[:2]
+        return f"http://{h}:{p}"
+
+    def stop(self):
+        if self._srv:
+            self._srv.shutdown()
+            self._srv.server_close()
+            self._srv = None
+
+
+def _tokens(text):
+    """split into word-ish tokens, keeping whitespace so the joined stream is exact"""
+    out, cur = [], ""
+    for ch in text:
+        cur += ch
+        if ch == " ":
+            out.append(cur)
+            cur = ""
+    return out + ([cur] if cur else [])
+
+
+def _handler(llm):
+    class H(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *a):
+            pass
+
+        def _json(self, code, obj, extra=None):
+            data = json.dumps(obj).encode()
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for k, v in (extra or {}).items():
+                self.send_header(k, v)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _chunk(self, data):
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+            self.wfile.flush()
+
+        def do_GET(self):
+            if self.path.rstrip("/").endswith("/models"):
+                llm.requests.append((self.path, None))
+                return self._json(200, {"data": [{"id": "mock", "context_length": llm.ctx}]})
+            self._json(404, {"error": {"message": "not found"}})
+
+        def do_POST(self):
+            n = int(self.headers.get("Content-Length") or 0)
+            try:
+                body = json.loads(self.rfile.read(n) or b"{}")
+            except ValueError:
+                return self._json(400, {"error": {"message": "bad json"}})
+            path = self.path.split("?")[0]
+            if path.endswith("/api/show"):
+                llm.requests.append((path, body))
+                return self._json(200, {"model_info": {"mock.context_length": llm.ctx}})
+            if path.endswith("/api/generate"):
+                llm.requests.append((path, body))
+                return self._json(200, {"model": body.get("model"), "done": True})
+            ollama = path.endswith("/api/chat")
+            if not ollama and not path.endswith("/chat/completions"):
+                return self._json(404, {"error": {"message": "not found"}})
+            turn = llm.next_turn(path, body)
+            if turn.get("error"):
+                code = int(turn["error"])
+                hdr = {"Retry-After": "1"} if code == 429 else {}
+                hdr.update(turn.get("headers") or {})
+                return self._json(code, {"error": {"message": f"injected {code}"}}, hdr)
+            try:
+                self._stream(body, turn, ollama)
+            except (BrokenPipeError, ConnectionResetError):
+                pass  # client cancelled mid-stream
+
+        def _stream(self, body, turn, ollama):
+            t0 = time.perf_counter()
+            self.send_response(200)
+            ct = "application/x-ndjson" if ollama else "text/event-stream"
+            self.send_header("Content-Type", ct)
+            self.send_header("Transfer-Encoding", "chunked")
+            for k, v in (turn.get("headers") or {}).items():
+                self.send_header(k, v)
+            self.end_headers()
+            ttft = turn.get("ttft", llm.ttft)
+            tps = turn.get("tps", llm.tps)
+            toks = _tokens(turn.get("content", "ok" if "tool_calls" not in turn else ""))
+            if ttft:
+                time.sleep(ttft)
+            for i, tok in enumerate(toks):
+                if i and tps:
+                    time.sleep(1 / tps)
+                if ollama:
+                    ev = {"message": {"role": "assistant", "content": tok}, "done": False}
+                    self._chunk(json.dumps(ev).encode() + b"\n")
+                else:
+                    ev = {"choices": [{"index": 0, "delta": {"content": tok}}]}
+                    self._chunk(b"data: " + json.dumps(ev).encode() + b"\n\n")
+            calls = turn.get("tool_calls") or []
+            if calls and ollama:
+                tcs = [{"function": {"name": c["name"], "arguments": c.get("args", {})}} for c in calls]
+                ev = {"message": {"role": "assistant", "content": "", "tool_calls": tcs}, "done": False}
+                self._chunk(json.dumps(ev).encode() + b"\n")
+            elif calls:
+                tcs = [
+                    {
+                        "index": i,
+                        "id": f"call_{len(llm.requests)}_{i}",
+                        "type": "function",
+                        "function": {"name": c["name"], "arguments": json.dumps(c.get("args", {}))},
+                    }
+                    for i, c in enumerate(calls)
+                ]
+                ev = {"choices": [{"index": 0, "delta": {"tool_calls": tcs}}]}
+                self._chunk(b"data: " + json.dumps(ev).encode() + b"\n\n")
+            prompt = len(json.dumps(body.get("messages", []))) // 4
+            gen = max(time.perf_counter() - t0 - ttft, 1e-6)
+            if ollama:
+                ev = {
+                    "message": {"role": "assistant", "content": ""},
+                    "done": True,
+                    "prompt_eval_count": prompt,
+                    "eval_count": len(toks),
+                    "load_duration": 0,
+                    "prompt_eval_duration": int(ttft * 1e9),
+                    "eval_duration": int(gen * 1e9),
+                }
+                self._chunk(json.dumps(ev).encode() + b"\n")
+            else:
+                usage = {"prompt_tokens": prompt, "completion_tokens": len(toks)}
+                ev = {"choices": [], "usage": usage}
+                self._chunk(b"data: " + json.dumps(ev).encode() + b"\n\n")
+                self._chunk(b"data: [DONE]\n\n")
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+
+    return H
+
+
+def main(argv=None):
+    A = argparse.ArgumentParser(prog="chalilulz mock", description=MockLLM.__doc__)
+    A.add_argument("--host", default="127.0.0.1")
+    A.add_argument("--port", type=int, default=8088)
+    A.add_argument("--script", help="JSON file with a list of turns")
+    A.add_argument("--loop", action="store_true", help="Cycle the script forever")
+    A.add_argument("--ttft", type=float, default=0.0, help="Seconds before first token")
+    A.add_argument("--tps", type=float, default=0.0, help="Tokens/sec (0 = no delay)")
+    A.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests to fail")
+    A.add_argument("--error-code", type=int, default=500, help="Status for injected errors")
+    A.add_argument("--ctx", type=int, default=32768, help="Context length to advertise")
+    a = A.parse_args(argv)
+    script = []
+    if a.script:
+        with open(a.script, encoding="utf-8") as f:
+            script = json.load(f)
+    llm = MockLLM(script, a.ttft, a.tps, a.error_rate, a.error_code, a.ctx, a.loop)
+    url = llm.start(a.host, a.port)
+    print(f"mock llm on {url}  (openai: {url}/v1  ollama: {url})", flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        llm.stop()
+    return 0
@@ -0,0 +1,446 @@
+"""chalilulz.serve — long-running daemon hosting many agent sessions
+
+one process keeps the provider connection pool, capability cache and skill index
+warm, and runs each client's session on its own thread. clients talk ndjson over a
+unix socket (default <data dir>/serve.sock) or localhost tcp: one request per line,
+{"op": ..., ...}; every reply is one json line, except turn, which streams the
+session's events (token, tool_call, tool_result, round, error) and ends with done.
+sessions run tools as the daemon's user, so only that user may connect: the socket
+is 0600, and over tcp a connection must first send {"op": "auth", "token"} with the
+token from <data dir>/serve.token (also 0600, rewritten on every start).
+
+    new      {model?, cwd?, yes?, settings?}  → {"type": "session", "id", "model", "skills"}
+    turn     {session, prompt}                → events…, {"type": "done", "status", "text", "stats"}
+    model    {session, model}                 → {"type": "ok", "model"}
+    cancel   {session}                        → {"type": "ok"}; the running turn ends as interrupted
+    clear / stats / close {session}
+    list / ping / shutdown
+"""
+
+import argparse, contextlib, functools, hmac, itertools, json, os, socket, socketserver, sys, threading, time
+
+import chalilulz as c
+
+# client-side settings (flags, config, env keys) an attached session runs with
+FORWARD = (
+    "key", "openrouter_host", "ollama_host", "mistral_key", "mistral_host", "groq_key",
+    "groq_host", "gemini_key", "gemini_host", "ctx_override", "fallback", "failover_ttft",
+    "keep_alive", "connect_timeout", "first_byte_timeout", "idle_timeout",
+)
+OPS = {"ping", "new", "list", "shutdown", "turn", "cancel", "model", "clear", "stats", "close"}
+
+
+def token_path():
+    return c._data_dir() / "serve.token"
+
+
+def _write_token():
+    tok = os.urandom(24).hex()
+    p = token_path()
+    p.parent.mkdir(parents=True, exist_ok=True)
+    with contextlib.suppress(FileNotFoundError):
+        p.unlink()  # a new file, so the mode below is the one it gets
+    fd = os.open(p, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, "w") as f:
+        f.write(tok)
+    return tok
+
+
+def default_addr():
+    """unix socket in the data dir, or localhost tcp where there is no AF_UNIX"""
+    if hasattr(socket, "AF_UNIX"):
+        return str(c._data_dir() / "serve.sock")
+    return "127.0.0.1:7878"
+
+
+def parse_addr(addr):
+    """"/path.sock" → path; "host:port", ":port" or "port" → (host, port)"""
+    addr = addr or default_addr()
+    host, _, port = addr.rpartition(":")
+    if port.isdigit() and "/" not in addr:
+        return (host or "127.0.0.1", int(port))
+    return addr
+
+
+class _Wire:
+    """file-like events sink writing to the client's connection"""
+
+    def __init__(self, wfile):
+        self.wfile = wfile
+
+    def write(self, s):
+        self.wfile.write(s.encode())
+        return len(s)
+
+    def flush(self):
+        self.wfile.flush()
+
+
+class Daemon:
+    """session table. skill discovery is cached process-wide per cwd (see
+    chalilulz._skill_index), so sessions in the same directory share it"""
+
+    def __init__(self):
+        self.sessions = {}  # id → (Agent, lock)
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self.started = time.time()
+
+    def new(self, model=None, cwd=None, yes=False, settings=None):
+        cwd = os.path.abspath(cwd or os.getcwd())
+        kw = dict(settings or {})
+        bad = set(kw) - set(FORWARD)
+        if bad:  # the rest (record_dir, auto_approve, …) is the daemon's business
+            raise ValueError(f"setting(s) not accepted from clients: {', '.join(sorted(bad))}")
+        if yes:
+            kw["auto_approve"] = True
+        ag = c.Agent(model, cwd=cwd, **kw)
+        ag.warm()  # builds the system prompt, discovering skills
+        with self._lock:
+            sid = str(next(self._ids))
+            self.sessions[sid] = (ag, threading.Lock())
+        return sid, ag
+
+    def get(self, sid):
+        with self._lock:
+            s = self.sessions.get(str(sid))
+        if not s:
+            raise ValueError(f"no session {sid}")
+        return s
+
+    def close(self, sid):
+        with self._lock:
+            return self.sessions.pop(str(sid), None) is not None
+
+
+def _handler(d):
+    class H(socketserver.StreamRequestHandler):
+        def send(self, type, **kw):
+            self.wfile.write((json.dumps(dict(type=type, **kw), default=str) + "\n").encode())
+            self.wfile.flush()
+
+        def handle(self):
+            if self.server.token and not self.auth():
+                return
+            for line in self.rfile:
+                if not line.strip():
+                    continue
+                req = {}
+                try:
+                    req = json.loads(line)
+                    if self.op(req) == "shutdown":
+                        return
+                except (BrokenPipeError, ConnectionResetError):
+                    return  # client went away mid-reply
+                except Exception as e:
+                    # op marks a failed request, as opposed to an error event inside a turn
+                    self.send("error", op=req.get("op"), message=str(e))
+
+        def auth(self):
+            try:
+                req = json.loads(self.rfile.readline() or b"{}")
+            except ValueError:
+                req = {}
+            tok = req.get("token") if req.get("op") == "auth" else None
+            if isinstance(tok, str) and hmac.compare_digest(tok, self.server.token):
+                self.send("ok")
+                return True
+            self.send("error", op=req.get("op"), message="not authorized")
+            return False
+
+        def op(self, req):
+            op = req.get("op")
+            if op not in OPS:
+                raise ValueError(f"unknown op {op!r}")
+            if op == "ping":
+                return self.send("pong", version=c.__version__, sessions=len(d.sessions))
+            if op == "new":
+                sid, ag = d.new(req.get("model"), req.get("cwd"), req.get("yes"), req.get("settings"))
+                return self.send("session", id=sid, model=ag.model, skills=len(ag.skills))
+            if op == "list":
+                rows = [{"id": k, "model": a.model, "cwd": a.cwd, "msgs": len(a.msgs), "busy": lk.locked()}
+                        for k, (a, lk) in list(d.sessions.items())]
+                return self.send("sessions", sessions=rows)
+            if op == "shutdown":
+                self.send("ok")
+                threading.Thread(target=self.server.shutdown, daemon=True).start()
+                return "shutdown"
+            ag, lock = d.get(req.get("session"))
+            if op == "close":
+                d.close(req["session"])
+                return self.send("ok")
+            if op == "stats":
+                return self.send("stats", stats=c.stats_summary(ag.stats), msgs=len(ag.msgs))
+            if op == "cancel":  # arrives on another connection: the turn's is busy streaming
+                ag.cancel()
+                return self.send("ok")
+            if not lock.acquire(blocking=False):
+                raise RuntimeError(f"session {req['session']} is busy")
+            try:
+                if op == "turn":
+                    ag.events = _Wire(self.wfile)
+                    try:
+                        status = ag.turn(req["prompt"])
+                    finally:
+                        ag.events = None
+                    return self.send("done", status=status, text=ag.reply, stats=c.stats_summary(ag.stats))
+                if op == "clear":
+                    ag.clear()
+                    return self.send("ok")
+                # model
+                ag.set_model(req["model"])
+                ag.warm()
+                return self.send("ok", model=ag.model)
+            finally:
+                lock.release()
+
+    return H
+
+
+class _TCP(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+
+
+def serve(addr=None, ready=None):
+    """run the daemon until shutdown; ready(server) is called once it is listening"""
+    addr = parse_addr(addr)
+    d = Daemon()
+    token = None
+    if isinstance(addr, tuple):
+        srv = _TCP(addr, _handler(d))
+        token = _write_token()
+    else:
+        os.makedirs(os.path.dirname(addr) or ".", exist_ok=True)
+        if os.path.exists(addr):
+            try:  # a live daemon already owns it
+                connect(addr).close()
+                raise OSError(f"a daemon is already listening on {addr}")
+            except ConnectionError:
+                os.remove(addr)  # stale socket from a killed daemon
+        srv = socketserver.ThreadingUnixStreamServer(addr, _handler(d))
+        os.chmod(addr, 0o600)  # sessions run tools as this user
+    srv.daemon_threads, srv.sessions, srv.token = True, d, token
+    try:
+        if ready:
+            ready(srv)
+        srv.serve_forever(0.2)
+    finally:
+        srv.server_close()
+        with contextlib.suppress(OSError):
+            os.remove(token_path() if token else addr)
+    return 0
+
+
+# ─ client
+def connect(addr=None, timeout=None):
+    addr = parse_addr(addr)
+    if isinstance(addr, tuple):
+        return socket.create_connection(addr, timeout=timeout)
+    s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    s.settimeout(timeout)
+    try:
+        s.connect(addr)
+    except FileNotFoundError:
+        s.close()
+        raise ConnectionRefusedError(f"no daemon on {addr}") from None
+    except OSError:
+        s.close()
+        raise
+    return s
+
+
+class Client:
+    """one connection to the daemon; call() for single replies, turn() for streams"""
+
+    def __init__(self, addr=None, timeout=None):
+        self.addr, self.sock = addr, connect(addr, timeout)
+        self.rfile = self.sock.makefile("rb")
+        if isinstance(parse_addr(addr), tuple):
+            try:
+                tok = token_path().read_text(encoding="utf-8").strip()
+            except OSError as e:
+                self.close()
+                raise ConnectionRefusedError(f"no daemon token ({e.strerror}): {token_path()}") from e
+            try:
+                self.call("auth", token=tok)
+            except (OSError, RuntimeError):
+                self.close()
+                raise
+
+    def _send(self, op, **kw):
+        self.sock.sendall((json.dumps(dict(op=op, **kw)) + "\n").encode())
+
+    def _recv(self):
+        line = self.rfile.readline()
+        if not line:
+            raise ConnectionError("daemon closed the connection")
+        return json.loads(line)
+
+    def call(self, op, **kw):
+        self._send(op, **kw)
+        r = self._recv()
+        if r.get("type") == "error":
+            raise RuntimeError(r.get("message"))
+        return r
+
+    def turn(self, session, prompt):
+        """start a turn; returns its events (see events)"""
+        self._send("turn", session=session, prompt=prompt)
+        return self.events()
+
+    def events(self):
+        """yield streamed events; the last one is done (or the request's error)"""
+        while True:
+            ev = self._recv()
+            yield ev
+            if ev.get("type") == "done" or "op" in ev:
+                return
+
+    def cancel(self, session):
+        """stop session's running turn; sent over a connection of its own, since this
+        one is busy streaming the turn"""
+        other = Client(self.addr, self.sock.gettimeout())
+        try:
+            other.call("cancel", session=session)
+        finally:
+            other.close()
+
+    def close(self):
+        self.rfile.close()
+        self.sock.close()
+
+
+def render(ev, calls, out=sys.stdout):
+    """print one streamed event the way the local repl would"""
+    t = ev.get("type")
+    if t == "token":
+        out.write(ev["text"])
+        out.flush()
+    elif t == "tool_call":
+        calls[ev.get("id") or ev["name"]] = ev.get("args") or {}
+    elif t == "tool_result":
+        args = calls.pop(ev.get("id") or ev["name"], {})
+        ic = c.TIC.get(ev["name"], "⚙")
+        av = str(list(args.values())[0])[:64] if args else ""
+        print(f"\n {c.Gr}{ic} {c.Bo}{ev['name']}{c.R}{c.D}({av}){c.R}", file=out)
+        print(f"   {c.D}⎿ {c.pvw(str(ev.get('result')))}{c.R}", file=out)
+    elif t == "round":
+        line = c.fmt_timing(ev.get("usage") or {}, ev.get("timing") or {})
+        if line:
+            print(f"\n {c.D}via {ev.get('model')} · {line}{c.R}", file=out)
+    elif t == "error":
+        print(f"\n {c.Re}✗ {ev.get('message')}{c.R}", file=out)
+
+
+def _stream(cl, sid, prompt, show):
+    """run one turn, passing each event to show. the first Ctrl-C cancels the turn on
+    the daemon and the rest of the stream (partial reply, then done) is still shown;
+    a second one gives up waiting. returns the turn's status"""
+    evs, status, ev, cancelled = cl.turn(sid, prompt), "error", {}, False
+    while True:
+        try:
+            for ev in evs:
+                show(ev)
+                status = ev.get("status", status)
+            return status
+        except KeyboardInterrupt:
+            if cancelled or ev.get("type") == "done" or "op" in ev:
+                raise
+            cancelled = True
+            cl.cancel(sid)
+            evs = cl.events()
+
+
+def attach(addr=None, model=None, yes=False, prompt=None, as_json=False, settings=None):
+    """run a session on the daemon from this terminal: one turn with prompt (like -p),
+    else a thin repl. returns the exit status"""
+    try:
+        cl = Client(addr)
+        s = cl.call("new", model=model, cwd=os.getcwd(), yes=yes, settings=settings)
+    except (OSError, RuntimeError) as e:
+        print(f" {c.Re}✗ daemon: {e}{c.R}", file=sys.stderr)
+        return 1
+    sid = s["id"]
+    try:
+        if prompt is not None:
+
+            def show(ev):
+                if as_json:
+                    sys.stdout.write(json.dumps(ev) + "\n")
+                    sys.stdout.flush()
+                else:
+                    render(ev, {})
+
+            status = _stream(cl, sid, prompt, show)
+            if not as_json:
+                print()
+            return {"ok": 0, "interrupted": 130}.get(status, 1)
+        c.sep("═", c.Bo + c.C)
+        print(f" {c.Bo}◆ chalilulz{c.R}  {c.D}{s['model']}  (daemon session {sid}){c.R}")
+        print(f" {c.D}cwd:{os.getcwd()}  skills:{s['skills']}{c.R}")
+        c.sep("═", c.Bo + c.C)
+        while True:
+            c.sep()
+            try:
+                ui = input(f" {c.Bo}{c.BL}❯ {c.R}").strip()
+            except (KeyboardInterrupt, EOFError):
+                print(f"\n {c.D}bye{c.R}")
+                return 0
+            if not ui:
+                continue
+            if ui in ("/q", "exit", "quit"):
+                print(f"\n {c.D}bye{c.R}")
+                return 0
+            try:
+                if ui == "/c":
+                    cl.call("clear", session=sid)
+                    print(f"\n {c.Gr}✓ cleared{c.R}")
+                elif ui.startswith("/model "):
+                    r = cl.call("model", session=sid, model=ui[7:].strip())
+                    print(f"\n {c.Gr}✓ model→{c.Bo}{r['model']}{c.R}")
+                elif ui == "/stats":
+                    st = cl.call("stats", session=sid)["stats"]
+                    print(f"\n {c.D}{json.dumps(st) if st else 'no rounds yet'}{c.R}")
+                elif ui == "/help":
+                    print(f"\n  {c.C}/q{c.R} quit  {c.C}/c{c.R} clear  {c.C}/model <slug>{c.R}  {c.C}/stats{c.R}")
+                else:
+                    c.sep()
+                    _stream(cl, sid, ui, functools.partial(render, calls={}))
+                    print()
+            except RuntimeError as e:
+                print(f"\n {c.Re}✗ {e}{c.R}")
+    except ConnectionError as e:
+        print(f"\n {c.Re}✗ daemon: {e}{c.R}", file=sys.stderr)
+        return 1
+    except KeyboardInterrupt:
+        print(f"\n {c.D}bye{c.R}")
+        return 130
+    finally:
+        try:
+            cl.call("close", session=sid)
+        except (OSError, RuntimeError, ValueError):
+            pass
+        cl.close()
+
+
+def main(argv=None):
+    A = argparse.ArgumentParser(prog="chalilulz serve", description=__doc__,
+                                formatter_class=argparse.RawDescriptionHelpFormatter)
+    A.add_argument("--socket", help="Unix socket path (default: <data dir>/serve.sock)")
+    A.add_argument("--port", type=int, help="Listen on localhost TCP instead")
+    A.add_argument("--stop", action="store_true", help="Ask a running daemon to exit")
+    a = A.parse_args(argv)
+    addr = f"127.0.0.1:{a.port}" if a.port else a.socket
+    if a.stop:
+        try:
+            Client(addr).call("shutdown")
+        except (OSError, RuntimeError) as e:
+            print(f" {c.Re}✗ daemon: {e}{c.R}", file=sys.stderr)
+            return 1
+        return 0
+    where = parse_addr(addr)
+    print(f"chalilulz daemon on {where if isinstance(where, str) else '%s:%d' % where}", flush=True)
+    try:
+        return serve(addr)
+    except KeyboardInterrupt:
+        return 0
@@ -0,0 +1,138 @@
+"""chalilulz.sessions — full-text search over session logs
+
+user prompts, assistant replies and the names of the tools they called are indexed
+into <data dir>/sessions/index.db (sqlite, fts5 where the build has it). each log
+is indexed from where the last run stopped, so catching up costs a stat per log
+plus whatever was appended since.
+"""
+
+import json, re
+
+import chalilulz as c
+
+
+def _db():
+    import sqlite3
+
+    c._sessions_dir().mkdir(parents=True, exist_ok=True)
+    con = sqlite3.connect(str(c._sessions_dir() / "index.db"), timeout=10)
+    con.execute("CREATE TABLE IF NOT EXISTS logs (name TEXT PRIMARY KEY, bytes INTEGER, lines INTEGER)")
+    try:
+        con.execute("CREATE VIRTUAL TABLE IF NOT EXISTS msgs USING fts5(log UNINDEXED, seq UNINDEXED, role UNINDEXED, body)")
+        fts = True
+    except sqlite3.OperationalError:  # sqlite built without fts5: plain rows, LIKE scans
+        con.execute("CREATE TABLE IF NOT EXISTS plain (log TEXT, seq INTEGER, role TEXT, body TEXT)")
+        fts = False
+    return con, fts
+
+
+def _text(m):
+    """what is searchable in a message: its text, plus tool names for assistant turns"""
+    parts = [m.get("content") if isinstance(m.get("content"), str) else ""]
+    for tc in m.get("tool_calls") or []:
+        parts.append((tc.get("function") or {}).get("name") or "")
+    return " ".join(p for p in parts if p)
+
+
+def index(con=None, fts=None):
+    """add whatever was appended to each log since the last run; returns messages added"""
+    d = c._sessions_dir()
+    if not d.is_dir():
+        return 0
+    if con is None:
+        con, fts = _db()
+        try:
+            return index(con, fts)
+        finally:
+            con.close()
+    table = "msgs" if fts else "plain"
+    done = {n: (b, k) for n, b, k in con.execute("SELECT name, bytes, lines FROM logs")}
+    added = 0
+    for p in d.glob("*.jsonl"):
+        off, seq = done.get(p.name, (0, 0))
+        size = p.stat().st_size
+        if size == off:
+            continue
+        with con:
+            if size < off:  # rewritten behind our back: start over
+                con.execute(f"DELETE FROM {table} WHERE log = ?", (p.name,))
+                off = seq = 0
+            with open(p, "rb") as f:
+                f.seek(off)
+                data = f.read(size - off)
+            data = data[: data.rfind(b"\n") + 1]  # a line still being written waits
+            rows = []
+            for line in data.splitlines():
+                seq += 1
+                try:
+                    m = json.loads(line)
+                except ValueError:
+                    continue
+                if m.get("role") in ("user", "assistant"):
+                    body = _text(c._unpack(m))
+                    if body:
+                        rows.append((p.name, seq, m["role"], body))
+            con.executemany(f"INSERT INTO {table} VALUES (?, ?, ?, ?)", rows)
+            con.execute("INSERT OR REPLACE INTO logs VALUES (?, ?, ?)", (p.name, off + len(data), seq))
+            added += len(rows)
+    return added
+
+
+def _names():
+    """log file → names it was saved under"""
+    out = {}
+    for p in c._sessions_dir().glob("*.json"):
+        try:
+            ptr = json.loads(p.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            continue
+        if isinstance(ptr, dict) and "log" in ptr:
+            out.setdefault(ptr["log"], []).append(p.stem)
+    return out
+
+
+def _snip(body, terms, hl, width=60):
+    low = body.lower()
+    at = min((i for i in (low.find(t) for t in terms) if i >= 0), default=0)
+    s = max(0, at - width // 2)
+    text = ("…" if s else "") + body[s : s + width] + ("…" if s + width < len(body) else "")
+    for t in terms:
+        text = re.sub(re.escape(t), lambda x: hl[0] + x.group(0) + hl[1], text, flags=re.I)
+    return text
+
+
+def search(query, limit=10, hl=("[", "]")):
+    """best-ranked message per session for query (every word must match), best first:
+    dicts with session, names, role, seq and a snippet with matches wrapped in hl"""
+    terms = query.split()
+    if not terms:
+        return []
+    con, fts = _db()
+    try:
+        index(con, fts)
+        if fts:
+            q = " ".join('"%s"' % t.replace('"', '""') for t in terms)
+            rows = con.execute(
+                "SELECT log, seq, role, snippet(msgs, 3, ?, ?, '…', 12) FROM msgs "
+                "WHERE msgs MATCH ? ORDER BY rank LIMIT ?",
+                (hl[0], hl[1], q, limit * 20),
+            ).fetchall()
+        else:
+            where = " AND ".join("body LIKE ?" for _ in terms)
+            rows = con.execute(
+                f"SELECT log, seq, role, body FROM plain WHERE {where} ORDER BY log DESC LIMIT ?",
+                [f"%{t}%" for t in terms] + [limit * 20],
+            ).fetchall()
+            rows = [(lg, seq, role, _snip(body, [t.lower() for t in terms], hl)) for lg, seq, role, body in rows]
+    finally:
+        con.close()
+    names, hits, seen = _names(), [], set()
+    for lg, seq, role, snip in rows:
+        if lg in seen:
+            continue
+        seen.add(lg)
+        hits.append({"session": lg[: -len(".jsonl")], "names": names.get(lg, []), "role": role,
+                     "seq": seq, "snippet": " ".join(snip.split())})
+        if len(hits) == limit:
+            break
+    return hits
@@ -0,0 +1,119 @@
+"""chalilulz.usage — report on the request ledger
+
+every provider request appends a row to <data dir>/usage.jsonl: provider, model,
+prompt / completion / cached tokens, connect / first-token / total latency, cost
+(from the price table; null when unknown) and an error if it failed. this rolls
+the rows up by day, model, provider or session.
+"""
+
+import argparse, json, sys, time
+
+import chalilulz as c
+
+KEYS = {
+    "day": lambda r: time.strftime("%Y-%m-%d", time.localtime(r.get("ts") or 0)),
+    "model": lambda r: f"{r.get('provider')}:{r.get('model')}",
+    "provider": lambda r: r.get("provider"),
+    "session": lambda r: r.get("session") or "-",
+}
+
+
+def load(path=None, since=None, session=None):
+    """ledger rows, optionally only those at/after since (epoch s) or from one session"""
+    rows = []
+    try:
+        with open(path or c._ledger_path(), encoding="utf-8") as f:
+            for line in f:
+                try:
+                    r = json.loads(line)
+                except ValueError:
+                    continue  # torn last line from a killed process
+                if since and (r.get("ts") or 0) < since:
+                    continue
+                if session and r.get("session") != session:
+                    continue
+                rows.append(r)
+    except FileNotFoundError:
+        pass
+    return rows
+
+
+def rollup(rows, by="day"):
+    """one summary dict per group, in first-seen order (chronological for day). cost
+    sums the priced requests; it is None when the group has no priced request but
+    some unpriced ones (unknown, not free)"""
+    key, groups = KEYS[by], {}
+    for r in rows:
+        g = groups.setdefault(key(r), {
+            by: key(r), "requests": 0, "errors": 0, "prompt_tokens": 0,
+            "completion_tokens": 0, "cached_tokens": 0, "cost": 0.0, "unpriced": 0,
+            "_priced": 0, "_ttft": [], "_total": [],
+        })
+        g["requests"] += 1
+        g["errors"] += 1 if r.get("error") else 0
+        for k in ("prompt_tokens", "completion_tokens", "cached_tokens"):
+            g[k] += r.get(k) or 0
+        if r.get("cost") is not None:
+            g["cost"] += r["cost"]
+            g["_priced"] += 1
+        elif not r.get("error"):
+            g["unpriced"] += 1
+        for k in ("ttft", "total"):
+            if r.get(k) is not None:
+                g["_" + k].append(r[k])
+    out = []
+    for g in groups.values():
+        for k in ("ttft", "total"):
+            v = g.pop("_" + k)
+            g[k] = sum(v) / len(v) if v else None
+        if not g.pop("_priced") and g["unpriced"]:
+            g["cost"] = None
+        out.append(g)
+    return out
+
+
+def table(groups, by, out=None):
+    out = out or sys.stdout
+    if not groups:
+        print(f" {c.D}no requests recorded{c.R}", file=out)
+        return
+    w = max(len(by), *(len(str(g[by])) for g in groups))
+    print(f"  {by:<{w}} {'reqs':>6} {'err':>4} {'prompt':>9} {'cached':>8} {'output':>8} "
+          f"{'cost $':>9} {'ttft':>6} {'total':>6}", file=out)
+    for g in groups + ([_total(groups, by)] if len(groups) > 1 else []):
+        if g["cost"] is None:
+            cost = "unknown "
+        else:
+            cost = f"{g['cost']:.4f}" + ("+" if g["unpriced"] else " ")
+        ttft = "-" if g["ttft"] is None else f"{g['ttft']:.2f}"
+        total = "-" if g["total"] is None else f"{g['total']:.2f}"
+        print(f"  {str(g[by]):<{w}} {g['requests']:>6} {g['errors']:>4} {g['prompt_tokens']:>9} "
+              f"{g['cached_tokens']:>8} {g['completion_tokens']:>8} {cost:>10} {ttft:>6} {total:>6}",
+              file=out)
+    if any(g["unpriced"] for g in groups):
+        print(f"  {c.D}+ some requests have no price (add \"prices\" to the config){c.R}", file=out)
+
+
+def _total(groups, by):
+    t = {by: "total", "ttft": None, "total": None}
+    for k in ("requests", "errors", "prompt_tokens", "completion_tokens", "cached_tokens", "unpriced"):
+        t[k] = sum(g[k] for g in groups)
+    costs = [g["cost"] for g in groups if g["cost"] is not None]
+    t["cost"] = sum(costs) if costs else None
+    return t
+
+
+def main(argv=None):
+    A = argparse.ArgumentParser(prog="chalilulz usage", description=__doc__)
+    A.add_argument("--by", choices=list(KEYS), default="day", help="Group rows by (default: day)")
+    A.add_argument("--days", type=float, help="Only the last N days")
+    A.add_argument("--session", help="Only this session id")
+    A.add_argument("--json", action="store_true", help="Print the rollup as JSON")
+    a = A.parse_args(argv)
+    since = time.time() - a.days * 86400 if a.days else None
+    groups = rollup(load(since=since, session=a.session), a.by)
+    if a.json:
+        print(json.dumps(groups, indent=2))
+    else:
+        table(groups, a.by)
+    return 0
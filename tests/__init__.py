@@ -0,0 +1,49 @@
+"""
+tests — Shared fixtures
+"""
+
+import unittest
+import sys
+import os
+import copy
+import tempfile
+import shutil
+from pathlib import Path
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import chalilulz
+
+
+def _restore(saved, contents):
+    """put module globals back, refilling containers in place for anyone holding them"""
+    for k, v in saved.items():
+        if isinstance(v, (set, dict)):
+            v.clear()
+            v.update(contents[k])
+        elif isinstance(v, list):
+            v[:] = contents[k]
+        setattr(chalilulz, k, v)
+
+
+class DataDirCase(unittest.TestCase):
+    """each test gets its own data dir (self.data, under the scratch dir self.tmp), the
+    module globals named in SAVE back as they were, no open circuit breakers and no
+    cached skill discovery"""
+
+    SAVE = ()  # module globals the tests change, e.g. ("PROVIDER", "ACTUAL_MODEL")
+
+    def setUp(self):
+        self.tmp = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.tmp, True)
+        self.data = self.tmp / "data"
+        p = patch("chalilulz._data_dir", return_value=self.data)
+        p.start()
+        self.addCleanup(p.stop)
+        saved = {k: getattr(chalilulz, k) for k in self.SAVE}
+        self.addCleanup(_restore, saved, {k: copy.copy(v) for k, v in saved.items()})
+        chalilulz._BREAKERS.clear()
+        self.addCleanup(chalilulz._BREAKERS.clear)
+        chalilulz._SKILL_INDEX.clear()  # discovery is cached per cwd and data dir
+        self.addCleanup(chalilulz._SKILL_INDEX.clear)
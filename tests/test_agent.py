@@ -0,0 +1,163 @@
+"""
+test_agent — Embeddable Agent sessions: isolation, concurrency and cwd handling
+"""
+
+import unittest
+import sys
+import os
+import io
+import threading
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import chalilulz
+from chalilulz.mock import MockLLM
+from tests import DataDirCase
+
+
+class AgentCase(DataDirCase):
+    def mock(self, script, **kw):
+        llm = MockLLM(script, **kw)
+        llm.start()
+        self.addCleanup(llm.stop)
+        return llm
+
+    def agent(self, llm, model="groq:mock", **kw):
+        kw.setdefault("ctx_override", {"*": 32768})
+        return chalilulz.Agent(
+            model, groq_host=llm.url + "/v1", groq_key="k", ollama_host=llm.url, fallback=[], **kw
+        )
+
+
+class TestAgentIsolation(AgentCase):
+    def test_turn_and_reply(self):
+        ag = self.agent(self.mock([{"content": "hello there"}]))
+        self.assertEqual(ag.turn("hi"), "ok")
+        self.assertEqual(ag.reply, "hello there")
+        self.assertEqual([m["role"] for m in ag.msgs], ["user", "assistant"])
+        self.assertEqual(len(ag.stats), 1)
+        ag.clear()
+        self.assertEqual((ag.msgs, ag.stats), ([], []))
+
+    def test_module_defaults_untouched(self):
+        before = (chalilulz.MODEL, chalilulz.PROVIDER, chalilulz.ACTUAL_MODEL, chalilulz.GROQ_KEY)
+        stats = list(chalilulz.STATS)
+        ag = self.agent(self.mock([{"content": "x"}]), model="ollama:mock")
+        ag.turn("hi")
+        ag.set_model("mistral:small")
+        after = (chalilulz.MODEL, chalilulz.PROVIDER, chalilulz.ACTUAL_MODEL, chalilulz.GROQ_KEY)
+        self.assertEqual(before, after)
+        self.assertEqual(chalilulz.STATS, stats)
+        self.assertEqual(ag.provider, "mistral")
+
+    def test_quiet_agent_prints_nothing(self):
+        ag = self.agent(self.mock([{"tool_calls": [{"name": "ls", "args": {}}]}, {"content": "x"}]))
+        out = io.StringIO()
+        with patch("sys.stdout", out):
+            self.assertEqual(ag.turn("list"), "ok")
+        self.assertEqual(out.getvalue(), "")
+        stream = io.StringIO()
+        ag = self.agent(self.mock([{"content": "shown"}]), out=stream)
+        ag.turn("hi")
+        self.assertIn("shown", stream.getvalue())
+
+    def test_unknown_setting(self):
+        with self.assertRaises(TypeError):
+            chalilulz.Agent("ollama:x", no_such_thing=1)
+
+    def test_quiet_agent_denies_gated_tools(self):
+        bash = {"name": "bash", "args": {"cmd": "echo hi"}}
+        ag = self.agent(self.mock([{"tool_calls": [bash]}, {"content": "ok"}]))
+        ag.turn("run")
+        self.assertIn("denied", ag.msgs[2]["content"])
+
+    def test_approve_callback(self):
+        bash = {"name": "bash", "args": {"cmd": "echo hi"}}
+        asked = []
+
+        def approve(name, args):
+            asked.append((name, args["cmd"]))
+            return len(asked) == 1
+
+        ag = self.agent(self.mock([{"tool_calls": [bash]}, {"tool_calls": [bash]}, {"content": "ok"}]), approve=approve)
+        ag.turn("run twice")
+        self.assertEqual(asked, [("bash", "echo hi")] * 2)
+        self.assertIn("hi", ag.msgs[2]["content"])
+        self.assertIn("denied", ag.msgs[4]["content"])
+
+    def test_prompt_goes_to_transcript(self):
+        bash = {"name": "bash", "args": {"cmd": "echo hi"}}
+        out = io.StringIO()
+        ag = self.agent(self.mock([{"tool_calls": [bash]}, {"content": "ok"}]), out=out)
+        ag.interactive = True
+        with patch("builtins.input", return_value="n"), patch("sys.stdout", io.StringIO()) as stdout:
+            ag.turn("run")
+        self.assertIn("Allow?", out.getvalue())
+        self.assertEqual(stdout.getvalue(), "")
+        self.assertIn("denied", ag.msgs[2]["content"])
+
+
+class TestAgentConcurrency(AgentCase):
+    def test_parallel_agents_keep_their_own_model_and_history(self):
+        a_llm = self.mock([{"content": "from a", "tps": 200}], loop=True)
+        b_llm = self.mock([{"content": "from b", "tps": 200}], loop=True)
+        agents = [self.agent(a_llm, "groq:mock"), self.agent(b_llm, "ollama:mock")]
+        errors = []
+
+        def drive(ag, want):
+            try:
+                for i in range(5):
+                    self.assertEqual(ag.turn(f"q{i}"), "ok")
+                    self.assertEqual(ag.reply, want)
+            except Exception as e:  # surfaced below; assertions don't cross threads
+                errors.append(e)
+
+        ts = [
+            threading.Thread(target=drive, args=(agents[0], "from a")),
+            threading.Thread(target=drive, args=(agents[1], "from b")),
+        ]
+        for t in ts:
+            t.start()
+        for t in ts:
+            t.join(10)
+        self.assertEqual(errors, [])
+        for ag in agents:
+            self.assertEqual(len(ag.msgs), 10)
+            self.assertEqual(len(ag.stats), 5)
+        chats = lambda llm: [p for p, _ in llm.requests if p.endswith(("/chat/completions", "/api/chat"))]
+        self.assertEqual(set(chats(a_llm)), {"/v1/chat/completions"})
+        self.assertEqual(set(chats(b_llm)), {"/api/chat"})
+
+
+class TestAgentCwd(AgentCase):
+    def test_tools_resolve_against_agent_cwd(self):
+        ws = os.path.join(self.tmp, "ws")
+        os.makedirs(ws)
+        with open(os.path.join(ws, "notes.txt"), "w") as f:
+            f.write("secret sauce\n")
+        script = [
+            {"tool_calls": [{"name": "read", "args": {"path": "notes.txt"}}]},
+            {"tool_calls": [{"name": "write", "args": {"path": "out/new.txt", "content": "x"}}]},
+            {"tool_calls": [{"name": "grep", "args": {"pat": "sauce"}}]},
+            {"content": "done"},
+        ]
+        ag = self.agent(self.mock(script), cwd=ws, auto_approve=True)
+        self.assertEqual(ag.turn("go"), "ok")
+        results = [m["content"] for m in ag.msgs if m["role"] == "tool"]
+        self.assertIn("secret sauce", results[0])
+        self.assertTrue(os.path.exists(os.path.join(ws, "out", "new.txt")))
+        self.assertIn(os.path.join(ws, "notes.txt"), results[2])
+        self.assertIn(ws, ag.system)
+
+    def test_in_cwd_leaves_absolute_paths(self):
+        args = chalilulz._in_cwd("read", {"path": "/etc/hosts"}, "/w")
+        self.assertEqual(args["path"], "/etc/hosts")
+        args = chalilulz._in_cwd("bash", {"cmd": "ls"}, "/w")
+        self.assertEqual(args["cwd"], "/w")
+        args = chalilulz._in_cwd("mv", {"src": "a", "dest": "b"}, "/w")
+        self.assertEqual((args["src"], args["dest"]), ("/w/a", "/w/b"))
+
+
+if __name__ == "__main__":
+    unittest.main()
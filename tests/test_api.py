@@ -19,11 +19,16 @@ from chalilulz import (
     call_groq,
     call_gemini,
     call_api,
+    read_sse_stream,
+    read_ndjson_stream,
+    fmt_timing,
+    stats_summary,
     ACTUAL_MODEL,
     PROVIDER,
     NO_TOOLS_MODELS,
     SCHEMA,
 )
+from tests import DataDirCase
 
 
 class FakeHTTPResponse:
@@ -92,7 +97,7 @@ class TestOpenRouterAPI(unittest.TestCase):
         chalilulz.ACTUAL_MODEL = self.orig_ACTUAL_MODEL
         chalilulz.PROVIDER = self.orig_PROVIDER
 
-    @patch("urllib.request.urlopen")
+    @patch("chalilulz._OPENER.open")
     def test_call_openrouter_success(self, mock_urlopen):
         mock_urlopen.side_effect = mock_urlopen_success(
             {
@@ -111,7 +116,7 @@ class TestOpenRouterAPI(unittest.TestCase):
         self.assertIn("choices", resp)
         self.assertTrue(use_tools)  # Tools supported by default
 
-    @patch("urllib.request.urlopen")
+    @patch("chalilulz._OPENER.open")
     def test_call_openrouter_with_tools(self, mock_urlopen):
         mock_urlopen.side_effect = mock_urlopen_success(
             {
@@ -129,7 +134,7 @@ class TestOpenRouterAPI(unittest.TestCase):
         resp, use_tools = result
         self.assertTrue(use_tools)
 
-    @patch("urllib.request.urlopen")
+    @patch("chalilulz._OPENER.open")
     def test_call_openrouter_error_400(self, mock_urlopen):
         mock_urlopen.side_effect = mock_urlopen_error(
             400, {"error": {"message": "Bad request"}}
@@ -158,7 +163,7 @@ class TestOllamaAPI(unittest.TestCase):
         chalilulz.PROVIDER = self.orig_PROVIDER
         chalilulz.OLLAMA_HOST = self.orig_OLLAMA_HOST
 
-    @patch("urllib.request.urlopen")
+    @patch("chalilulz._OPENER.open")
     def test_call_ollama_success(self, mock_urlopen):
         mock_urlopen.side_effect = mock_urlopen_success(
             {
@@ -197,7 +202,7 @@ class TestOpenAICompatible(unittest.TestCase):
         chalilulz.GROQ_KEY = self.orig_GROQ_KEY
         chalilulz.GEMINI_KEY = self.orig_GEMINI_KEY
 
-    @patch("urllib.request.urlopen")
+    @patch("chalilulz._OPENER.open")
     def test_call_mistral_success(self, mock_urlopen):
         mock_urlopen.side_effect = mock_urlopen_success(
             {
@@ -214,7 +219,7 @@ class TestOpenAICompatible(unittest.TestCase):
         resp, use_tools = result
         self.assertEqual(resp["choices"][0]["message"]["content"], "Mistral here")
 
-    @patch("urllib.request.urlopen")
+    @patch("chalilulz._OPENER.open")
     def test_call_gemini_with_correct_header(self, mock_urlopen):
         mock_urlopen.side_effect = mock_urlopen_success(
             {
@@ -237,19 +242,71 @@ class TestOpenAICompatible(unittest.TestCase):
         self.assertIn("x-goog-api-key", headers_lower)
         self.assertEqual(headers_lower["x-goog-api-key"], "google-key")
 
+    @patch("chalilulz._OPENER.open")
+    def test_call_ollama_sets_num_ctx_and_keep_alive(self, mock_urlopen):
+        mock_urlopen.side_effect = mock_urlopen_success({"message": {"content": "x"}})
+        import chalilulz
+
+        chalilulz.ACTUAL_MODEL = "num-ctx-model"
+        chalilulz.PROVIDER = "ollama"
+        chalilulz._NUM_CTX.pop("num-ctx-model", None)
+        with patch("sys.stdout"):
+            call_ollama([{"role": "user", "content": "hi"}], "System")
+        body = json.loads(mock_urlopen.call_args[0][0].data)
+        self.assertEqual(body["keep_alive"], chalilulz.KEEP_ALIVE)
+        self.assertGreaterEqual(body["options"]["num_ctx"], 2048)
+
+
+class TestOllamaTuning(DataDirCase):
+    SAVE = ("PROVIDER", "ACTUAL_MODEL", "CTX_OVERRIDE")
 
-class TestCallAPIDispatcher(unittest.TestCase):
     def setUp(self):
         import chalilulz
 
-        self.orig_PROVIDER = chalilulz.PROVIDER
-        self.orig_ACTUAL_MODEL = chalilulz.ACTUAL_MODEL
+        super().setUp()
+        chalilulz._NUM_CTX.clear()
+        self.addCleanup(chalilulz._NUM_CTX.clear)
 
-    def tearDown(self):
+    def test_num_ctx_grows_in_powers_of_two_and_sticks(self):
         import chalilulz
 
-        chalilulz.PROVIDER = self.orig_PROVIDER
-        chalilulz.ACTUAL_MODEL = self.orig_ACTUAL_MODEL
+        chalilulz.CTX_OVERRIDE = {"ollama:m": 32768}
+        small = chalilulz.ollama_num_ctx([], "", "m")
+        self.assertEqual(small & (small - 1), 0)
+        big = chalilulz.ollama_num_ctx([{"content": "x" * 60000}], "", "m")
+        self.assertGreater(big, small)
+        # a shorter history doesn't shrink it again (that would reload the model)
+        self.assertEqual(chalilulz.ollama_num_ctx([], "", "m"), big)
+
+    def test_num_ctx_capped_at_model_max(self):
+        import chalilulz
+
+        chalilulz.CTX_OVERRIDE = {"ollama:m": 4096}
+        self.assertEqual(chalilulz.ollama_num_ctx([{"content": "x" * 100000}], "", "m"), 4096)
+
+    @patch("chalilulz._OPENER.open")
+    def test_warm_up_loads_model(self, mock_urlopen):
+        import chalilulz
+
+        chalilulz.PROVIDER, chalilulz.ACTUAL_MODEL = "ollama", "m"
+        chalilulz.CTX_OVERRIDE = {"ollama:m": 8192}
+        chalilulz.warm_ollama("sys").join(2)
+        req = mock_urlopen.call_args[0][0]
+        self.assertTrue(req.full_url.endswith("/api/generate"))
+        body = json.loads(req.data)
+        self.assertEqual(body["model"], "m")
+        self.assertIn("keep_alive", body)
+        self.assertEqual(body["options"]["num_ctx"], chalilulz._NUM_CTX["m"])
+
+    def test_no_warm_up_for_remote_providers(self):
+        import chalilulz
+
+        chalilulz.PROVIDER = "groq"
+        self.assertIsNone(chalilulz.warm_ollama())
+
+
+class TestCallAPIDispatcher(DataDirCase):
+    SAVE = ("PROVIDER", "ACTUAL_MODEL")
 
     @patch("chalilulz.call_ollama")
     def test_dispatcher_ollama(self, mock_ollama):
@@ -304,20 +361,17 @@ class TestCallAPIDispatcher(unittest.TestCase):
             call_api([], "System")
 
 
-class TestNoToolsModels(unittest.TestCase):
-    def setUp(self):
-        import chalilulz
-
-        self.original = chalilulz.NO_TOOLS_MODELS.copy()
-        chalilulz.NO_TOOLS_MODELS.clear()
+class TestNoToolsModels(DataDirCase):
+    # the 400 fallback is persisted to the capability cache, which DataDirCase keeps out of $HOME
+    SAVE = ("NO_TOOLS_MODELS",)
 
-    def tearDown(self):
+    def setUp(self):
         import chalilulz
 
+        super().setUp()
         chalilulz.NO_TOOLS_MODELS.clear()
-        chalilulz.NO_TOOLS_MODELS.update(self.original)
 
-    @patch("urllib.request.urlopen")
+    @patch("chalilulz._OPENER.open")
     def test_ollama_fallback_on_400(self, mock_urlopen):
         # Simulate 400 error on first call, then success on retry
         call_count = 0
@@ -347,5 +401,106 @@ class TestNoToolsModels(unittest.TestCase):
         self.assertIn(chalilulz.ACTUAL_MODEL, chalilulz.NO_TOOLS_MODELS)
 
 
+class TestStreamTiming(unittest.TestCase):
+    def test_sse_records_ttft_and_tps(self):
+        lines = [
+            b"data: " + json.dumps({"choices": [{"delta": {"content": "Hi there"}}]}).encode(),
+            b"data: " + json.dumps({"usage": {"prompt_tokens": 3, "completion_tokens": 4}}).encode(),
+            b"data: [DONE]",
+        ]
+        with patch("sys.stdout"):
+            resp = read_sse_stream(iter(lines), {"start": 0.0, "connect": 0.1})
+        tm = resp["timing"]
+        self.assertEqual(tm["connect"], 0.1)
+        self.assertIn("ttft", tm)
+        self.assertIn("total", tm)
+        self.assertNotIn("start", tm)
+
+    def test_ndjson_keeps_ollama_durations(self):
+        lines = [
+            json.dumps({"message": {"content": "ok"}, "done": False}).encode(),
+            json.dumps(
+                {
+                    "done": True,
+                    "prompt_eval_count": 5,
+                    "eval_count": 20,
+                    "load_duration": 2_000_000_000,
+                    "prompt_eval_duration": 500_000_000,
+                    "eval_duration": 1_000_000_000,
+                }
+            ).encode(),
+        ]
+        with patch("sys.stdout"):
+            resp = read_ndjson_stream(iter(lines))
+        tm = resp["timing"]
+        self.assertAlmostEqual(tm["load"], 2.0)
+        self.assertAlmostEqual(tm["prompt_eval"], 0.5)
+        self.assertAlmostEqual(tm["tps"], 20.0)
+
+    def test_fmt_timing_compact(self):
+        line = fmt_timing(
+            {"prompt_tokens": 10, "completion_tokens": 5},
+            {"connect": 0.2, "ttft": 0.5, "tps": 40.0, "tools": 0.1},
+        )
+        self.assertEqual(
+            line, "↑10 ↓5 · conn 0.20s · ttft 0.50s · 40.0 tok/s · tools 0.10s"
+        )
+        self.assertEqual(fmt_timing({}, {}), "")
+
+    def test_stats_summary(self):
+        st = stats_summary(
+            [{"connect": 0.1, "total": 1.0}, {"connect": 0.3, "total": 2.0, "tools": 0.5}]
+        )
+        self.assertEqual(st["rounds"], 2)
+        self.assertAlmostEqual(st["connect"], 0.2)
+        self.assertAlmostEqual(st["model"], 3.0)
+        self.assertAlmostEqual(st["tools"], 0.5)
+        self.assertIsNone(st["ttft"])
+        self.assertEqual(stats_summary([]), {})
+
+
+class InterruptedStream:
+    """yields some lines then raises KeyboardInterrupt, like Ctrl-C mid-stream"""
+
+    def __init__(self, lines):
+        self.lines = lines
+        self.closed = False
+
+    def __iter__(self):
+        yield from self.lines
+        raise KeyboardInterrupt
+
+    def close(self):
+        self.closed = True
+
+
+class TestStreamCancel(unittest.TestCase):
+    def test_sse_interrupt_keeps_partial_and_closes(self):
+        resp = InterruptedStream(
+            [
+                b"data: " + json.dumps({"choices": [{"delta": {"content": "partial"}}]}).encode(),
+                b"data: "
+                + json.dumps(
+                    {"choices": [{"delta": {"tool_calls": [{"index": 0, "id": "c1", "function": {"name": "read", "arguments": "{\"pa"}}]}}]}
+                ).encode(),
+            ]
+        )
+        with patch("sys.stdout"):
+            out = read_sse_stream(resp)
+        self.assertTrue(out["interrupted"])
+        self.assertTrue(resp.closed)
+        msg = out["choices"][0]["message"]
+        self.assertEqual(msg["content"], "partial")
+        self.assertNotIn("tool_calls", msg)
+
+    def test_ndjson_interrupt(self):
+        resp = InterruptedStream([json.dumps({"message": {"content": "abc"}}).encode()])
+        with patch("sys.stdout"):
+            out = read_ndjson_stream(resp)
+        self.assertTrue(out["interrupted"])
+        self.assertTrue(resp.closed)
+        self.assertEqual(out["choices"][0]["message"]["content"], "abc")
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,103 @@
+"""
+test_batch — Parallel headless tasks and resumable results
+"""
+
+import unittest
+import sys
+import os
+import json
+import time
+import tempfile
+import shutil
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from chalilulz import batch
+from chalilulz.mock import MockLLM
+
+
+class TestBatchRun(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.llm = MockLLM([{"content": "done here"}], loop=True)
+        url = self.llm.start()
+        env = {
+            "GROQ_HOST": url + "/v1",
+            "GROQ_API_KEY": "k",
+            "CHALILULZ_HOME": os.path.join(self.tmp, "home"),
+        }
+        self._env = patch.dict(os.environ, env)
+        self._env.start()
+        self.tasks = os.path.join(self.tmp, "tasks.jsonl")
+        self.out = os.path.join(self.tmp, "results.jsonl")
+        with open(self.tasks, "w") as f:
+            for i in range(3):
+                task = {"prompt": f"task {i}", "cwd": self.tmp, "model": "groq:mock"}
+                f.write(json.dumps(task) + "\n")
+
+    def tearDown(self):
+        self._env.stop()
+        self.llm.stop()
+        shutil.rmtree(self.tmp)
+
+    def chats(self):
+        return [p for p, _ in self.llm.requests if p.endswith("/chat/completions")]
+
+    def test_runs_in_parallel_then_resumes(self):
+        t0 = time.perf_counter()
+        res = batch.run(batch.load_tasks(self.tasks), self.out, workers=3, rpm={"groq": 300})
+        wall = time.perf_counter() - t0
+        self.assertEqual(sorted(r["id"] for r in res), ["1", "2", "3"])
+        for r in res:
+            self.assertEqual(r["status"], "ok", r.get("error"))
+            self.assertEqual(r["text"], "done here")
+            self.assertEqual(r["usage"]["completion_tokens"], 2)
+            self.assertEqual(r["rounds"], 1)
+        self.assertGreaterEqual(wall, 0.4)  # three starts spaced 0.2s apart
+        with open(self.out) as f:
+            self.assertEqual(len(f.readlines()), 3)
+        # second run finds everything recorded and does nothing
+        self.assertEqual(batch.run(batch.load_tasks(self.tasks), self.out), [])
+        self.assertEqual(len(self.chats()), 3)
+
+    def test_retry_failed(self):
+        with open(self.out, "w") as f:
+            f.write(json.dumps({"id": "1", "status": "ok"}) + "\n")
+            f.write(json.dumps({"id": "2", "status": "error"}) + "\n")
+            f.write('{"id": "3", "sta')  # torn line from a killed run
+        self.assertEqual(batch.load_done(self.out), {"1", "2"})
+        self.assertEqual(batch.load_done(self.out, retry_failed=True), {"1"})
+
+
+class TestBatchHelpers(unittest.TestCase):
+    def test_summarize_events(self):
+        events = [
+            {"type": "tool_call", "name": "ls"},
+            {"type": "round", "usage": {"prompt_tokens": 5, "completion_tokens": 1}},
+            {"type": "round", "usage": {"prompt_tokens": 7, "completion_tokens": 2}},
+            {"type": "done", "status": "ok", "text": "hi", "stats": {"rounds": 2}},
+        ]
+        r = batch._summarize(events)
+        self.assertEqual(r["usage"], {"prompt_tokens": 12, "completion_tokens": 3})
+        self.assertEqual((r["rounds"], r["tool_calls"], r["status"]), (2, 1, "ok"))
+        self.assertEqual(batch._summarize([])["status"], "error")
+
+    def test_limit_parsing(self):
+        self.assertEqual(batch._limits(["60", "groq=30"]), {"*": 60.0, "groq": 30.0})
+
+    def test_task_ids_and_validation(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        p = os.path.join(tmp, "t.jsonl")
+        with open(p, "w") as f:
+            f.write('{"prompt": "a"}\n\n{"prompt": "b", "id": 7}\n')
+        self.assertEqual([t["id"] for t in batch.load_tasks(p)], ["1", "7"])
+        with open(p, "w") as f:
+            f.write('{"cwd": "."}\n')
+        with self.assertRaises(ValueError):
+            batch.load_tasks(p)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,125 @@
+"""
+test_bench — End-to-end benchmark run and baseline comparison
+"""
+
+import unittest
+import sys
+import os
+import json
+import tempfile
+import shutil
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import chalilulz
+from chalilulz import bench
+
+
+class TestBenchRun(unittest.TestCase):
+    def test_run_openai(self):
+        model, home = chalilulz.MODEL, os.environ.get("CHALILULZ_HOME")
+        res = bench.run(sessions=2, files=20)
+        self.assertEqual(res["rounds"], 8)
+        for k in bench.METRICS:
+            self.assertIn(k, res["metrics"])
+        self.assertGreater(res["metrics"]["sse_parse_mb_s"], 0)
+        self.assertIsNotNone(res["metrics"]["tools_ms_avg"])
+        # globals and env restored
+        self.assertEqual(chalilulz.MODEL, model)
+        self.assertEqual(os.environ.get("CHALILULZ_HOME"), home)
+
+    def test_run_ollama(self):
+        res = bench.run(sessions=1, files=20, provider="ollama")
+        self.assertEqual(res["rounds"], 4)
+
+
+class TestMakeRepo(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+
+    def _tree(self, root):
+        out = {}
+        for d, _, fs in os.walk(root):
+            for f in fs:
+                p = os.path.join(d, f)
+                with open(p, "rb") as fh:
+                    out[os.path.relpath(p, root)] = fh.read()
+        return out
+
+    def test_deterministic(self):
+        a, b = os.path.join(self.tmp, "a"), os.path.join(self.tmp, "b")
+        self.assertEqual(bench.make_repo(a, 150, seed=3), bench.make_repo(b, 150, seed=3))
+        self.assertEqual(self._tree(a), self._tree(b))
+        c = os.path.join(self.tmp, "c")
+        bench.make_repo(c, 150, seed=4)
+        self.assertNotEqual(self._tree(a), self._tree(c))
+
+    def test_shape(self):
+        text = bench.make_repo(self.tmp, 400, depth=2, binary=0.1, ignored=0.3)
+        tree = self._tree(self.tmp)
+        self.assertEqual(len(tree), 400)
+        bins = [p for p in tree if p.endswith(".bin")]
+        ign = [p for p in tree if any(x in p.split(os.sep) for x in bench.IGNORED)]
+        self.assertTrue(20 < len(bins) < 70)
+        self.assertTrue(80 < len(ign) < 160)
+        self.assertTrue(all(p.count(os.sep) <= 3 for p in tree))
+        self.assertEqual(len(text), len(set(tree) - set(bins) - set(ign)))
+        for p in text:
+            self.assertIn(b"def f0", tree[p])
+
+    def test_ignored_dirs_hidden_from_tools(self):
+        bench.make_repo(self.tmp, 200, ignored=0.5)
+        out = chalilulz._gl({"pat": "**/*", "path": self.tmp})
+        self.assertFalse(any(x in out.split(os.sep) for x in ["node_modules", ".git"]))
+
+
+class TestScale(unittest.TestCase):
+    def test_scale_rows(self):
+        res = bench.scale((50, 100))
+        self.assertEqual(len(res["rows"]), 2 * len(bench.SCALE_TOOLS))
+        self.assertEqual(res["config"]["sizes"], [50, 100])
+        for tool in bench.SCALE_TOOLS:
+            self.assertIn(f"{tool}_ms@100", res["metrics"])
+            self.assertIn(f"{tool}_peak_kb@50", res["metrics"])
+        grep = [r for r in res["rows"] if r["tool"] == "grep"]
+        self.assertTrue(all(r["lines"] > 1 for r in grep))
+
+
+class TestBenchCompare(unittest.TestCase):
+    def test_compare_directions(self):
+        base = {"metrics": {"round_ms_p50": 10.0, "sse_parse_mb_s": 100.0}}
+        ok = {"metrics": {"round_ms_p50": 11.0, "sse_parse_mb_s": 90.0}}
+        self.assertEqual(bench.compare(ok, base, 0.25), [])
+        bad = {"metrics": {"round_ms_p50": 20.0, "sse_parse_mb_s": 50.0}}
+        names = [r[0] for r in bench.compare(bad, base, 0.25)]
+        self.assertEqual(names, ["round_ms_p50", "sse_parse_mb_s"])
+
+    def test_compare_scale_metrics(self):
+        base = {"metrics": {"grep_ms@1000": 10.0}}
+        cur = {"metrics": {"grep_ms@1000": 20.0}}
+        self.assertEqual([r[0] for r in bench.compare(cur, base)], ["grep_ms@1000"])
+
+    def test_compare_skips_missing(self):
+        base = {"metrics": {"peak_rss_mb": None, "truncate_ms": 0}}
+        cur = {"metrics": {"peak_rss_mb": 50.0, "truncate_ms": 5.0}}
+        self.assertEqual(bench.compare(cur, base), [])
+
+    def test_main_exit_on_regression(self):
+        tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp)
+        base = os.path.join(tmp, "base.json")
+        with open(base, "w") as f:
+            json.dump({"metrics": {"round_ms_p50": 1e-9}}, f)
+        fake = {"rounds": 1, "wall_s": 0.1, "metrics": {"round_ms_p50": 1.0}}
+        with patch("chalilulz.bench.run", return_value=fake), patch("builtins.print"):
+            self.assertEqual(bench.main(["--baseline", base]), 1)
+            out = os.path.join(tmp, "out.json")
+            self.assertEqual(bench.main(["--out", out]), 0)
+        with open(out) as f:
+            self.assertEqual(json.load(f)["rounds"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
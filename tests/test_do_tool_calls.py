@@ -76,6 +76,21 @@ class TestDoToolCalls(unittest.TestCase):
         self.assertEqual(len(self.msgs), initial_len + 1)
         self.assertEqual(self.msgs[-1]["role"], "tool")
 
+    def test_interrupt_fills_remaining_results(self):
+        import chalilulz
+        from unittest.mock import patch
+
+        chalilulz.PROVIDER = "groq"
+        second = dict(self.tool_call, id="call_456")
+        with patch("chalilulz.run_tool", side_effect=KeyboardInterrupt), patch(
+            "chalilulz.show_tc"
+        ):
+            with self.assertRaises(KeyboardInterrupt):
+                _do_tool_calls([self.tool_call, second], self.msgs, xml_mode=False)
+        # every call id still has a result so the next request is well-formed
+        self.assertEqual([m["tool_call_id"] for m in self.msgs], ["call_123", "call_456"])
+        self.assertIn("interrupted", self.msgs[0]["content"])
+
 
 if __name__ == "__main__":
     unittest.main()
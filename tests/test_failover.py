@@ -0,0 +1,196 @@
+"""
+test_failover — Provider failover chain, circuit breakers and history conversion
+"""
+
+import unittest
+import sys
+import os
+import json
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import chalilulz
+from tests import DataDirCase
+
+
+OK = ({"choices": [{"message": {"content": "ok"}}], "usage": {}}, True)
+
+
+class TestFailover(DataDirCase):
+    SAVE = ("PROVIDER", "ACTUAL_MODEL", "FALLBACK", "KEY", "GROQ_KEY", "NO_TOOLS_MODELS")
+
+    def setUp(self):
+        super().setUp()
+        chalilulz.PROVIDER, chalilulz.ACTUAL_MODEL = "groq", "llama"
+        chalilulz.FALLBACK = ["openrouter:backup", "ollama:local"]
+        chalilulz.KEY = chalilulz.GROQ_KEY = "k"
+
+    def test_rate_limit_fails_over(self):
+        seen = []
+
+        def groq(msgs, sysp, fnt=False):
+            seen.append(("groq", chalilulz.ACTUAL_MODEL))
+            raise chalilulz.ProviderError("HTTP 429: slow down")
+
+        def openrouter(msgs, sysp, fnt=False):
+            seen.append(("openrouter", chalilulz.ACTUAL_MODEL))
+            return OK
+
+        with patch("chalilulz.call_groq", side_effect=groq), patch(
+            "chalilulz.call_openrouter", side_effect=openrouter
+        ), patch("builtins.print"):
+            resp, _ = chalilulz.call_api([], "sys")
+        self.assertEqual(seen, [("groq", "llama"), ("openrouter", "backup")])
+        self.assertEqual(resp["model"], "openrouter:backup")
+        # the session model is unchanged after failover
+        self.assertEqual((chalilulz.PROVIDER, chalilulz.ACTUAL_MODEL), ("groq", "llama"))
+
+    def test_open_breaker_skips_provider(self):
+        with patch("chalilulz.call_groq", side_effect=chalilulz.ProviderError("down")), patch(
+            "chalilulz.call_openrouter", return_value=OK
+        ), patch("builtins.print"):
+            chalilulz.call_api([], "sys")
+        with patch("chalilulz.call_groq") as groq, patch(
+            "chalilulz.call_openrouter", return_value=OK
+        ):
+            chalilulz.call_api([], "sys")
+        groq.assert_not_called()
+
+    def test_breaker_is_per_model(self):
+        chalilulz.FALLBACK = ["groq:other", "openrouter:backup"]
+        seen = []
+
+        def groq(msgs, sysp, fnt=False):
+            seen.append(chalilulz.ACTUAL_MODEL)
+            if chalilulz.ACTUAL_MODEL == "llama":
+                raise chalilulz.ProviderError("HTTP 503")
+            return OK
+
+        with patch("chalilulz.call_groq", side_effect=groq), patch("builtins.print"):
+            chalilulz.call_api([], "sys")
+            chalilulz.call_api([], "sys")
+        # llama's breaker is open; the same provider's other model still runs
+        self.assertEqual(seen, ["llama", "other", "other"])
+
+    def test_prompt_picked_per_candidate(self):
+        chalilulz.NO_TOOLS_MODELS.add("backup")
+        prompts = []
+
+        def record(name, err=None):
+            def call(msgs, sysp, fnt=False):
+                prompts.append((name, sysp))
+                if err:
+                    raise err
+                return OK
+
+            return call
+
+        with patch("chalilulz.call_groq", side_effect=record("groq", chalilulz.ProviderError("HTTP 429"))), patch(
+            "chalilulz.call_openrouter", side_effect=record("openrouter")
+        ), patch("builtins.print"):
+            chalilulz.call_api([], "sys", "xml")
+        self.assertEqual(prompts, [("groq", "sys"), ("openrouter", "xml")])
+
+    def test_non_retryable_error_propagates(self):
+        with patch("chalilulz.call_groq", side_effect=RuntimeError("HTTP 401")), patch(
+            "chalilulz.call_openrouter"
+        ) as orr:
+            with self.assertRaises(RuntimeError):
+                chalilulz.call_api([], "sys")
+        orr.assert_not_called()
+
+    def test_all_failing_raises_last_error(self):
+        err = chalilulz.ProviderError("boom")
+        with patch("chalilulz.call_groq", side_effect=err), patch(
+            "chalilulz.call_openrouter", side_effect=err
+        ), patch("chalilulz.call_ollama", side_effect=err), patch("builtins.print"):
+            with self.assertRaises(chalilulz.ProviderError):
+                chalilulz.call_api([], "sys")
+
+    def test_http_error_classification(self):
+        self.assertIsInstance(chalilulz._http_error(429, ""), chalilulz.ProviderError)
+        self.assertIsInstance(chalilulz._http_error(503, ""), chalilulz.ProviderError)
+        err = chalilulz._http_error(401, "")
+        self.assertNotIsInstance(err, chalilulz.ProviderError)
+        self.assertIsInstance(err, RuntimeError)
+
+    def test_stalled_first_token_is_retryable(self):
+        def stalled():
+            raise chalilulz.socket.timeout("timed out")
+            yield
+
+        with patch("sys.stdout"):
+            with self.assertRaises(chalilulz.ProviderError):
+                chalilulz.read_sse_stream(stalled())
+
+    def test_open_error_classification(self):
+        e = chalilulz._open_error(chalilulz.urllib.error.URLError(chalilulz.socket.timeout()))
+        self.assertEqual(e.phase, "connect")
+        e = chalilulz._open_error(chalilulz.socket.timeout("timed out"))
+        self.assertEqual(e.phase, "first_byte")
+        e = chalilulz._open_error(chalilulz.urllib.error.URLError("refused"))
+        self.assertIsInstance(e, chalilulz.ProviderError)
+        self.assertNotIsInstance(e, chalilulz.StreamTimeout)
+
+    def test_mid_stream_break_is_not_retryable(self):
+        def broken():
+            yield b"data: " + json.dumps({"choices": [{"delta": {"content": "a"}}]}).encode()
+            raise ConnectionResetError("reset")
+
+        with patch("sys.stdout"):
+            with self.assertRaises(RuntimeError) as cm:
+                chalilulz.read_sse_stream(broken())
+        self.assertNotIsInstance(cm.exception, chalilulz.ProviderError)
+
+
+class TestConvertMsgs(unittest.TestCase):
+    def test_ollama_history_to_openai(self):
+        msgs = [
+            {"role": "user", "content": "hi"},
+            {
+                "role": "assistant",
+                "content": "",
+                "tool_calls": [{"function": {"name": "read", "arguments": {"path": "a"}}}],
+            },
+            {"role": "tool", "tool_name": "read", "content": "data"},
+        ]
+        out = chalilulz.convert_msgs(msgs, "groq")
+        tc = out[1]["tool_calls"][0]
+        self.assertEqual(json.loads(tc["function"]["arguments"]), {"path": "a"})
+        self.assertEqual(out[2]["tool_call_id"], tc["id"])
+        self.assertNotIn("tool_name", out[2])
+        # the stored history is not mutated
+        self.assertIn("tool_name", msgs[2])
+
+    def test_openai_history_to_ollama(self):
+        msgs = [
+            {
+                "role": "assistant",
+                "content": "",
+                "tool_calls": [
+                    {"id": "c1", "type": "function", "function": {"name": "ls", "arguments": "{}"}},
+                    {"id": "c2", "type": "function", "function": {"name": "read", "arguments": "{\"path\": \"x\"}"}},
+                ],
+            },
+            {"role": "tool", "tool_call_id": "c2", "content": "x"},
+            {"role": "tool", "tool_call_id": "c1", "content": "dir"},
+        ]
+        out = chalilulz.convert_msgs(msgs, "ollama")
+        self.assertEqual(out[0]["tool_calls"][1]["function"]["arguments"], {"path": "x"})
+        self.assertEqual([m["tool_name"] for m in out[1:]], ["read", "ls"])
+
+    def test_native_history_is_returned_as_is(self):
+        msgs = [
+            {
+                "role": "assistant",
+                "content": "",
+                "tool_calls": [{"id": "c1", "type": "function", "function": {"name": "ls", "arguments": "{}"}}],
+            },
+            {"role": "tool", "tool_call_id": "c1", "content": "dir"},
+        ]
+        self.assertIs(chalilulz.convert_msgs(msgs, "groq"), msgs)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -5,6 +5,11 @@ test_main — Main REPL loop and command handling
 import unittest
 import sys
 import os
+import io
+import json
+import tempfile
+import shutil
+from pathlib import Path
 from unittest.mock import patch, MagicMock, mock_open
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -22,17 +27,43 @@ class TestMainREPL(unittest.TestCase):
         self.orig_ACTUAL_MODEL = chalilulz.ACTUAL_MODEL
         self.orig_KEY = chalilulz.KEY
         self.orig_OLLAMA_HOST = chalilulz.OLLAMA_HOST
+        # keep caches and sessions written by main() out of $HOME
+        self.data_dir = tempfile.mkdtemp()
+        self._patches = [
+            patch("chalilulz._data_dir", return_value=Path(self.data_dir)),
+            patch("chalilulz._fetch_ctx", return_value=None),
+        ]
+        for p in self._patches:
+            p.start()
 
     def tearDown(self):
         # Restore globals
         import chalilulz
 
+        for p in self._patches:
+            p.stop()
+        shutil.rmtree(self.data_dir)
+
         chalilulz.MODEL = self.orig_MODEL
         chalilulz.PROVIDER = self.orig_PROVIDER
         chalilulz.ACTUAL_MODEL = self.orig_ACTUAL_MODEL
         chalilulz.KEY = self.orig_KEY
         chalilulz.OLLAMA_HOST = self.orig_OLLAMA_HOST
 
+    def _repl(self, argv=()):
+        """run main(argv) quietly; returns the Agent the REPL drove"""
+        import chalilulz
+
+        made, real = [], chalilulz.Agent
+
+        def make(*a, **kw):
+            made.append(real(*a, **kw))
+            return made[-1]
+
+        with patch("chalilulz.Agent", side_effect=make), patch("builtins.print"):
+            main(list(argv))
+        return made[0]
+
     @patch("builtins.input", side_effect=["/q"])
     @patch("chalilulz.call_api")
     @patch("chalilulz.sep")
@@ -63,14 +94,14 @@ class TestMainREPL(unittest.TestCase):
     @patch("chalilulz.sep")
     @patch("chalilulz.SP")
     def test_model_change_command(self, mock_sp, mock_sep, mock_call, mock_input):
-        """Test that /model updates the global model"""
+        """Test that /model updates the session's model, not the module defaults"""
         import chalilulz
 
-        with patch("builtins.print"):
-            main([])
-        self.assertEqual(chalilulz.MODEL, "mistral:small")
-        self.assertEqual(chalilulz.PROVIDER, "mistral")
-        self.assertEqual(chalilulz.ACTUAL_MODEL, "small")
+        ag = self._repl()
+        self.assertEqual(ag.model, "mistral:small")
+        self.assertEqual(ag.provider, "mistral")
+        self.assertEqual(ag.actual_model, "small")
+        self.assertNotEqual(chalilulz.MODEL, "mistral:small")
 
     @patch("builtins.input", side_effect=["/skills", "/q"])
     @patch("chalilulz.call_api")
@@ -99,7 +130,7 @@ class TestMainREPL(unittest.TestCase):
         # Capture msgs at call time
         captured_msgs = []
 
-        def capture(msgs, sysp):
+        def capture(msgs, sysp, xml_sysp):
             captured_msgs.append(msgs.copy())  # copy to avoid mutation later
             return ({"choices": [{"message": {"content": "Hi"}}]}, False)
 
@@ -141,12 +172,9 @@ class TestMainREPL(unittest.TestCase):
         self, mock_sp, mock_sep, mock_call, mock_input
     ):
         """Test that invalid model change still updates provider"""
-        import chalilulz
-
-        with patch("builtins.print"):
-            main([])
-        self.assertEqual(chalilulz.MODEL, "invalid")
-        self.assertEqual(chalilulz.PROVIDER, "ollama")  # default provider
+        ag = self._repl()
+        self.assertEqual(ag.model, "invalid")
+        self.assertEqual(ag.provider, "ollama")  # default provider
 
     @patch("builtins.input", side_effect=["/model   mistral:small  ", "/q"])
     @patch("chalilulz.call_api")
@@ -154,13 +182,91 @@ class TestMainREPL(unittest.TestCase):
     @patch("chalilulz.SP")
     def test_model_whitespace_handling(self, mock_sp, mock_sep, mock_call, mock_input):
         """Test that /model with extra whitespace trims correctly"""
+        ag = self._repl()
+        self.assertEqual(ag.model, "mistral:small")
+        self.assertEqual(ag.provider, "mistral")
+        self.assertEqual(ag.actual_model, "small")
+
+    @patch("builtins.input", side_effect=["Hello", "/q"])
+    @patch("chalilulz.call_api")
+    @patch("chalilulz.sep")
+    @patch("chalilulz.SP")
+    def test_interrupted_reply_kept_in_history(
+        self, mock_sp, mock_sep, mock_call, mock_input
+    ):
+        """Test that a Ctrl-C'd stream keeps the partial reply, marked as interrupted"""
         import chalilulz
 
+        seen = []
+
+        def interrupted(msgs, sysp, xml_sysp):
+            seen.append(msgs)
+            return (
+                {"choices": [{"message": {"content": "half"}}], "interrupted": True},
+                True,
+            )
+
+        mock_call.side_effect = interrupted
         with patch("builtins.print"):
             main([])
-        self.assertEqual(chalilulz.MODEL, "mistral:small")
-        self.assertEqual(chalilulz.PROVIDER, "mistral")
-        self.assertEqual(chalilulz.ACTUAL_MODEL, "small")
+        msgs = seen[0]
+        self.assertEqual(msgs[-1]["role"], "assistant")
+        self.assertEqual(msgs[-1]["content"], "half\n" + chalilulz.INTERRUPTED)
+        mock_sp.stop.assert_called()
+
+    def _headless(self, argv, replies, stdin=""):
+        """run main(argv) headless; returns (exit status, stdout text, msgs seen by the api)"""
+        seen = []
+
+        def reply(msgs, sysp, xml_sysp):
+            seen.append([dict(m) for m in msgs])
+            return replies.pop(0)
+
+        out = io.StringIO()
+        with patch("chalilulz.call_api", side_effect=reply), patch(
+            "builtins.input", side_effect=AssertionError("prompted")
+        ), patch("sys.stdin", io.StringIO(stdin)), patch("sys.stdout", out), patch(
+            "sys.stderr", io.StringIO()
+        ):
+            rc = main(["--model", "ollama:x"] + argv)
+        return rc, out.getvalue(), seen
+
+    def test_headless_prompt(self):
+        text = {"choices": [{"message": {"content": "Hi"}}], "usage": {}}
+        rc, out, seen = self._headless(["-p", "hello"], [(text, True)])
+        self.assertEqual(rc, 0)
+        self.assertEqual(seen[0][0]["content"], "hello")
+
+    def test_headless_stdin_and_error_status(self):
+        rc, _, seen = self._headless(["-p"], [], stdin="from stdin\n")
+        self.assertEqual(rc, 1)  # call_api ran out of replies → error
+        self.assertEqual(seen[0][0]["content"], "from stdin")
+
+    def test_headless_json_events_and_tool_denial(self):
+        bash = {
+            "id": "c1",
+            "type": "function",
+            "function": {"name": "bash", "arguments": json.dumps({"cmd": "echo hi"})},
+        }
+        replies = [
+            ({"choices": [{"message": {"role": "assistant", "tool_calls": [bash]}}]}, True),
+            ({"choices": [{"message": {"role": "assistant", "content": "done"}}], "usage": {"prompt_tokens": 3}}, True),
+        ]
+        rc, out, seen = self._headless(["-p", "run it", "--json"], replies)
+        self.assertEqual(rc, 0)
+        events = [json.loads(ln) for ln in out.splitlines()]
+        types = [e["type"] for e in events]
+        self.assertEqual(types, ["tool_call", "tool_result", "round", "round", "done"])
+        self.assertFalse(events[1]["ok"])
+        self.assertIn("denied", events[1]["result"])
+        self.assertEqual(events[3]["usage"], {"prompt_tokens": 3})
+        self.assertEqual(events[-1]["status"], "ok")
+        self.assertEqual(events[-1]["text"], "done")
+        self.assertEqual(events[-1]["stats"]["rounds"], 2)
+        import chalilulz
+
+        self.assertIsNone(chalilulz.EVENTS)
+        self.assertTrue(chalilulz.INTERACTIVE)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,147 @@
+"""
+test_mock — The stand-in LLM server driven through the real client code
+"""
+
+import unittest
+import sys
+import os
+import json
+import socket
+import threading
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import chalilulz
+from chalilulz.mock import MockLLM, _tokens
+from tests import DataDirCase
+
+
+class MockServerCase(DataDirCase):
+    SAVE = ("PROVIDER", "ACTUAL_MODEL", "GROQ_HOST", "GROQ_KEY", "OLLAMA_HOST", "FALLBACK")
+    script = []
+    kw = {}
+
+    def setUp(self):
+        super().setUp()
+        self.llm = MockLLM(self.script, **self.kw)
+        self.url = self.llm.start()
+        self.addCleanup(self.llm.stop)
+        chalilulz.GROQ_HOST = self.url + "/v1"
+        chalilulz.OLLAMA_HOST = self.url
+        chalilulz.GROQ_KEY = "k"
+
+    def call(self, provider, msgs=None):
+        chalilulz.PROVIDER, chalilulz.ACTUAL_MODEL = provider, "mock"
+        with patch("sys.stdout"), patch("builtins.print"):
+            return chalilulz.call_api(msgs or [{"role": "user", "content": "hi"}], "sys")
+
+
+class TestMockStreaming(MockServerCase):
+    script = [
+        {"content": "hello from the mock"},
+        {"tool_calls": [{"name": "ls", "args": {"path": "."}}]},
+        {"content": "ollama says hi"},
+        {"tool_calls": [{"name": "read", "args": {"path": "x"}}]},
+    ]
+
+    def test_openai_and_ollama_protocols(self):
+        resp, _ = self.call("groq")
+        self.assertEqual(resp["choices"][0]["message"]["content"], "hello from the mock")
+        self.assertEqual(resp["usage"]["completion_tokens"], 4)
+
+        resp, _ = self.call("groq")
+        tc = resp["choices"][0]["message"]["tool_calls"][0]
+        self.assertEqual(tc["function"]["name"], "ls")
+        self.assertEqual(json.loads(tc["function"]["arguments"]), {"path": "."})
+
+        resp, _ = self.call("ollama")
+        self.assertEqual(resp["choices"][0]["message"]["content"], "ollama says hi")
+        self.assertIn("tps", resp["timing"])
+
+        resp, _ = self.call("ollama")
+        tc = resp["choices"][0]["message"]["tool_calls"][0]
+        self.assertEqual(tc["function"]["arguments"], {"path": "x"})
+
+    def test_tokens_roundtrip(self):
+        self.assertEqual("".join(_tokens("a bc  d")), "a bc  d")
+
+
+class TestMockLatency(MockServerCase):
+    kw = {"ttft": 0.2, "tps": 200}
+
+    def test_ttft_is_observed_by_client(self):
+        resp, _ = self.call("groq")
+        self.assertGreaterEqual(resp["timing"]["ttft"], 0.2)
+
+
+class TestMockErrors(MockServerCase):
+    script = [{"error": 429}, {"content": "recovered"}]
+
+    def test_injected_429_triggers_failover(self):
+        chalilulz.FALLBACK = ["ollama:mock"]
+        resp, _ = self.call("groq")
+        self.assertEqual(resp["model"], "ollama:mock")
+        self.assertEqual(resp["choices"][0]["message"]["content"], "recovered")
+        self.assertEqual([p for p, _ in self.llm.requests], ["/v1/chat/completions", "/api/chat"])
+
+
+class TestStreamTimeouts(MockServerCase):
+    script = [
+        {"content": "slow start", "ttft": 0.5},
+        {"content": "a b c", "tps": 2},
+        {"content": "fine", "ttft": 0.2},
+    ]
+
+    SAVE = MockServerCase.SAVE + ("CONNECT_TIMEOUT", "FIRST_BYTE_TIMEOUT", "IDLE_TIMEOUT")
+
+    def setUp(self):
+        super().setUp()
+        chalilulz.FALLBACK = []
+
+    def test_first_byte_then_idle_then_ok(self):
+        chalilulz.FIRST_BYTE_TIMEOUT, chalilulz.IDLE_TIMEOUT = 0.2, 0.2
+        with self.assertRaises(chalilulz.StreamTimeout) as cm:
+            self.call("groq")
+        self.assertEqual(cm.exception.phase, "first_byte")
+        with self.assertRaises(chalilulz.StreamStalled) as cm:
+            self.call("ollama")
+        self.assertEqual(cm.exception.phase, "idle")
+        self.assertNotIsInstance(cm.exception, chalilulz.ProviderError)  # never failed over
+        # a slow first token is fine when only connect/idle are tight
+        chalilulz.CONNECT_TIMEOUT, chalilulz.FIRST_BYTE_TIMEOUT = 0.1, 2
+        resp, _ = self.call("groq")
+        self.assertEqual(resp["choices"][0]["message"]["content"], "fine")
+
+    def test_stall_after_first_token_not_failed_over(self):
+        chalilulz.IDLE_TIMEOUT, chalilulz.FALLBACK = 0.2, ["ollama:mock"]
+        self.llm.script = [{"content": "a b c", "tps": 2}, {"content": "other model"}]
+        with self.assertRaises(chalilulz.StreamStalled):
+            self.call("groq")
+        self.assertEqual(len(self.llm.requests), 1)
+
+    def test_no_response_headers(self):
+        srv = socket.socket()
+        srv.bind(("127.0.0.1", 0))
+        srv.listen(1)
+        self.addCleanup(srv.close)
+        conns = []
+        threading.Thread(target=lambda: conns.append(srv.accept()), daemon=True).start()
+        chalilulz.GROQ_HOST = "http://127.0.0.1:%d/v1" % srv.getsockname()[1]
+        chalilulz.CONNECT_TIMEOUT, chalilulz.FIRST_BYTE_TIMEOUT = 5, 0.2
+        with self.assertRaises(chalilulz.StreamTimeout) as cm:
+            self.call("groq")
+        self.assertEqual(cm.exception.phase, "first_byte")
+        self.assertIn("0.2s", str(cm.exception))
+
+
+class TestMockMetadata(MockServerCase):
+    kw = {"ctx": 4096}
+
+    def test_context_length_endpoints(self):
+        self.assertEqual(chalilulz._fetch_ctx("ollama", "mock"), 4096)
+        self.assertEqual(chalilulz._fetch_ctx("groq", "mock"), 4096)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,199 @@
+"""
+test_providers — Provider registry and the persisted capability cache
+"""
+
+import unittest
+import sys
+import os
+import json
+import time
+import threading
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import chalilulz
+from tests import DataDirCase
+
+
+class CapsTestCase(DataDirCase):
+    """the data dir is a temp dir, so the real cache is never touched"""
+
+    SAVE = ("MODEL", "PROVIDER", "ACTUAL_MODEL", "NO_TOOLS_MODELS")
+
+
+class TestRegistry(unittest.TestCase):
+    def test_every_provider_has_a_call_fn(self):
+        for name, (fn, auth, key_var, host_var) in chalilulz.PROVIDERS.items():
+            self.assertTrue(callable(getattr(chalilulz, fn)), name)
+            self.assertIsInstance(getattr(chalilulz, host_var), str)
+
+    def test_parse_model_uses_registry(self):
+        with patch.dict(chalilulz.PROVIDERS, {"local": ("call_ollama", None, None, "OLLAMA_HOST")}):
+            self.assertEqual(chalilulz.parse_model("local:foo"), ("local", "foo"))
+        self.assertEqual(chalilulz.parse_model("local:foo"), ("ollama", "local:foo"))
+
+    def test_openrouter_uses_host_from_registry(self):
+        seen = []
+
+        def fake(req, timeout=None):
+            seen.append(req.full_url)
+            raise chalilulz.urllib.error.URLError("offline")
+
+        with patch.object(chalilulz, "OPENROUTER_HOST", "http://127.0.0.1:9/v1"), patch(
+            "chalilulz._OPENER.open", side_effect=fake
+        ):
+            with self.assertRaises(Exception):
+                chalilulz.call_openrouter([], "sys")
+        self.assertEqual(seen, ["http://127.0.0.1:9/v1/chat/completions"])
+
+
+class TestCapsCache(CapsTestCase):
+    def test_roundtrip(self):
+        self.assertEqual(chalilulz.get_caps("groq", "m"), {})
+        chalilulz.set_caps("groq", "m", tools=False, ctx=8192)
+        c = chalilulz.get_caps("groq", "m")
+        self.assertIs(c["tools"], False)
+        self.assertEqual(c["ctx"], 8192)
+        chalilulz.set_caps("groq", "m", quirks={"stream_usage": True})
+        self.assertEqual(chalilulz.get_caps("groq", "m")["ctx"], 8192)
+
+    def test_concurrent_writers_keep_every_entry(self):
+        def learn(w):
+            for i in range(20):
+                chalilulz.set_caps("groq", f"w{w}-{i}", tools=True)
+
+        ts = [threading.Thread(target=learn, args=(w,)) for w in range(8)]
+        for t in ts:
+            t.start()
+        for t in ts:
+            t.join(10)
+        self.assertEqual(len(json.loads(chalilulz._caps_path().read_text())), 160)
+        self.assertEqual([p.name for p in self.data.iterdir() if "caps.json." in p.name], ["caps.json.lock"])
+
+    def test_ttl_expiry(self):
+        chalilulz.set_caps("groq", "m", tools=False)
+        later = time.time() + chalilulz.CAPS_TTL + 1
+        with patch("time.time", return_value=later):
+            self.assertEqual(chalilulz.get_caps("groq", "m"), {})
+
+    def test_update_model_seeds_no_tools(self):
+        chalilulz.set_caps("ollama", "tiny", tools=False)
+        chalilulz.NO_TOOLS_MODELS.discard("tiny")
+        chalilulz.update_model("ollama:tiny")
+        self.assertIn("tiny", chalilulz.NO_TOOLS_MODELS)
+
+    def test_call_api_records_capabilities(self):
+        chalilulz.PROVIDER, chalilulz.ACTUAL_MODEL = "groq", "m"
+        resp = {"choices": [{"message": {"content": "x"}}], "usage": {}}
+        with patch("chalilulz.call_groq", return_value=(resp, True)):
+            chalilulz.call_api([], "sys")
+        c = chalilulz.get_caps("groq", "m")
+        self.assertIs(c["tools"], True)
+        self.assertIs(c["quirks"]["stream_usage"], False)
+
+    def fallback_400(self, model, body):
+        chalilulz.PROVIDER, chalilulz.ACTUAL_MODEL = "ollama", model
+        calls = []
+
+        def fake(req, timeout=None):
+            calls.append(json.loads(req.data))
+            if len(calls) == 1:
+                raise chalilulz.urllib.error.HTTPError(
+                    "http://x", 400, "bad", {}, __import__("io").BytesIO(body)
+                )
+            return iter([json.dumps({"message": {"content": "ok"}, "done": True}).encode()])
+
+        with patch("chalilulz._OPENER.open", side_effect=fake), patch("sys.stdout"):
+            chalilulz.call_ollama([], "sys")
+        self.assertIn("tools", calls[0])
+        self.assertNotIn("tools", calls[1])
+        self.assertIn(model, chalilulz.NO_TOOLS_MODELS)
+
+    def test_400_fallback_is_persisted(self):
+        self.fallback_400("no-tools-model", b'{"error": "registry.ollama.ai/x does not support tools"}')
+        self.assertIs(chalilulz.get_caps("ollama", "no-tools-model")["tools"], False)
+
+    def test_other_400_only_for_the_session(self):
+        self.fallback_400("big-prompt", b'{"error": "prompt is longer than the context window"}')
+        self.assertNotIn("tools", chalilulz.get_caps("ollama", "big-prompt"))
+
+    def test_no_tools_messages(self):
+        for msg in ("model does not support tools", "Tool use is not supported for this model",
+                    "No endpoints found that support tool use", "function calling not supported"):
+            self.assertTrue(chalilulz._NO_TOOLS_ERR.search(msg), msg)
+        self.assertFalse(chalilulz._NO_TOOLS_ERR.search("invalid 'tools[0].function.name'"))
+
+
+class FakeJSON:
+    def __init__(self, data):
+        self.data = json.dumps(data).encode()
+
+    def read(self):
+        return self.data
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *a):
+        pass
+
+
+class TestBudget(CapsTestCase):
+    SAVE = CapsTestCase.SAVE + ("CTX_OVERRIDE", "BUDGET")
+
+    def setUp(self):
+        super().setUp()
+        chalilulz.CTX_OVERRIDE = {}
+
+    def test_budget_scales_with_context(self):
+        small, large = chalilulz.budget(8192), chalilulz.budget(200000)
+        self.assertEqual(small["reserve"], 2048)
+        self.assertEqual(small["history"], 6144)
+        self.assertGreater(large["history"], 180000)
+        self.assertGreater(large["tool_chars"], small["tool_chars"])
+
+    def test_override_beats_cache(self):
+        chalilulz.set_caps("groq", "m", ctx=8192)
+        self.assertEqual(chalilulz.model_ctx("groq", "m"), 8192)
+        chalilulz.CTX_OVERRIDE = {"groq:m": 32768}
+        self.assertEqual(chalilulz.model_ctx("groq", "m"), 32768)
+
+    def test_fetch_openrouter_metadata_is_cached(self):
+        data = {"data": [{"id": "a/b", "context_length": 200000}]}
+        with patch("chalilulz._OPENER.open", return_value=FakeJSON(data)) as m:
+            self.assertEqual(chalilulz.model_ctx("openrouter", "a/b"), 200000)
+            self.assertEqual(chalilulz.model_ctx("openrouter", "a/b"), 200000)
+        self.assertEqual(m.call_count, 1)
+        self.assertTrue(m.call_args[0][0].full_url.endswith("/models"))
+
+    def test_fetch_ollama_show(self):
+        data = {"model_info": {"llama.context_length": 8192}}
+        with patch("chalilulz._OPENER.open", return_value=FakeJSON(data)) as m:
+            self.assertEqual(chalilulz.model_ctx("ollama", "llama3"), 8192)
+        self.assertTrue(m.call_args[0][0].full_url.endswith("/api/show"))
+
+    def test_unknown_falls_back_to_default(self):
+        with patch("chalilulz._OPENER.open", side_effect=OSError):
+            self.assertEqual(chalilulz.model_ctx("groq", "x"), chalilulz.DEFAULT_CTX)
+
+    def test_truncate_history(self):
+        msgs = [{"role": "user", "content": "x" * 400} for _ in range(10)]
+        dropped = chalilulz.truncate_history(msgs, 700)
+        self.assertEqual(len(msgs), 10 - dropped)
+        self.assertLessEqual(len(json.dumps(msgs)) // 4, 700)
+        self.assertEqual(dropped, 4)
+        # never below the minimum window
+        chalilulz.truncate_history(msgs, 0)
+        self.assertEqual(len(msgs), 5)
+
+    def test_tool_results_clipped_to_budget(self):
+        chalilulz.BUDGET = chalilulz.budget(8192)
+        out = chalilulz._clip("y" * 10000)
+        self.assertLess(len(out), 10000)
+        self.assertIn("truncated", out)
+        self.assertEqual(chalilulz._clip("short"), "short")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,122 @@
+"""
+test_ratelimit — Shared per-provider rate limit store, token buckets and learned limits
+"""
+
+import unittest
+import sys
+import os
+import json
+import tempfile
+import shutil
+from pathlib import Path
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import chalilulz
+from chalilulz.mock import MockLLM
+
+
+class TestThrottle(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.orig = chalilulz.RATE_DIR, chalilulz.RATE_LIMIT, chalilulz.TOKEN_LIMIT
+        chalilulz.RATE_DIR, chalilulz.RATE_LIMIT, chalilulz.TOKEN_LIMIT = self.tmp, {}, {}
+        self.slept = []
+        self._sleep = patch("time.sleep", side_effect=self.slept.append)
+        self._sleep.start()
+
+    def tearDown(self):
+        self._sleep.stop()
+        chalilulz.RATE_DIR, chalilulz.RATE_LIMIT, chalilulz.TOKEN_LIMIT = self.orig
+        shutil.rmtree(self.tmp)
+
+    def test_spacing(self):
+        chalilulz.RATE_LIMIT = {"*": 600}
+        waits = [chalilulz._throttle("groq") for _ in range(3)]
+        self.assertEqual(waits[0], 0)
+        self.assertAlmostEqual(sum(waits), 0.3, delta=0.05)  # 0, 0.1, 0.2: each queues behind the last
+        self.assertEqual(chalilulz._throttle("ollama"), 0)  # separate provider bucket
+
+    def test_off_without_limit_or_state(self):
+        self.assertEqual(chalilulz._throttle("groq", 10**6), 0)
+        self.assertEqual(os.listdir(self.tmp), [])
+        chalilulz.RATE_LIMIT = {"groq": 1}
+        self.assertEqual(chalilulz._throttle("ollama"), 0)
+
+    def test_buckets_per_key(self):
+        chalilulz.RATE_LIMIT = {"*": 60}
+        a = chalilulz.Agent("groq:m", groq_key="a")
+        b = chalilulz.Agent("groq:m", groq_key="b")
+        with a.active():
+            self.assertEqual(chalilulz._throttle("groq"), 0)
+        with b.active():
+            self.assertEqual(chalilulz._throttle("groq"), 0)
+        with a.active():
+            self.assertAlmostEqual(chalilulz._throttle("groq"), 1, delta=0.05)
+        self.assertEqual(len(os.listdir(self.tmp)), 2)
+
+    def test_tokens_per_minute(self):
+        chalilulz.TOKEN_LIMIT = {"groq": 600}
+        self.assertEqual(chalilulz._throttle("groq", 600), 0)
+        self.assertAlmostEqual(chalilulz._throttle("groq", 60), 6, delta=0.1)
+        chalilulz._rate_spend("groq", 60)  # generated tokens count too
+        self.assertAlmostEqual(chalilulz._throttle("groq", 0), 0, delta=0.1)
+        self.assertAlmostEqual(chalilulz._throttle("groq", 10), 13, delta=0.1)
+
+    def test_lock_without_fcntl(self):
+        calls = []
+        fake = type(sys)("msvcrt")
+        fake.LK_LOCK, fake.LK_UNLCK = 1, 0
+        fake.locking = lambda fd, mode, n: calls.append((mode, n))
+        chalilulz.RATE_LIMIT = {"*": 600}
+        with patch.dict(sys.modules, {"fcntl": None, "msvcrt": fake}):
+            chalilulz._throttle("groq")
+        self.assertEqual(calls, [(1, 1), (0, 1)])
+
+    def test_learns_from_headers(self):
+        chalilulz._rate_learn("groq", {
+            "x-ratelimit-limit-tokens": "6000",
+            "x-ratelimit-remaining-tokens": "0",
+            "x-ratelimit-reset-tokens": "1m0s",
+            "x-ratelimit-limit-requests": "14400",
+            "x-ratelimit-remaining-requests": "14399",
+            "x-ratelimit-reset-requests": "6s",
+        })
+        self.assertAlmostEqual(chalilulz._throttle("groq", 500), 5, delta=0.1)  # refills 100 tok/s
+
+    def test_retry_after_blocks(self):
+        chalilulz._rate_learn("groq", {"retry-after": "2"}, 429)
+        self.assertAlmostEqual(chalilulz._throttle("groq"), 2, delta=0.1)
+        chalilulz._rate_learn("mistral", {"retry-after": "2"}, 200)  # only a 429 blocks
+        self.assertEqual(chalilulz._throttle("mistral"), 0)
+
+    def test_learns_through_agent(self):
+        hdr = {"x-ratelimit-limit-tokens": "1000", "x-ratelimit-remaining-tokens": "400"}
+        llm = MockLLM([{"content": "hi", "headers": hdr}, {"error": 429, "headers": {"Retry-After": "3"}}])
+        llm.start()
+        self.addCleanup(llm.stop)
+        home = patch("chalilulz._data_dir", return_value=Path(self.tmp) / "home")
+        home.start()
+        self.addCleanup(home.stop)
+        ag = chalilulz.Agent("groq:mock", groq_host=llm.url + "/v1", groq_key="k", fallback=[],
+                             ctx_override={"*": 32768})
+        self.assertEqual(ag.turn("hi"), "ok")
+        (f,) = [f for f in os.listdir(self.tmp) if f.endswith(".json")]
+        with open(os.path.join(self.tmp, f)) as fh:
+            st = json.load(fh)
+        self.assertEqual(st["tok"]["limit"], 1000)
+        self.assertLessEqual(st["tok"]["level"], 400)
+        self.assertEqual(ag.turn("again"), "error")
+        with ag.active():
+            self.assertAlmostEqual(chalilulz._throttle("groq"), 3, delta=0.1)
+
+    def test_duration(self):
+        self.assertAlmostEqual(chalilulz._duration("2m59.56s"), 179.56)
+        self.assertAlmostEqual(chalilulz._duration("20ms"), 0.02)
+        self.assertEqual(chalilulz._duration("7"), 7)
+        self.assertEqual(chalilulz._duration("1h"), 3600)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,153 @@
+"""
+test_replay — Recording provider streams and replaying them offline
+"""
+
+import unittest
+import sys
+import os
+import json
+import threading
+import urllib.error
+import urllib.request
+from io import BytesIO
+from pathlib import Path
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import chalilulz
+from tests import DataDirCase
+
+
+SSE = [
+    b"data: " + json.dumps({"choices": [{"delta": {"content": "Hello "}}]}).encode() + b"\n",
+    b"data: " + json.dumps({"choices": [{"delta": {"content": "offline"}}]}).encode() + b"\n",
+    b"data: " + json.dumps({"usage": {"prompt_tokens": 3, "completion_tokens": 2}}).encode() + b"\n",
+    b"data: [DONE]\n",
+]
+
+
+class FakeStream:
+    def __init__(self, lines):
+        self.lines = lines
+
+    def __iter__(self):
+        return iter(self.lines)
+
+    def close(self):
+        pass
+
+
+class TestRecordReplay(DataDirCase):
+    SAVE = ("PROVIDER", "ACTUAL_MODEL", "RECORD_DIR", "REPLAY_DIR", "GROQ_KEY", "NO_TOOLS_MODELS")
+
+    def setUp(self):
+        super().setUp()
+        self.dir = str(self.tmp / "rec")
+        os.mkdir(self.dir)
+        chalilulz.PROVIDER, chalilulz.ACTUAL_MODEL = "groq", "m"
+        chalilulz.NO_TOOLS_MODELS.discard("m")
+
+    def call(self):
+        with patch("sys.stdout"):
+            return chalilulz.call_groq([{"role": "user", "content": "hi"}], "sys")
+
+    def test_record_then_replay_without_network(self):
+        chalilulz.RECORD_DIR = self.dir
+        chalilulz.GROQ_KEY = "live-key"
+        with patch("chalilulz._OPENER.open", return_value=FakeStream(SSE)):
+            live, _ = self.call()
+        self.assertEqual(len(os.listdir(self.dir)), 1)
+
+        chalilulz.RECORD_DIR, chalilulz.REPLAY_DIR = None, self.dir
+        chalilulz.GROQ_KEY = "other-key"  # keys are not part of the request hash
+        with patch("chalilulz._OPENER.open", side_effect=AssertionError("network")):
+            replayed, _ = self.call()
+        self.assertEqual(
+            replayed["choices"][0]["message"]["content"], "Hello offline"
+        )
+        self.assertEqual(replayed["usage"], live["usage"])
+
+    def test_replay_in_another_checkout(self):
+        a, b = self.tmp / "a", self.tmp / "b"
+        for d in (a, b):
+            (d / ".git").mkdir(parents=True)  # keep skill discovery inside the checkout
+        sk = a / ".skills" / "only-here"
+        sk.mkdir(parents=True)
+        (sk / "SKILL.md").write_text("---\nname: only-here\ndescription: local skill\n---\n")
+
+        def turn(cwd, **kw):
+            ag = chalilulz.Agent("groq:m", cwd=str(cwd), groq_key="k", fallback=[],
+                                 ctx_override={"*": 32768}, **kw)
+            self.assertEqual(ag.turn("hi"), "ok")
+            return ag
+
+        with patch("chalilulz._OPENER.open", return_value=FakeStream(SSE)):
+            self.assertIn("only-here", turn(a, record_dir=self.dir).system)
+        with patch("chalilulz._OPENER.open", side_effect=AssertionError("network")):
+            self.assertEqual(turn(b, replay_dir=self.dir).reply, "Hello offline")
+
+    def test_same_request_recorded_concurrently(self):
+        path = Path(self.dir) / "k.jsonl"
+        errors = []
+
+        def save(w):
+            try:
+                for i in range(20):
+                    chalilulz._save_recording(path, {"status": 200, "w": w}, [{"t": i, "d": "x"}])
+            except Exception as e:
+                errors.append(e)
+
+        ts = [threading.Thread(target=save, args=(w,)) for w in range(8)]
+        for t in ts:
+            t.start()
+        for t in ts:
+            t.join(10)
+        self.assertEqual(errors, [])
+        self.assertEqual(os.listdir(self.dir), ["k.jsonl"])
+        self.assertEqual(len(path.read_text().splitlines()), 2)
+
+    def test_replay_miss(self):
+        chalilulz.REPLAY_DIR = self.dir
+        with self.assertRaises(RuntimeError) as cm:
+            self.call()
+        self.assertIn("no recording", str(cm.exception))
+
+    def test_recorded_400_replays_tool_fallback(self):
+        chalilulz.RECORD_DIR = self.dir
+        calls = []
+
+        def live(req, timeout=None):
+            calls.append(req)
+            if len(calls) == 1:
+                raise urllib.error.HTTPError("u", 400, "bad", {}, BytesIO(b"no tools"))
+            return FakeStream(SSE)
+
+        with patch("chalilulz._OPENER.open", side_effect=live), patch("builtins.print"):
+            self.call()
+        self.assertEqual(len(os.listdir(self.dir)), 2)
+
+        chalilulz.NO_TOOLS_MODELS.discard("m")
+        chalilulz.RECORD_DIR, chalilulz.REPLAY_DIR = None, self.dir
+        with patch("builtins.print"):
+            resp, use_tools = self.call()
+        self.assertFalse(use_tools)
+        self.assertEqual(resp["choices"][0]["message"]["content"], "Hello offline")
+
+    def test_key_ignores_host(self):
+        a = urllib.request.Request("http://a/v1/chat/completions", data=b'{"b": 1, "a": 2}')
+        b = urllib.request.Request("http://b/v1/chat/completions", data=b'{"a": 2, "b": 1}')
+        self.assertEqual(chalilulz._req_key(a), chalilulz._req_key(b))
+
+    def test_key_ignores_ollama_knobs(self):
+        def key(body):
+            return chalilulz._req_key(urllib.request.Request("http://h/api/chat", data=json.dumps(body).encode()))
+
+        base = {"model": "m", "messages": []}
+        self.assertEqual(key(base), key(dict(base, keep_alive="30m", options={"num_ctx": 8192})))
+        self.assertNotEqual(key(dict(base, options={"num_ctx": 8192})),
+                            key(dict(base, options={"num_ctx": 8192, "temperature": 0})))
+
+
+if __name__ == "__main__":
+    unittest.main()
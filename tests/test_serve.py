@@ -0,0 +1,293 @@
+"""
+test_serve — Session daemon over a local socket, attach client and the keep-alive pool
+"""
+
+import unittest
+import sys
+import os
+import io
+import json
+import threading
+import time
+import socket
+import urllib.request
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import chalilulz
+from chalilulz import serve
+from chalilulz.mock import MockLLM
+from tests import DataDirCase
+
+
+class ServeCase(DataDirCase):
+    def setUp(self):
+        super().setUp()
+        self.llm = MockLLM([{"content": "hello from the daemon"}], loop=True)
+        self.llm.start()
+        self.addCleanup(self.llm.stop)
+        self.addr = os.path.join(self.tmp, "d.sock")
+        up = threading.Event()
+        self.srv = None
+
+        def ready(srv):
+            self.srv = srv
+            up.set()
+
+        self.th = threading.Thread(target=serve.serve, args=(self.addr, ready), daemon=True)
+        self.th.start()
+        self.assertTrue(up.wait(5))
+        self.settings = {
+            "groq_host": self.llm.url + "/v1",
+            "groq_key": "k",
+            "fallback": [],
+            "ctx_override": {"*": 32768},
+        }
+
+    def tearDown(self):
+        self.srv.shutdown()
+        self.th.join(5)
+
+    def client(self):
+        cl = serve.Client(self.addr, timeout=10)
+        self.addCleanup(cl.close)
+        return cl
+
+    def session(self, cl, **kw):
+        return cl.call("new", model="groq:mock", cwd=str(self.tmp), settings=self.settings, **kw)["id"]
+
+
+class TestDaemon(ServeCase):
+    def test_turn_streams_events(self):
+        cl = self.client()
+        self.assertEqual(cl.call("ping")["type"], "pong")
+        sid = self.session(cl)
+        evs = list(cl.turn(sid, "hi"))
+        toks = "".join(e["text"] for e in evs if e["type"] == "token")
+        self.assertEqual(toks, "hello from the daemon")
+        self.assertEqual(evs[-1]["type"], "done")
+        self.assertEqual(evs[-1]["status"], "ok")
+        self.assertEqual(evs[-1]["text"], "hello from the daemon")
+        self.assertIn("round", [e["type"] for e in evs])
+        self.assertEqual(cl.call("stats", session=sid)["msgs"], 2)
+
+    def test_sessions_are_isolated_and_concurrent(self):
+        res = {}
+
+        def run(n):
+            cl = serve.Client(self.addr, timeout=10)
+            try:
+                sid = self.session(cl)
+                for _ in range(n):
+                    res.setdefault(sid, []).append(list(cl.turn(sid, "hi"))[-1]["status"])
+            finally:
+                cl.close()
+
+        ths = [threading.Thread(target=run, args=(n,)) for n in (1, 2, 3)]
+        for t in ths:
+            t.start()
+        for t in ths:
+            t.join(10)
+        self.assertEqual(sorted(len(v) for v in res.values()), [1, 2, 3])
+        self.assertTrue(all(s == "ok" for v in res.values() for s in v))
+        rows = self.client().call("list")["sessions"]
+        self.assertEqual(sorted(r["msgs"] for r in rows), [2, 4, 6])
+
+    def test_tools_run_in_session_cwd(self):
+        (self.tmp / "marker.txt").write_text("x")
+        self.llm.script = [{"tool_calls": [{"name": "ls", "args": {}}]}, {"content": "done"}]
+        self.llm.loop = False
+        cl = self.client()
+        sid = self.session(cl, yes=True)
+        evs = list(cl.turn(sid, "list files"))
+        res = [e for e in evs if e["type"] == "tool_result"]
+        self.assertEqual(len(res), 1)
+        self.assertIn("marker.txt", res[0]["result"])
+        self.assertEqual(evs[-1]["status"], "ok")
+
+    def test_request_errors(self):
+        cl = self.client()
+        with self.assertRaisesRegex(RuntimeError, "no session 99"):
+            cl.call("clear", session="99")
+        with self.assertRaisesRegex(RuntimeError, "unknown op"):
+            cl.call("bogus")
+        with self.assertRaisesRegex(RuntimeError, "not accepted from clients: nope"):
+            cl.call("new", settings={"nope": 1})
+        with self.assertRaisesRegex(RuntimeError, "record_dir"):
+            cl.call("new", settings={"record_dir": str(self.tmp)})
+        sid = self.session(cl)
+        self.assertEqual(cl.call("model", session=sid, model="groq:other")["model"], "groq:other")
+        self.assertEqual(cl.call("close", session=sid)["type"], "ok")
+        self.assertEqual(cl.call("list")["sessions"], [])
+
+    def test_skills_shared_between_sessions(self):
+        cl = self.client()
+        with patch("chalilulz._skill_dirs", return_value=[]) as scan:
+            self.session(cl)
+            self.session(cl)
+        self.assertEqual(scan.call_count, 1)
+
+    def test_attach_print_json(self):
+        out = io.StringIO()
+        # attached sessions take the daemon's own settings
+        daemon = {k.upper(): v for k, v in self.settings.items()}
+        with patch.multiple("chalilulz", **daemon), patch("sys.stdout", out):
+            rc = serve.attach(self.addr, "groq:mock", prompt="hi", as_json=True)
+        self.assertEqual(rc, 0)
+        evs = [json.loads(x) for x in out.getvalue().splitlines()]
+        self.assertEqual(evs[-1]["type"], "done")
+        self.assertEqual(evs[-1]["text"], "hello from the daemon")
+
+    def test_ctrl_c_cancels_turn(self):
+        self.llm.script = [{"content": " ".join(["word"] * 50), "tps": 5}, {"content": "next"}]
+        self.llm.loop = False
+        cl = self.client()
+        sid = self.session(cl)
+        seen = []
+
+        def show(ev):
+            seen.append(ev)
+            if len(seen) == 1:
+                raise KeyboardInterrupt
+
+        t0 = time.perf_counter()
+        self.assertEqual(serve._stream(cl, sid, "hi", show), "interrupted")
+        self.assertLess(time.perf_counter() - t0, 5)  # not the 10s the reply would take
+        self.assertTrue(seen[-1]["text"].startswith("word"))
+        self.assertEqual(cl.call("stats", session=sid)["msgs"], 2)
+        # the session is free again and the cancel does not carry over
+        self.assertEqual(list(cl.turn(sid, "again"))[-1]["status"], "ok")
+
+    def test_cancel_while_waiting_for_first_token(self):
+        self.llm.script = [{"content": "late", "ttft": 10}]
+        cl = self.client()
+        sid = self.session(cl)
+        threading.Timer(0.3, cl.cancel, (sid,)).start()
+        t0 = time.perf_counter()
+        evs = list(cl.turn(sid, "hi"))
+        self.assertLess(time.perf_counter() - t0, 5)
+        self.assertEqual(evs[-1]["status"], "interrupted")
+
+    def test_attach_without_daemon(self):
+        err = io.StringIO()
+        with patch("sys.stderr", err):
+            rc = serve.attach(os.path.join(self.tmp, "none.sock"), "groq:mock", prompt="hi")
+        self.assertEqual(rc, 1)
+        self.assertIn("no daemon", err.getvalue())
+
+
+class TestTCP(DataDirCase):
+    def setUp(self):
+        super().setUp()
+        s = socket.socket()
+        s.bind(("127.0.0.1", 0))
+        self.addr = "127.0.0.1:%d" % s.getsockname()[1]
+        s.close()
+        up = threading.Event()
+
+        def ready(srv):
+            self.srv = srv
+            up.set()
+
+        self.th = threading.Thread(target=serve.serve, args=(self.addr, ready), daemon=True)
+        self.th.start()
+        self.assertTrue(up.wait(5))
+
+    def tearDown(self):
+        self.srv.shutdown()
+        self.th.join(5)
+
+    def test_token_required(self):
+        self.assertEqual(os.stat(serve.token_path()).st_mode & 0o777, 0o600)
+        raw = serve.connect(self.addr, timeout=5)
+        self.addCleanup(raw.close)
+        raw.sendall(b'{"op": "new", "yes": true}\n')
+        r = json.loads(raw.makefile("rb").readline())
+        self.assertEqual((r["type"], r["message"]), ("error", "not authorized"))
+        cl = serve.Client(self.addr, timeout=5)
+        self.addCleanup(cl.close)
+        self.assertEqual(cl.call("ping")["type"], "pong")
+        cl.call("shutdown")
+        self.th.join(5)
+        self.assertFalse(serve.token_path().exists())
+
+    def test_no_token_file(self):
+        serve.token_path().unlink()
+        with self.assertRaisesRegex(ConnectionRefusedError, "no daemon token"):
+            serve.Client(self.addr, timeout=5)
+        serve.token_path().write_text("x")
+        with self.assertRaisesRegex(RuntimeError, "not authorized"):
+            serve.Client(self.addr, timeout=5)
+
+
+class TestParseAddr(unittest.TestCase):
+    def test_forms(self):
+        self.assertEqual(serve.parse_addr("/tmp/x.sock"), "/tmp/x.sock")
+        self.assertEqual(serve.parse_addr("127.0.0.1:9000"), ("127.0.0.1", 9000))
+        self.assertEqual(serve.parse_addr(":9000"), ("127.0.0.1", 9000))
+        self.assertEqual(serve.parse_addr("9000"), ("127.0.0.1", 9000))
+
+
+class TestPool(unittest.TestCase):
+    def setUp(self):
+        self.llm = MockLLM([{"content": "a b c d e f"}], loop=True)
+        self.llm.start()
+        chalilulz._POOL.clear()
+        self.connects = 0
+        orig = chalilulz._HTTPConn.connect
+
+        def counted(conn):
+            self.connects += 1
+            return orig(conn)
+
+        self._p = patch.object(chalilulz._HTTPConn, "connect", counted)
+        self._p.start()
+
+    def tearDown(self):
+        self._p.stop()
+        self.llm.stop()
+        chalilulz._POOL.clear()
+
+    def post(self):
+        body = json.dumps({"model": "mock", "messages": [], "stream": True}).encode()
+        req = urllib.request.Request(self.llm.url + "/v1/chat/completions", data=body)
+        return chalilulz._open(req)
+
+    def test_global_opener_untouched(self):
+        self.assertIsNot(urllib.request._opener, chalilulz._OPENER)
+        handlers = [type(h) for h in urllib.request.build_opener().handlers]
+        self.assertNotIn(chalilulz._HTTPHandler, handlers)
+
+    def test_connection_reused(self):
+        for _ in range(3):
+            r = self.post()
+            r.read()
+            r.close()
+        self.assertEqual(self.connects, 1)
+        self.assertEqual(len(self.llm.requests), 3)
+
+    def test_abandoned_stream_not_reused(self):
+        r = self.post()
+        r.readline()
+        r.close()
+        self.assertEqual(sum(len(v) for v in chalilulz._POOL.values()), 0)
+        r = self.post()
+        r.read()
+        r.close()
+        self.assertEqual(self.connects, 2)
+
+    def test_server_closed_idle_connection_retried(self):
+        r = self.post()
+        r.read()
+        r.close()
+        for idle in chalilulz._POOL.values():
+            for _, h in idle:
+                h.sock.close()  # dropped while idle, as servers do
+        r = self.post()
+        self.assertIn(b"data:", r.read())
+        self.assertEqual(self.connects, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
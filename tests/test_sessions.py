@@ -0,0 +1,299 @@
+"""
+test_sessions — Append-only session logs, named save pointers and loading
+"""
+
+import unittest
+import sys
+import os
+import json
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import chalilulz
+from chalilulz import sessions
+from chalilulz.mock import MockLLM
+from tests import DataDirCase
+
+
+class SessionCase(DataDirCase):
+    def setUp(self):
+        super().setUp()
+        self.llm = MockLLM([{"content": "fine"}], loop=True)
+        self.llm.start()
+        self.addCleanup(self.llm.stop)
+
+    def agent(self, **kw):
+        return chalilulz.Agent("groq:mock", groq_host=self.llm.url + "/v1", groq_key="k",
+                               fallback=[], ctx_override={"*": 32768}, auto_approve=True, **kw)
+
+    def lines(self, ag):
+        return [json.loads(x) for x in ag.log.path.read_text().splitlines()]
+
+
+class TestSessionLog(SessionCase):
+    def test_one_line_per_message(self):
+        self.llm.script = [{"tool_calls": [{"name": "ls", "args": {}}]}, {"content": "done"}, {"content": "again"}]
+        self.llm.loop = False
+        ag = self.agent(log=True)
+        ag.turn("list")
+        self.assertEqual([m["role"] for m in self.lines(ag)], ["user", "assistant", "tool", "assistant"])
+        ag.turn("more")
+        self.assertEqual(self.lines(ag), ag.msgs)
+
+    def test_written_each_round(self):
+        self.llm.script = [{"tool_calls": [{"name": "ls", "args": {}}]}, {"error": 400}, {"error": 400}]
+        self.llm.loop = False
+        ag = self.agent(log=True)
+        self.assertEqual(ag.turn("list"), "error")
+        # the first round survives the failed second one, in the log and in memory
+        self.assertEqual([m["role"] for m in self.lines(ag)], ["user", "assistant", "tool"])
+        self.assertEqual(self.lines(ag), ag.msgs)
+
+    def test_failed_turn_not_logged(self):
+        self.llm.script = [{"error": 400}, {"error": 400}]  # the retry without tools fails too
+        self.llm.loop = False
+        ag = self.agent(log=True)
+        self.assertEqual(ag.turn("hi"), "error")
+        self.assertFalse(ag.log.path.exists())
+
+    def test_off_by_default(self):
+        ag = self.agent()
+        ag.turn("hi")
+        self.assertIsNone(ag.log)
+        self.assertFalse((self.data / "sessions").exists())
+
+    def test_torn_line_skipped(self):
+        ag = self.agent(log=True)
+        ag.turn("hi")
+        with open(ag.log.path, "a") as f:
+            f.write('{"role": "us')
+        self.assertEqual(chalilulz.read_log(ag.log.path), ag.msgs)
+
+
+class TestSaveLoad(SessionCase):
+    def test_save_is_a_pointer(self):
+        ag = self.agent(log=True)
+        ag.turn("one")
+        ag.save("s")
+        ag.turn("two")
+        data = json.loads((chalilulz._sessions_dir() / "s.json").read_text())
+        self.assertEqual(data["log"], ag.log.path.name)
+        b = self.agent(log=True)
+        self.assertEqual(b.load("s"), 2)  # as it was when saved
+        self.assertEqual(b.msgs[0]["content"], "one")
+        self.assertEqual(b.load(ag.session), 4)  # a session id loads its whole log
+
+    def test_loaded_session_continues_in_new_log(self):
+        ag = self.agent(log=True)
+        ag.turn("one")
+        ag.save("s")
+        b = self.agent(log=True)
+        b.load("s")
+        self.assertNotEqual(b.log.path, ag.log.path)
+        b.turn("two")
+        self.assertEqual([m["content"] for m in b.msgs], ["one", "fine", "two", "fine"])
+        self.assertEqual(len(self.lines(b)), 3)  # a reference back, then only the new turn
+        b.save("s2")
+        self.assertEqual(chalilulz.load_session("s2")[0], b.msgs)
+
+    def test_save_without_log(self):
+        ag = self.agent()
+        ag.turn("one")
+        ag.save("s")
+        self.assertEqual(chalilulz.load_session("s")[0], ag.msgs)
+
+    def test_save_before_anything_logged(self):
+        ag = self.agent(log=True)
+        ag.save("empty")
+        self.assertTrue(ag.log.path.exists())
+        self.assertEqual(chalilulz.load_session("empty"), ([], {"log": ag.log.path.name, "bytes": 0}))
+
+    def test_legacy_json(self):
+        d = chalilulz._sessions_dir()
+        d.mkdir(parents=True)
+        old = [{"role": "user", "content": "hi"}, {"role": "assistant", "content": "yo"}]
+        (d / "old.json").write_text(json.dumps(old))
+        ag = self.agent(log=True)
+        self.assertEqual(ag.load("old"), 2)
+        self.assertEqual(self.lines(ag), old)
+        with self.assertRaises(FileNotFoundError):
+            ag.load("missing")
+
+
+class TestLazyLoad(SessionCase):
+    def setUp(self):
+        super().setUp()
+        ag = self.agent(log=True)
+        for i in range(30):
+            ag.log.append([{"role": "user", "content": "question %d" % i},
+                           {"role": "assistant", "content": "reply %d " % i + "z" * 200}])
+        ag.save("long")
+        self.log = ag.log.path
+
+    def small(self):
+        # room for ~600 tokens of history next to the system prompt
+        ag = self.agent(log=True)
+        ag.budget = dict(ag.budget, history=len(ag.system) // 4 + 600)
+        return ag
+
+    def test_tail_and_pinned_first_message(self):
+        ag = self.small()
+        with patch("chalilulz._unpack", wraps=chalilulz._unpack) as up:
+            n = ag.load("long")
+        self.assertLess(n, 20)
+        self.assertLess(up.call_count, 3 * n)  # read about what was loaded, not all 60
+        self.assertEqual(ag.msgs[0]["content"], "question 0")
+        self.assertEqual(ag.msgs[-1]["content"], "reply 29 " + "z" * 200)
+        self.assertEqual(ag.older, 60 - n)
+        got = ag.more(10)
+        self.assertEqual(got, 10)
+        self.assertEqual(ag.older, 50 - n)
+        self.assertEqual(ag.msgs[0]["content"], "question 0")
+        full = chalilulz.load_session("long")[0]
+        self.assertEqual(ag.msgs[1:], full[-(len(ag.msgs) - 1):])
+        while ag.more(50):
+            pass
+        self.assertEqual(ag.msgs, full)
+
+    def test_save_after_lazy_load_keeps_history(self):
+        ag = self.agent()  # not logging until it has to
+        ag.budget = dict(ag.budget, history=len(ag.system) // 4 + 600)
+        ag.load("long")
+        self.assertTrue(ag.older)
+        ag.save("again")
+        self.assertEqual(chalilulz.load_session("again")[0], chalilulz.load_session("long")[0])
+
+    def test_tool_results_keep_their_call(self):
+        self.llm.script = [{"tool_calls": [{"name": "ls", "args": {}}]}] * 6 + [{"content": "ok"}]
+        ag = self.agent(log=True)
+        ag.turn("list a lot")
+        ag.save("tools")
+        b = self.small()
+        b.budget = dict(b.budget, history=len(b.system) // 4 + 40)
+        b.load("tools")
+        self.assertEqual(b.msgs[0]["content"], "list a lot")
+        self.assertNotEqual(b.msgs[1]["role"], "tool")
+
+    def test_index_rebuilt_or_caught_up(self):
+        idx = self.log.with_suffix(".idx")
+        data = idx.read_bytes()
+        idx.write_bytes(data[:-16])  # a crash between the log write and the index write
+        ag = self.small()
+        ag.load("long")
+        self.assertEqual(ag.older + len(ag.msgs), 60)
+        idx.unlink()  # a log from before the index
+        b = self.small()
+        b.load("long")
+        self.assertEqual(idx.read_bytes(), data)
+        self.assertEqual(b.msgs, ag.msgs)
+
+
+class TestBlobs(SessionCase):
+    def test_big_fields_stored_once(self):
+        big = "x" * 10000 + "\n"
+        (self.tmp / "big.txt").write_text(big)
+        self.llm.script = [
+            {"tool_calls": [{"name": "read", "args": {"path": "big.txt"}}]},
+            {"tool_calls": [{"name": "read", "args": {"path": "big.txt"}}]},
+            {"content": "read it twice"},
+        ]
+        self.llm.loop = False
+        ag = self.agent(log=True, cwd=self.tmp)
+        ag.turn("read big.txt")
+        tools = [m for m in self.lines(ag) if m["role"] == "tool"]
+        self.assertEqual(len(tools), 2)
+        self.assertNotIn("content", tools[0])
+        self.assertEqual(tools[0]["_blobs"], tools[1]["_blobs"])
+        self.assertEqual(len(chalilulz._blobs()), 1)
+        self.assertLess(ag.log.size, 2000)
+        self.assertEqual(chalilulz.read_log(ag.log.path), ag.msgs)
+        st = chalilulz.blob_stats()
+        self.assertEqual(st["blobs"], 1)
+        self.assertGreater(st["saved"], 10000)  # two references, one small blob
+
+    def test_gc(self):
+        ag = self.agent(log=True)
+        ag.turn("y" * 5000)
+        orphan, _ = chalilulz._blob_put("z" * 5000)
+        self.assertEqual(chalilulz.blob_gc(), (0, 0))  # too recent to be sure
+        n, freed = chalilulz.blob_gc(grace=-1)
+        self.assertEqual(n, 1)
+        self.assertGreater(freed, 0)
+        self.assertEqual([p.stem for p in chalilulz._blobs()], [chalilulz._pack(ag.msgs[0])["_blobs"]["content"][0]])
+        self.assertEqual(chalilulz.read_log(ag.log.path)[0]["content"], "y" * 5000)
+
+    def test_zlib_fallback(self):
+        with patch.dict(sys.modules, {"lzma": None}):
+            h, n = chalilulz._blob_put("w" * 3000)
+        self.assertEqual((n, chalilulz._blob_get(h)), (3000, "w" * 3000))
+
+
+class TestSearch(SessionCase):
+    def setUp(self):
+        super().setUp()
+        self.llm.script = [
+            {"content": "the segfault came from a null parser"},
+            {"tool_calls": [{"name": "grep", "args": {"pattern": "x"}}]},
+            {"content": "nothing there"},
+        ]
+        self.llm.loop = False
+        self.a = self.agent(log=True)
+        self.a.turn("why does the parser crash")
+        self.a.save("parser-bug")
+        self.b = self.agent(log=True)
+        self.b.turn("look for flaky tests")
+
+    def test_ranked_hits_with_snippets(self):
+        hits = sessions.search("parser")
+        self.assertEqual(len(hits), 1)
+        h = hits[0]
+        self.assertEqual((h["session"], h["names"]), (self.a.session, ["parser-bug"]))
+        self.assertIn("[parser]", h["snippet"])
+        self.assertEqual(sessions.search("segfault parser")[0]["role"], "assistant")
+        self.assertEqual(sessions.search("parser zebra"), [])
+        self.assertEqual(sessions.search('"quoted (syntax'), [])
+
+    def test_tool_names_indexed(self):
+        self.assertEqual([h["session"] for h in sessions.search("grep")], [self.b.session])
+
+    def test_incremental(self):
+        self.assertEqual(sessions.index(), 3)  # b's turn; a was indexed by save(); tool results are not
+        self.assertEqual(sessions.index(), 0)
+        self.llm.script = [{"content": "done"}]
+        self.b.turn("now the tokenizer")
+        self.assertEqual(sessions.index(), 2)
+        self.assertEqual(sessions.search("tokenizer")[0]["session"], self.b.session)
+
+    def test_without_fts5(self):
+        import sqlite3
+
+        real = sqlite3.connect
+
+        class NoFTS:
+            def __init__(self, *a, **kw):
+                self.con = real(*a, **kw)
+
+            def execute(self, sql, *a):
+                if "fts5" in sql:
+                    raise sqlite3.OperationalError("no such module: fts5")
+                return self.con.execute(sql, *a)
+
+            def __getattr__(self, k):
+                return getattr(self.con, k)
+
+            def __enter__(self):
+                return self.con.__enter__()
+
+            def __exit__(self, *a):
+                return self.con.__exit__(*a)
+
+        (chalilulz._sessions_dir() / "index.db").unlink()
+        with patch("sqlite3.connect", NoFTS):
+            hits = sessions.search("PARSER crash")
+        self.assertEqual(hits[0]["session"], self.a.session)
+        self.assertIn("[parser]", hits[0]["snippet"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -5,13 +5,15 @@ test_skills — Skill loading, parsing, and prompt generation
 import unittest
 import sys
 import os
-import tempfile
 import shutil
+import threading
 from pathlib import Path
+from unittest.mock import patch
 
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from chalilulz import _parse_frontmatter, _skill_dirs, load_skills, skills_prompt
+from tests import DataDirCase
 
 
 class TestParseFrontmatter(unittest.TestCase):
@@ -75,15 +77,12 @@ class TestSkillDirs(unittest.TestCase):
             self.assertTrue(Path(d).is_dir())
 
 
-class TestLoadSkills(unittest.TestCase):
+class TestLoadSkills(DataDirCase):
     def setUp(self):
-        self.test_dir = tempfile.mkdtemp()
-        self.skills_dir = Path(self.test_dir) / ".agents" / "skills"
+        super().setUp()
+        self.skills_dir = self.tmp / ".agents" / "skills"
         self.skills_dir.mkdir(parents=True)
 
-    def tearDown(self):
-        shutil.rmtree(self.test_dir)
-
     def test_load_empty_skills_dir(self):
         skills = load_skills()
         # Should not crash, returns list
@@ -254,5 +253,304 @@ class TestSkillsPrompt(unittest.TestCase):
         self.assertLessEqual(len(desc_part), 120)
 
 
+class TestSkillIndex(DataDirCase):
+    """discovery runs once; directory mtimes decide when to rescan"""
+
+    def setUp(self):
+        import chalilulz
+
+        super().setUp()
+        self.c = chalilulz
+        (self.tmp / ".git").mkdir()  # stop the walk up here
+        self.scans = 0
+        real = chalilulz._skill_dirs
+
+        def counted():
+            self.scans += 1
+            return real()
+
+        d = patch("chalilulz._skill_dirs", counted)
+        d.start()
+        self.addCleanup(d.stop)
+        self.ag = chalilulz.Agent(cwd=str(self.tmp))
+
+    def add(self, root, name, body="do it"):
+        d = self.tmp / root / name
+        d.mkdir(parents=True)
+        (d / "SKILL.md").write_text(f"---\nname: {name}\ndescription: {name} skill\n---\n{body}")
+        # bump mtimes past the filesystem's timestamp granularity
+        for p in (d.parent, d.parent.parent):
+            st = os.stat(p)
+            os.utime(p, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+
+    def names(self):
+        with self.ag.active():
+            return {s["name"] for s in load_skills()}
+
+    def test_discovery_cached(self):
+        self.add(".skills", "alpha")
+        self.assertIn("alpha", self.names())
+        self.assertIn("alpha", self.names())
+        with self.ag.active():
+            for _ in range(5):
+                self.assertIn("do it", self.c._sk({"name": "alpha"}))
+        self.assertEqual(self.scans, 1)
+
+    def test_new_skill_and_new_root_invalidate(self):
+        self.add(".skills", "alpha")
+        self.assertEqual(self.names() & {"alpha", "beta", "gamma"}, {"alpha"})
+        self.add(".skills", "beta")
+        self.assertIn("beta", self.names())
+        self.add(".agents/skills", "gamma")
+        self.assertIn("gamma", self.names())
+        self.assertEqual(self.scans, 3)
+
+    def test_skill_md_written_into_existing_dir(self):
+        self.add(".skills", "alpha")
+        d = self.tmp / ".skills" / "late"
+        d.mkdir()
+        self.assertNotIn("late", self.names())
+        (d / "SKILL.md").write_text("---\nname: late\ndescription: late skill\n---\n")
+        st = os.stat(d)  # only the skill dir itself changes
+        os.utime(d, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+        self.assertIn("late", self.names())
+
+    def test_load_skill_rescans_on_miss(self):
+        self.add(".skills", "alpha")
+        self.names()
+        self.add(".skills", "late", body="late body")
+        with self.ag.active():
+            self.assertIn("late body", self.c._sk({"name": "late"}))
+            self.assertIn("not found", self.c._sk({"name": "nope"}))
+        self.assertEqual(self.scans, 2)  # nothing changed for the unknown name: no rescan
+
+
+class TestSkillMeta(DataDirCase):
+    """frontmatter-only reads and the persisted skill index"""
+
+    def setUp(self):
+        import chalilulz
+
+        super().setUp()
+        self.c = chalilulz
+        self.root = self.tmp / "skills"
+        self.sd = self.root / "alpha"
+        (self.sd / "scripts" / "sub").mkdir(parents=True)
+        (self.sd / "scripts" / "run.sh").write_text("echo")
+        self.md = self.sd / "SKILL.md"
+        self.md.write_bytes(b"---\nname: alpha\ndescription: first\n---\nbody\n" + b"\xff\xfe" * 1000)
+        d = patch("chalilulz._skill_dirs", return_value=[self.root])
+        d.start()
+        self.addCleanup(d.stop)
+        chalilulz._JSON.clear()
+
+    def test_reads_only_frontmatter(self):
+        # the body is not valid utf-8, so reading past the closing --- would fail
+        fm = self.c._read_frontmatter(self.md)
+        self.assertEqual((fm["name"], fm["description"]), ("alpha", "first"))
+        self.assertEqual(self.c._read_frontmatter(self.sd / "scripts" / "run.sh"), {})
+
+    def test_unchanged_skills_not_read(self):
+        self.assertEqual([s["name"] for s in load_skills()], ["alpha"])
+        self.assertTrue(self.c._skill_meta_path().exists())
+        self.c._JSON.clear()  # as a fresh process would start
+        with patch("chalilulz._read_frontmatter") as rf:
+            self.assertEqual(load_skills()[0]["desc"], "first")
+        rf.assert_not_called()
+        self.md.write_text("---\nname: alpha\ndescription: changed desc\n---\n")
+        self.assertEqual(load_skills()[0]["desc"], "changed desc")
+
+    def test_concurrent_saves_merge(self):
+        paths = []
+        for i in range(40):
+            paths.append(str(self.tmp / f"s{i}.md"))
+            open(paths[-1], "w").close()
+
+        def save(chunk):
+            for p in chunk:
+                self.c._save_skill_meta({p: {"sig": [0, 0], "fm": {}}})
+
+        ts = [threading.Thread(target=save, args=(paths[w::8],)) for w in range(8)]
+        for t in ts:
+            t.start()
+        for t in ts:
+            t.join(10)
+        self.assertEqual(sorted(self.c._load_skill_meta()), sorted(paths))
+
+    def test_scripts_listing_cached(self):
+        files = self.c._skill_scripts(self.sd)
+        self.assertEqual(files, [str(self.sd / "scripts" / "run.sh")])
+        with patch("os.walk") as walk:
+            self.assertEqual(self.c._skill_scripts(self.sd), files)
+        walk.assert_not_called()
+        new = self.sd / "scripts" / "sub" / "x.py"
+        new.write_text("")
+        d = new.parent
+        st = os.stat(d)
+        os.utime(d, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+        self.assertIn(str(new), self.c._skill_scripts(self.sd))
+
+
+class TestSkillRanking(DataDirCase):
+    """only the skills relevant to the turn are listed; search_skills finds the rest"""
+
+    TOPICS = {
+        "pdf-tools": ("Extract text and tables from PDF files", "pdf pages ocr"),
+        "git-helper": ("Write commit messages and resolve merge conflicts", "git rebase branch"),
+        "docker-run": ("Build and run containers", "dockerfile image compose"),
+        "sql-tuning": ("Explain and speed up slow SQL queries", "index postgres query plan"),
+    }
+
+    def setUp(self):
+        import chalilulz
+
+        super().setUp()
+        self.c = chalilulz
+        self.root = self.tmp / "skills"
+        for name, (desc, body) in self.TOPICS.items():
+            (self.root / name).mkdir(parents=True)
+            (self.root / name / "SKILL.md").write_text(
+                f"---\nname: {name}\ndescription: {desc}\n---\n{body}\n"
+            )
+        for p in (patch("chalilulz._skill_dirs", return_value=[self.root]), patch("chalilulz.SKILLS_TOP_K", 2)):
+            p.start()
+            self.addCleanup(p.stop)
+        chalilulz._JSON.clear()
+
+    def test_bm25(self):
+        docs = [["git", "commit"], ["pdf", "text", "pdf"], ["sql", "query"]]
+        s = self.c.bm25(["pdf"], docs)
+        self.assertGreater(s[1], 0)
+        self.assertEqual((s[0], s[2]), (0, 0))
+        self.assertEqual(self.c.bm25(["x"], []), [])
+
+    def test_pick_skills(self):
+        skills = load_skills()
+        picked = [s["name"] for s in self.c.pick_skills(skills, "my postgres query is slow")]
+        self.assertEqual(picked, ["sql-tuning"])
+        self.assertIsNone(self.c.pick_skills(skills, "hello there"))
+        self.assertEqual(self.c.pick_skills(skills, "anything", k=10), skills)
+        # body keywords are kept in the skill index
+        e = self.c._load_skill_meta()[str(self.root / "pdf-tools" / "SKILL.md")]
+        self.assertIn("ocr", e["kw"])
+
+    def test_agent_prompt_per_turn(self):
+        seen = []
+
+        def fake(msgs, sysp, xml_sysp):
+            seen.append(sysp)
+            if len(seen) == 1:
+                msg = {"role": "assistant", "tool_calls": [
+                    {"id": "1", "type": "function", "function": {"name": "ls", "arguments": "{}"}}
+                ]}
+            else:
+                msg = {"role": "assistant", "content": "done"}
+            return {"choices": [{"message": msg}]}, True
+
+        ag = self.c.Agent("groq:x", cwd=str(self.tmp), fallback=[], auto_approve=True)
+        with patch("chalilulz.call_api", side_effect=fake):
+            ag.turn("rebase my git branch")
+        self.assertEqual(len(seen), 2)
+        self.assertEqual(seen[0], seen[1])  # stable across rounds
+        self.assertIn("git-helper", seen[0])
+        self.assertNotIn("docker-run", seen[0])
+        self.assertIn("3 more: use search_skills", seen[0])
+        first = ag.system
+        ag._select("thanks")  # matches nothing: the listing is kept
+        self.assertIs(ag.system, first)
+        ag._select("build a docker image")
+        self.assertIn("docker-run", ag.system)
+
+    def test_search_skills_tool(self):
+        out = self.c._ss({"query": "merge conflicts"})
+        self.assertTrue(out.startswith("git-helper: Write commit messages"))
+        self.assertIn("no skills match", self.c._ss({"query": "zebra"}))
+        self.assertIn("search_skills", self.c.TOOLS)
+
+
+class TestGlobalSync(DataDirCase):
+    """bundled skills are synced per package version, file by file"""
+
+    def setUp(self):
+        import chalilulz
+
+        super().setUp()
+        self.c = chalilulz
+        self.bundle = self.tmp / "bundle"
+        self.g = self.data / "skills"
+        self.put("alpha/SKILL.md", "---\nname: alpha\ndescription: a\n---\n")
+        self.put("alpha/scripts/run.sh", "echo 1")
+        self.put("beta/SKILL.md", "---\nname: beta\ndescription: b\n---\n")
+        os.chmod(self.bundle / "alpha/scripts/run.sh", 0o755)
+        b = patch("chalilulz._get_bundled_skills_dir", return_value=self.bundle)
+        b.start()
+        self.addCleanup(b.stop)
+
+    def put(self, rel, text):
+        (self.bundle / rel).parent.mkdir(parents=True, exist_ok=True)
+        (self.bundle / rel).write_text(text)
+
+    def sync(self, version):
+        with patch("chalilulz.__version__", version):
+            self.c._ensure_global_skills()
+
+    def test_install_and_fast_path(self):
+        self.sync("1")
+        self.assertEqual((self.g / "alpha/scripts/run.sh").read_text(), "echo 1")
+        self.assertTrue(os.access(self.g / "alpha/scripts/run.sh", os.X_OK))
+        self.assertTrue((self.g / ".synced-1").exists())
+        with patch("chalilulz._get_bundled_skills_dir") as b:
+            self.sync("1")
+        b.assert_not_called()
+
+    def test_upgrade_only_rewrites_changes(self):
+        self.sync("1")
+        keep = (self.g / "beta/SKILL.md").stat().st_mtime_ns
+        os.utime(self.g / "beta/SKILL.md", ns=(keep - 10**9, keep - 10**9))
+        self.put("alpha/scripts/run.sh", "echo 2")
+        (self.bundle / "alpha/scripts/new.sh").write_text("echo new")
+        self.sync("2")
+        self.assertEqual((self.g / "alpha/scripts/run.sh").read_text(), "echo 2")
+        self.assertTrue((self.g / "alpha/scripts/new.sh").exists())
+        self.assertEqual((self.g / "beta/SKILL.md").stat().st_mtime_ns, keep - 10**9)
+        self.assertEqual([p.name for p in self.g.glob(".synced-*")], [".synced-2"])
+
+    def test_user_edits_kept(self):
+        self.sync("1")
+        (self.g / "alpha/SKILL.md").write_text("---\nname: alpha\ndescription: mine\n---\n")
+        self.put("alpha/scripts/run.sh", "echo 2")
+        self.sync("2")
+        self.assertIn("mine", (self.g / "alpha/SKILL.md").read_text())
+        self.assertEqual((self.g / "alpha/scripts/run.sh").read_text(), "echo 1")
+        self.put("alpha/scripts/run.sh", "echo 3")
+        self.sync("3")  # still the user's
+        self.assertEqual((self.g / "alpha/scripts/run.sh").read_text(), "echo 1")
+
+    def test_removed_skill_dropped(self):
+        self.sync("1")
+        shutil.rmtree(self.bundle / "beta")
+        self.sync("2")
+        self.assertFalse((self.g / "beta").exists())
+        self.assertTrue((self.g / "alpha/SKILL.md").exists())
+
+    def test_legacy_install_keeps_edits(self):
+        # an install from before the manifest: only the .installed marker
+        (self.g / "alpha/scripts").mkdir(parents=True)
+        (self.g / "alpha/SKILL.md").write_text("---\nname: alpha\ndescription: mine\n---\n")
+        (self.g / "alpha/scripts/run.sh").write_text("echo 1")
+        (self.g / ".installed").touch()
+        self.sync("2")
+        self.assertIn("mine", (self.g / "alpha/SKILL.md").read_text())
+        self.assertTrue((self.g / "beta/SKILL.md").exists())  # missing skills are installed
+        self.assertFalse((self.g / ".installed").exists())
+        self.put("alpha/scripts/run.sh", "echo 3")
+        self.sync("3")  # still the user's
+        self.assertIn("mine", (self.g / "alpha/SKILL.md").read_text())
+        self.assertEqual((self.g / "alpha/scripts/run.sh").read_text(), "echo 1")
+        shutil.rmtree(self.g / "alpha")
+        self.sync("4")  # deleted: the bundled one comes back
+        self.assertEqual((self.g / "alpha/scripts/run.sh").read_text(), "echo 3")
+
+
 if __name__ == "__main__":
     unittest.main()
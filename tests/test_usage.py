@@ -0,0 +1,141 @@
+"""
+test_usage — Per-request usage ledger, cost from the price table and rollups
+"""
+
+import unittest
+import sys
+import os
+import io
+import json
+import time
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import chalilulz
+from chalilulz import usage
+from chalilulz.mock import MockLLM
+from tests import DataDirCase
+
+
+class TestLedger(DataDirCase):
+    def setUp(self):
+        super().setUp()
+        self.llm = MockLLM([{"content": "one two three"}, {"error": 400}, {"error": 400}])
+        self.llm.start()
+        self.addCleanup(self.llm.stop)
+
+    def agent(self):
+        return chalilulz.Agent("groq:mock", groq_host=self.llm.url + "/v1", groq_key="k",
+                               fallback=[], ctx_override={"*": 32768})
+
+    def test_rows_per_request(self):
+        ag = self.agent()
+        with patch.dict(chalilulz.PRICES, {"groq:mock": (1.0, 2.0)}):
+            self.assertEqual(ag.turn("hi"), "ok")
+            self.assertEqual(ag.turn("again"), "error")
+        rows = usage.load()
+        self.assertEqual(len(rows), 2)
+        ok, bad = rows
+        self.assertEqual((ok["provider"], ok["model"], ok["session"]), ("groq", "mock", ag.session))
+        self.assertEqual(ok["completion_tokens"], 3)
+        self.assertGreater(ok["prompt_tokens"], 0)
+        self.assertAlmostEqual(ok["cost"], (ok["prompt_tokens"] * 1 + 3 * 2) / 1e6)
+        self.assertIsNotNone(ok["ttft"])
+        self.assertNotIn("error", ok)
+        self.assertIn("HTTP 400", bad["error"])
+        self.assertIsNone(bad["cost"])
+
+    def test_sessions_are_separate(self):
+        a, b = self.agent(), self.agent()
+        self.assertNotEqual(a.session, b.session)
+        a.turn("hi")
+        self.assertEqual(len(usage.load(session=a.session)), 1)
+        self.assertEqual(usage.load(session=b.session), [])
+
+    def test_replay_not_recorded(self):
+        ag = self.agent()
+        with ag.active():
+            ag.replay_dir = self.tmp
+            chalilulz._ledger("groq", "mock", {"usage": {"prompt_tokens": 5}})
+        self.assertFalse(chalilulz._ledger_path().exists())
+
+
+class TestCost(unittest.TestCase):
+    def test_price_table(self):
+        u = {"prompt_tokens": 1000, "completion_tokens": 500, "prompt_tokens_details": {"cached_tokens": 400}}
+        with patch.dict(chalilulz.PRICES, {"groq:m": (1.0, 4.0, 0.5)}):
+            self.assertAlmostEqual(chalilulz._cost("groq", "m", u), (600 * 1 + 400 * 0.5 + 500 * 4) / 1e6)
+        self.assertEqual(chalilulz._cost("ollama", "llama3", u), 0)
+        self.assertEqual(chalilulz._cost("openrouter", "x/y:free", u), 0)
+        self.assertEqual(chalilulz._cost("openrouter", "x/y", dict(u, cost=0.25)), 0.25)
+
+    def test_unknown_price(self):
+        with patch("chalilulz.get_caps", return_value={}):
+            self.assertIsNone(chalilulz._cost("groq", "nope", {"prompt_tokens": 1}))
+        with patch("chalilulz.get_caps", return_value={"price": [3.0, 15.0]}):
+            self.assertAlmostEqual(chalilulz._cost("openrouter", "a/b", {"prompt_tokens": 10**6}), 3.0)
+
+    def test_cached_tokens(self):
+        self.assertEqual(chalilulz._cached_tokens({"prompt_cache_hit_tokens": 7}), 7)
+        self.assertEqual(chalilulz._cached_tokens({}), 0)
+
+
+class TestReport(DataDirCase):
+    def setUp(self):
+        super().setUp()
+        self.data.mkdir()
+        day = 86400
+        now = time.time()
+        rows = [
+            {"ts": now - 2 * day, "session": "s1", "provider": "groq", "model": "a",
+             "prompt_tokens": 100, "completion_tokens": 10, "cached_tokens": 0, "ttft": 0.2, "total": 1.0, "cost": 0.01},
+            {"ts": now, "session": "s2", "provider": "groq", "model": "a",
+             "prompt_tokens": 200, "completion_tokens": 20, "cached_tokens": 50, "ttft": 0.4, "total": 2.0, "cost": 0.02},
+            {"ts": now, "session": "s2", "provider": "ollama", "model": "b",
+             "prompt_tokens": None, "completion_tokens": None, "cached_tokens": 0, "cost": None, "error": "boom"},
+        ]
+        with open(chalilulz._ledger_path(), "w") as f:
+            f.write("".join(json.dumps(r) + "\n" for r in rows) + '{"torn')
+
+    def test_rollup_by_model(self):
+        g = {x["model"]: x for x in usage.rollup(usage.load(), "model")}
+        self.assertEqual(g["groq:a"]["requests"], 2)
+        self.assertEqual(g["groq:a"]["prompt_tokens"], 300)
+        self.assertEqual(g["groq:a"]["cached_tokens"], 50)
+        self.assertAlmostEqual(g["groq:a"]["cost"], 0.03)
+        self.assertAlmostEqual(g["groq:a"]["ttft"], 0.3)
+        self.assertEqual((g["ollama:b"]["errors"], g["ollama:b"]["unpriced"]), (1, 0))
+
+    def test_unpriced_cost_is_unknown(self):
+        rows = usage.load() + [{"provider": "mistral", "model": "c", "prompt_tokens": 5, "cost": None}]
+        groups = usage.rollup(rows, "model")
+        self.assertIsNone(groups[-1]["cost"])
+        out = io.StringIO()
+        usage.table(groups, "model", out)
+        self.assertRegex(out.getvalue(), r"mistral:c .* unknown ")
+        self.assertRegex(out.getvalue(), r"total .* 0\.0300\+")
+        # with some priced requests the sum is a lower bound
+        g = usage.rollup(rows + [{"provider": "groq", "model": "a", "cost": None}], "model")[0]
+        self.assertEqual((round(g["cost"], 4), g["unpriced"]), (0.03, 1))
+
+    def test_filters_and_day(self):
+        self.assertEqual(len(usage.load(since=time.time() - 3600)), 2)
+        self.assertEqual(len(usage.load(session="s1")), 1)
+        days = usage.rollup(usage.load(), "day")
+        self.assertEqual([d["requests"] for d in days], [1, 2])
+
+    def test_main(self):
+        out = io.StringIO()
+        with patch("sys.stdout", out):
+            self.assertEqual(usage.main(["--by", "session", "--json"]), 0)
+        self.assertEqual([g["session"] for g in json.loads(out.getvalue())], ["s1", "s2"])
+        out = io.StringIO()
+        with patch("sys.stdout", out):
+            usage.main(["--by", "model"])
+        self.assertIn("groq:a", out.getvalue())
+        self.assertIn("total", out.getvalue())
+
+
+if __name__ == "__main__":
+    unittest.main()